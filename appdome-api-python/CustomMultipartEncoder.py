@@ -1,18 +1,113 @@
+import io
 import os
 from uuid import uuid4
 
+DEFAULT_CHUNK_SIZE = 64 * 1024
+
 
 class CustomMultipartEncoder:
-    def __init__(self, fields, boundary=None, encoding='utf-8'):
+    """
+    Streaming multipart/form-data body.
+
+    fields maps a field name to a value, or to a (filename, content, content_type) tuple for a file part.
+    File content can be bytes, str, a path (os.PathLike) or an open binary file. The size of a file that cannot
+    seek cheaply (e.g. a zip member) is given as a 4th item: (filename, file, content_type, size). Parts are produced lazily,
+    so the encoder can be passed as request data and file parts are streamed from disk as the body is sent.
+    Its length is known up front, so the request is sent with a Content-Length header.
+    It can be rewound with seek(0) to be sent again, e.g. by a retry, when its open files can seek.
+    """
+    def __init__(self, fields, boundary=None, encoding='utf-8', chunk_size=DEFAULT_CHUNK_SIZE):
         self.boundary_value = boundary or uuid4().hex
         self.boundary = f'--{self.boundary_value}'
         self.encoding = encoding
         self.fields = fields
+        self.chunk_size = chunk_size
+        self._segments = self._build_segments()
+        self.len = sum(self._segment_length(segment) for segment in self._segments)
+        self._chunks = None
+        self._buffer = b''
+        self._position = 0
+
+    def __len__(self):
+        return self.len
+
+    def __iter__(self):
+        for segment in self._segments:
+            if isinstance(segment, bytes):
+                view = memoryview(segment)
+                for offset in range(0, len(view), self.chunk_size):
+                    yield bytes(view[offset:offset + self.chunk_size])
+            else:
+                yield from self._iter_file(*segment)
+
+    def read(self, size=-1):
+        if self._chunks is None:
+            self._chunks = iter(self)
+        if size is None or size < 0:
+            data, self._buffer = self._buffer + b''.join(self._chunks), b''
+            self._position += len(data)
+            return data
+        chunks = [self._buffer]
+        buffered = len(self._buffer)
+        while buffered < size:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                break
+            chunks.append(chunk)
+            buffered += len(chunk)
+        data = b''.join(chunks)
+        data, self._buffer = data[:size], data[size:]
+        self._position += len(data)
+        return data
+
+    def tell(self):
+        return self._position
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        """
+        Rewind the body to its start. Other positions are not supported.
+        """
+        if offset != 0 or whence != os.SEEK_SET:
+            raise io.UnsupportedOperation('The body can only be rewound to its start')
+        for segment in self._segments:
+            if not isinstance(segment, bytes) and not isinstance(segment[0], os.PathLike):
+                file_obj, _, start = segment
+                if start is None:
+                    raise io.UnsupportedOperation(f'File part {file_obj} can not seek')
+                file_obj.seek(start)
+        self._chunks = None
         self._buffer = b''
+        self._position = 0
+        return 0
 
-    def _encode_field(self, name, value, filename=None, content_type=None):
-        part = []
-        part.append(f'{self.boundary}\r\n')
+    def to_string(self):
+        return b''.join(self)
+
+    @property
+    def content_type(self):
+        return f'multipart/form-data; boundary={self.boundary_value}'
+
+    def _build_segments(self):
+        segments = []
+        for name, value in self.fields.items():
+            if isinstance(value, tuple):
+                filename, file_content, content_type = value[:3]
+                segments.append(self._encode_header(name, filename, content_type))
+                if len(value) > 3:
+                    segments.append((file_content, value[3], self._start_position(file_content)))
+                else:
+                    segments.append(self._content_segment(file_content))
+            else:
+                segments.append(self._encode_header(name))
+                segments.append(self._content_segment(value))
+            segments.append(b'\r\n')
+
+        # Closing boundary
+        segments.append(f'{self.boundary}--\r\n'.encode(self.encoding))
+        return segments
+
+    def _encode_header(self, name, filename=None, content_type=None):
+        part = [f'{self.boundary}\r\n']
         if filename:
             part.append(f'Content-Disposition: form-data; name="{name}"; filename="{filename}"\r\n')
         else:
@@ -22,36 +117,56 @@ class CustomMultipartEncoder:
             part.append(f'Content-Type: {content_type}\r\n')
 
         part.append('\r\n')
-        if isinstance(value, bytes):
-            part.append(value.decode(self.encoding))
-        else:
-            part.append(str(value))
-        part.append('\r\n')
-
         return ''.join(part).encode(self.encoding)
 
-    def _encode_file_field(self, name, file_path, content_type):
-        with open(file_path, 'rb') as f:
-            file_content = f.read()
-        filename = os.path.basename(file_path)
-        return self._encode_field(name, file_content, filename, content_type)
-
-    def to_string(self):
-        encoded = []
+    def _content_segment(self, value):
+        """
+        :return: bytes, or a (path or file object, size, start position) tuple for content read when the body is sent
+        """
+        if isinstance(value, bytes):
+            return value
+        if isinstance(value, (bytearray, memoryview)):
+            return bytes(value)
+        if isinstance(value, os.PathLike):
+            return value, os.path.getsize(value), 0
+        if hasattr(value, 'read'):
+            return value, self._remaining_file_size(value), self._start_position(value)
+        return str(value).encode(self.encoding)
 
-        # Iterate through fields and encode them
-        for name, value in self.fields.items():
-            if isinstance(value, tuple):
-                filename, file_content, content_type = value
-                encoded.append(self._encode_field(name, file_content, filename, content_type))
-            else:
-                encoded.append(self._encode_field(name, value))
+    @staticmethod
+    def _remaining_file_size(file_obj):
+        position = file_obj.tell()
+        try:
+            return os.fstat(file_obj.fileno()).st_size - position
+        except (AttributeError, OSError, ValueError):
+            end = file_obj.seek(0, os.SEEK_END)
+            file_obj.seek(position)
+            return end - position
 
-        # Closing boundary
-        encoded.append(f'{self.boundary}--\r\n'.encode(self.encoding))
+    @staticmethod
+    def _start_position(file_obj):
+        """
+        :return: Position to rewind the file to, or None when it can't seek
+        """
+        try:
+            return file_obj.tell() if file_obj.seekable() else None
+        except (AttributeError, OSError, ValueError):
+            return None
 
-        return b''.join(encoded)
+    @staticmethod
+    def _segment_length(segment):
+        return len(segment) if isinstance(segment, bytes) else segment[1]
 
-    @property
-    def content_type(self):
-        return f'multipart/form-data; boundary={self.boundary_value}'
\ No newline at end of file
+    def _iter_file(self, source, size, start=None):
+        file_obj = open(source, 'rb') if isinstance(source, os.PathLike) else source
+        try:
+            remaining = size
+            while remaining > 0:
+                chunk = file_obj.read(min(self.chunk_size, remaining))
+                if not chunk:
+                    raise IOError(f'File part ended {remaining} bytes before its expected size')
+                remaining -= len(chunk)
+                yield chunk
+        finally:
+            if file_obj is not source:
+                file_obj.close()
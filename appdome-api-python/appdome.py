@@ -0,0 +1,55 @@
+import sys
+from importlib import import_module
+
+# Subcommand: (module, description). Modules are imported only when their subcommand runs, so short commands
+# like status and download don't pay for importing the whole flow.
+SUBCOMMANDS = {
+    'run': ('appdome_api', 'Whole flow of a task from upload to download'),
+    'sdk': ('appdome_api_sdk', 'Whole flow of an SDK task from upload to download'),
+    'batch': ('batch', 'Whole flow of many apps at once'),
+    'worker': ('worker', 'Run whole flow jobs submitted over a local socket'),
+    'upload': ('upload', 'Upload an app'),
+    'build': ('build', 'Build an uploaded app'),
+    'build-to-test': ('build_to_test', 'Build an uploaded app for automation testing'),
+    'context': ('context', 'Context an app after build'),
+    'sign': ('sign', 'Sign an app on Appdome'),
+    'private-sign': ('private_sign', 'Prepare an app for private signing'),
+    'auto-dev-sign': ('auto_dev_sign', 'Prepare an app for auto-dev private signing'),
+    'status': ('status', 'Get or wait for the status of a task'),
+    'download': ('download', 'Download the output of a task'),
+    'certificate': ('certified_secure', 'Download the Certified Secure pdf file of a task'),
+    'certificate-json': ('certified_secure_json', 'Download the Certified Secure json file of a task'),
+    'validate': ('validate', 'Validate an app after local signing'),
+    'release-fs': ('release_fusion_set', 'Release a fusion set'),
+    'upload-mapping': ('upload_mapping_file', 'Upload a deobfuscation mapping file to Crashlytics or DataDog'),
+    'mock-server': ('mock_server', 'Run a local mock Appdome server'),
+    'benchmark': ('benchmark', 'Benchmark the whole flow or the import times of the subcommands'),
+}
+
+
+def print_usage(file=sys.stdout):
+    print("usage: appdome <command> [arguments]\n\ncommands:", file=file)
+    for name, (_, description) in SUBCOMMANDS.items():
+        print(f"  {name:<18}{description}", file=file)
+    print("\nRun 'appdome <command> --help' for the arguments of a command.", file=file)
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if not argv or argv[0] in ('-h', '--help'):
+        print_usage()
+        return
+    name, command_args = argv[0], argv[1:]
+    if name not in SUBCOMMANDS:
+        print(f"appdome: unknown command '{name}'\n", file=sys.stderr)
+        print_usage(sys.stderr)
+        sys.exit(2)
+
+    module = import_module(SUBCOMMANDS[name][0])
+    # The subcommand parses sys.argv like when run as its own script
+    sys.argv = [f"appdome {name}"] + command_args
+    module.main()
+
+
+if __name__ == '__main__':
+    main()
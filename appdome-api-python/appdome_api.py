@@ -1,11 +1,14 @@
 import argparse
 import logging
+import re
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
 from enum import Enum
+from itertools import product
 from os import getenv
-from os.path import splitext
-from build_to_test import BuildToTestVendors, build_to_test, init_automation_vendor
+from os.path import splitext, basename
+from build_to_test import BuildToTestVendors, init_automation_vendor
 from auto_dev_sign import auto_dev_sign_android, auto_dev_sign_ios
-from build import build
 from certified_secure import download_certified_secure
 from certified_secure_json import download_certified_secure_json, format_json_file
 from context import context
@@ -13,11 +16,31 @@ from download import download, download_action
 from private_sign import private_sign_android, private_sign_ios
 from sign import sign_android, sign_ios
 from status import wait_for_status_complete
-from upload import upload
+from workflow_log import add_workflow_log_args, init_workflow_log
+from metrics import phase, collect, submit_in_context, add_metrics_args, write_metrics
+from polling import add_polling_args, init_polling_strategy
+from upload import add_multipart_upload_args, validate_multipart_upload_args, add_upload_cache_args, init_upload_cache
+from multipart_upload import MB
 from utils import (validate_response, log_and_exit, add_common_args, init_common_args, validate_output_path,
-                   init_overrides, init_baseline_file, init_certs_pinning)
+                   init_overrides, file_sha256)
 from status import _get_obfuscation_map_status
-from upload_mapping_file import upload_mapping_file
+from build_cache import add_build_cache_args, init_build_cache, build_cache_key, get_cached_task_id
+from checkpoint import add_checkpoint_args, validate_checkpoint_args, init_checkpoint
+from pipeline_phases import run_upload, run_build, download_task_file
+
+
+DEFAULT_DOWNLOAD_WORKERS = 4
+DEFAULT_VARIANT_CONCURRENCY = 4
+# Per variant copies of these output paths are written when building several fusion sets or vendors
+VARIANT_OUTPUT_ARGS = ('output', 'sign_second_output', 'deobfuscation_script_output', 'certificate_output',
+                       'certificate_json', 'metrics_json', 'metrics_prometheus', 'checkpoint')
+# Long names of the create_parser arguments that are flags, and of those taking several values, for manifests that
+# hold arguments as text (batch.py CSV manifests). Keep them in sync with create_parser
+FLAG_ARGS = ('sign_on_appdome', 'private_signing', 'auto_dev_private_signing', 'diagnostic_logs', 'google_play_signing',
+             'multipart_upload', 'upload_cache', 'verify_upload_cache', 'build_cache', 'verify_build_cache',
+             'refresh_build_cache', 'clear_build_cache', 'resume', 'workflow_logs_compress', 'workflow_logs_quiet',
+             'verbose')
+LIST_ARGS = ('fusion_set_id', 'build_to_test_vendor', 'provisioning_profiles', 'entitlements')
 
 
 class Platform(Enum):
@@ -26,16 +49,20 @@ class Platform(Enum):
     IOS = 2
 
 
-def parse_arguments():
-    parser = argparse.ArgumentParser(description='Runs Appdome API commands')
+def create_parser(parser_class=argparse.ArgumentParser):
+    """
+    :param parser_class: argparse.ArgumentParser or a subclass, e.g. one raising on errors instead of exiting
+    """
+    parser = parser_class(description='Runs Appdome API commands')
     upload_group = parser.add_mutually_exclusive_group(required=True)
     upload_group.add_argument('-a', '--app', metavar='application_file', help='Upload app file input path')
     upload_group.add_argument('--app_id', metavar='app_id_value', help='App id of previously uploaded app')
 
     add_common_args(parser)
 
-    parser.add_argument('-fs', '--fusion_set_id', metavar='fusion_set_id_value',
-                        help='Appdome Fusion Set id. '
+    parser.add_argument('-fs', '--fusion_set_id', nargs='+', metavar='fusion_set_id_value',
+                        help='Appdome Fusion Set id. Can be multiple ids, the app is uploaded once and built with '
+                             'each of them. '
                              'Default for Android is environment variable APPDOME_ANDROID_FS_ID. '
                              'Default for iOS is environment variable APPDOME_IOS_FS_ID')
     parser.add_argument('-bv', '--build_overrides', metavar='overrides_json_file',
@@ -52,6 +79,10 @@ def parse_arguments():
                         help='baseline profile file to use')
     parser.add_argument('-cert_zip', '--cert_pinning_zip', metavar='cert_pinning_zip',
                         help='Path to zip file containing dynamic certificates for certificate pinning')
+    add_multipart_upload_args(parser)
+    add_upload_cache_args(parser)
+    add_build_cache_args(parser)
+    add_polling_args(parser)
 
     sign_group = parser.add_mutually_exclusive_group(required=True)
     sign_group.add_argument('-s', '--sign_on_appdome', action='store_true', help='Sign on Appdome')
@@ -90,15 +121,29 @@ def parse_arguments():
                         help='Output file for Certified Secure pdf')
     parser.add_argument('-cj', '--certificate_json', metavar='certificate_json_output_file',
                         help='Output file for Certified Secure json')
-    parser.add_argument('-bt', '--build_to_test_vendor', metavar='build_to_test_vendor',
-                        help='Enter vendor name on which Build to Test will happen')
+    parser.add_argument('-bt', '--build_to_test_vendor', nargs='+', metavar='build_to_test_vendor',
+                        help='Enter vendor name on which Build to Test will happen. Can be multiple vendors, '
+                             'the app is built for each of them')
+    parser.add_argument('--variant_concurrency', type=int, default=DEFAULT_VARIANT_CONCURRENCY, metavar='variants',
+                        help='Max number of fusion set and vendor variants built at the same time. '
+                             f'Default is {DEFAULT_VARIANT_CONCURRENCY}')
     parser.add_argument('-wol', '--workflow_output_logs', metavar='workflow_output_logs',
                         help='Enter path to a workflow output logs file (optional)')
-    return parser.parse_args()
+    add_workflow_log_args(parser)
+    parser.add_argument('--download_workers', type=int, default=DEFAULT_DOWNLOAD_WORKERS, metavar='workers',
+                        help='Max number of outputs downloaded (and mapping files uploaded) at the same time. '
+                             f'Default is {DEFAULT_DOWNLOAD_WORKERS}')
+    add_metrics_args(parser)
+    add_checkpoint_args(parser)
+    return parser
+
+
+def parse_arguments(argv=None):
+    return create_parser().parse_args(argv)
 
 
 def validate_args(args):
-    fusion_set_id = args.fusion_set_id
+    fusion_set_ids = args.fusion_set_id
     platform = Platform.UNKNOWN
     init_common_args(args)
     if args.app:
@@ -118,9 +163,9 @@ def validate_args(args):
         else:
             log_and_exit(f"Please specify the correct platform signing credentials")
 
-    if not fusion_set_id:
-        fusion_set_id = getenv('APPDOME_IOS_FS_ID' if platform == Platform.IOS else 'APPDOME_ANDROID_FS_ID')
-        if not fusion_set_id:
+    if not fusion_set_ids:
+        fusion_set_ids = [getenv('APPDOME_IOS_FS_ID' if platform == Platform.IOS else 'APPDOME_ANDROID_FS_ID')]
+        if not fusion_set_ids[0]:
             log_and_exit(f"fusion_set_id must be specified or set though the correct platform environment variable")
 
     if args.private_signing or args.auto_dev_private_signing:
@@ -138,59 +183,41 @@ def validate_args(args):
         if args.google_play_signing and not args.signing_fingerprint:
             log_and_exit(f"Google signing fingerprint requires providing a signing fingerprint")
 
-    if args.build_to_test_vendor and not any(
-            args.build_to_test_vendor == vendor.value for vendor in BuildToTestVendors):
+    if args.build_to_test_vendor and not all(
+            any(build_to_test_vendor == vendor.value for vendor in BuildToTestVendors)
+            for build_to_test_vendor in args.build_to_test_vendor):
         log_and_exit(f"Vendor name provided for Build To Test isn't one of the acceptable vendors")
 
     if args.google_play_signing:
         if args.signing_fingerprint_upgrade and not args.signing_fingerprint:
             log_and_exit(f"Base Google signing fingerprint is required to upgrade the fingerprint")
 
+    validate_multipart_upload_args(args)
+    if args.download_workers < 1:
+        log_and_exit("download_workers must be at least 1")
+    if args.variant_concurrency < 1:
+        log_and_exit("variant_concurrency must be at least 1")
     validate_output_path(args.output)
     validate_output_path(args.certificate_output)
     validate_output_path(args.certificate_json)
-    return platform, fusion_set_id
-
-
-def _upload(api_key, team_id, app_path):
-    upload_response = upload(api_key, team_id, app_path)
-    validate_response(upload_response)
-    logging.info(f"Upload done. App-id: {upload_response.json()['id']}")
-    return upload_response.json()['id']
-
-
-def _build(api_key, team_id, app_id, fusion_set_id, build_overrides, use_diagnostic_logs, build_to_test_vendor,
-           workflow_output_logs=None, baseline_profile=None, cert_pinning_zip=None):
-    build_overrides_json = init_overrides(build_overrides)
-    files = init_certs_pinning(cert_pinning_zip)
-    init_baseline_file(baseline_profile, files)
-    if build_to_test_vendor:
-        automation_vendor = init_automation_vendor(build_to_test_vendor).name
-        build_response = build_to_test(api_key, team_id, app_id, fusion_set_id, automation_vendor,
-                                       overrides=build_overrides_json, use_diagnostic_logs=use_diagnostic_logs,
-                                       files=files)
-    else:
-        build_response = build(api_key, team_id, app_id, fusion_set_id, build_overrides_json, use_diagnostic_logs,
-                               files=files)
-    validate_response(build_response)
-    logging.info(f"Build request started. Response: {build_response.json()}")
-    task_id = build_response.json()['task_id']
-    wait_for_status_complete(api_key, team_id, task_id, operation="build",
-                             workflow_output_logs_path=workflow_output_logs)
-    logging.info(f"Build request finished.")
-    return task_id
+    validate_output_path(args.metrics_json)
+    validate_output_path(args.metrics_prometheus)
+    validate_checkpoint_args(args)
+    return platform, fusion_set_ids
 
 
-def _context(api_key, team_id, task_id, workflow_output_logs=None):
+@phase('context')
+def _context(api_key, team_id, task_id, workflow_output_logs=None, polling_strategy=None):
     context_response = context(api_key, team_id, task_id)
     validate_response(context_response)
     logging.info(f"Context request started. Response: {context_response.json()}")
     wait_for_status_complete(api_key, team_id, task_id, operation="context",
-                             workflow_output_logs_path=workflow_output_logs)
+                             workflow_output_logs_path=workflow_output_logs, polling_strategy=polling_strategy)
     logging.info(f"Context request finished.")
 
 
-def _sign(args, platform, task_id, sign_overrides, workflow_output_logs=None):
+@phase('sign')
+def _sign(args, platform, task_id, sign_overrides, workflow_output_logs=None, polling_strategy=None):
     sign_overrides_json = init_overrides(sign_overrides)
     if platform == Platform.ANDROID:
         if args.sign_on_appdome:
@@ -217,45 +244,270 @@ def _sign(args, platform, task_id, sign_overrides, workflow_output_logs=None):
     validate_response(r)
     logging.info(f"Signing request started. Response: {r.json()}")
     wait_for_status_complete(args.api_key, args.team_id, task_id, operation="sign",
-                             workflow_output_logs_path=workflow_output_logs)
+                             workflow_output_logs_path=workflow_output_logs, polling_strategy=polling_strategy)
     logging.info(f"Signing request finished.")
 
 
-def _download_file(api_key, team_id, task_id, output_path, download_func):
-    download_response = download_func(api_key, team_id, task_id)
-    validate_response(download_response)
-    with open(output_path, 'wb') as f:
-        f.write(download_response.content)
-    logging.info(f"File written to {output_path}")
+def run_pipeline(args):
+    """
+    Run the whole flow from upload to download for parsed appdome_api arguments.
+
+    With several fusion sets and/or build to test vendors, the app is uploaded once and every variant is built,
+    signed and downloaded concurrently, to per variant output paths.
+
+    :return: Task id of the build, or task ids by variant name when building several variants
+    """
+    platform, fusion_set_ids = validate_args(args)
+    variants = pipeline_variants(fusion_set_ids, args.build_to_test_vendor)
+    if len(variants) == 1:
+        fusion_set_id, vendor = variants[0]
+        return _collect_pipeline(variant_arguments(args, fusion_set_id, vendor), platform, fusion_set_id)
+    return _run_matrix(args, platform, variants)
+
+
+def pipeline_variants(fusion_set_ids, build_to_test_vendors=None):
+    """
+    :return: List of (fusion set id, build to test vendor or None) of every combination, without duplicates
+    """
+    return list(product(dict.fromkeys(fusion_set_ids), dict.fromkeys(build_to_test_vendors or [None])))
+
+
+def variant_name(fusion_set_id, vendor=None):
+    name = f"{fusion_set_id}_{vendor}" if vendor else fusion_set_id
+    return re.sub(r'[^\w.-]', '_', name)
+
+
+def variant_output_path(path, fusion_set_id, vendor=None):
+    """
+    :return: '<stem>_<fusion set id>[_<vendor>]<ext>' of an output path
+    """
+    if not path:
+        return path
+    stem, ext = splitext(path)
+    return f"{stem}_{variant_name(fusion_set_id, vendor)}{ext}"
+
+
+def variant_arguments(args, fusion_set_id, vendor, app_id=None, per_variant_outputs=False):
+    """
+    :return: Copy of the arguments building one fusion set and vendor, from app_id when given
+    """
+    variant_args = argparse.Namespace(**vars(args))
+    variant_args.fusion_set_id = fusion_set_id
+    variant_args.build_to_test_vendor = vendor
+    if app_id:
+        variant_args.app = None
+        variant_args.app_id = app_id
+    if per_variant_outputs:
+        for arg in VARIANT_OUTPUT_ARGS:
+            setattr(variant_args, arg, variant_output_path(getattr(args, arg), fusion_set_id, vendor))
+    return variant_args
+
+
+def _app_label(args):
+    return basename(args.app) if args.app else args.app_id
+
+
+def _collect_pipeline(args, platform, fusion_set_id, app_label=None):
+    labels = {'app': app_label or _app_label(args), 'fusion_set_id': fusion_set_id}
+    if args.build_to_test_vendor:
+        labels['build_to_test_vendor'] = args.build_to_test_vendor
+    with collect(labels) as pipeline_metrics:
+        try:
+            return _run_pipeline(args, platform, fusion_set_id)
+        finally:
+            write_metrics(args, pipeline_metrics)
+
+
+def _run_matrix(args, platform, variants):
+    """
+    Upload the app once, then run the build to download flow of the variants concurrently, up to
+    --variant_concurrency at a time. Every variant is attempted, and the errors of all failed variants are reported together.
+    """
+    fusion_set_ids = ','.join(dict.fromkeys(fusion_set_id for fusion_set_id, _ in variants))
+    with collect({'app': _app_label(args), 'fusion_set_id': fusion_set_ids}) as upload_metrics:
+        try:
+            # The checkpoint of the matrix holds the upload, each variant has its own
+            checkpoint = init_checkpoint(args, fusion_set_ids)
+            app_hash = file_sha256(args.app) if args.app and args.upload_cache else None
+            app_id = checkpoint.run_phase('upload', lambda: _upload_app(args, init_polling_strategy(args), app_hash),
+                                          key='app_id')
+        finally:
+            write_metrics(args, upload_metrics)
+
+    logging.info(f"Building {len(variants)} variants of app-id {app_id}")
+    max_workers = min(len(variants), args.variant_concurrency)
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='variant') as executor:
+        futures = {variant_name(fusion_set_id, vendor): submit_in_context(
+            executor, _collect_pipeline, variant_arguments(args, fusion_set_id, vendor, app_id, True), platform,
+            fusion_set_id, _app_label(args)) for fusion_set_id, vendor in variants}
+    errors = {}
+    for name, future in futures.items():
+        if future.exception():
+            errors[name] = future.exception()
+            logging.error(f"Variant {name} failed. Error: {future.exception()}")
+    if errors:
+        log_and_exit("Failed variants: " + "; ".join(f"{name}: {error}" for name, error in errors.items()))
+    return {name: future.result() for name, future in futures.items()}
+
+
+def _upload_app(args, polling_strategy, app_hash=None):
+    if not args.app:
+        return args.app_id
+    return run_upload(args.api_key, args.team_id, args.app, args.multipart_upload, args.upload_part_size * MB,
+                      args.upload_concurrency, polling_strategy, init_upload_cache(args), args.verify_upload_cache,
+                      app_hash)
+
+
+def _signing_inputs(args, platform):
+    """
+    :return: Signing configuration of a pipeline without its passwords. Files are identified by their SHA-256
+    """
+    if args.sign_on_appdome:
+        sign_mode = 'sign_on_appdome'
+    elif args.private_signing:
+        sign_mode = 'private_signing'
+    else:
+        sign_mode = 'auto_dev_private_signing'
+    return {
+        'platform': platform.name,
+        'sign_mode': sign_mode,
+        'sign_overrides': init_overrides(args.sign_overrides),
+        'keystore': file_sha256(args.keystore) if args.keystore else None,
+        'keystore_alias': args.keystore_alias,
+        'signing_fingerprint': args.signing_fingerprint,
+        'signing_fingerprint_upgrade': args.signing_fingerprint_upgrade,
+        'google_play_signing': args.google_play_signing,
+        'provisioning_profiles': [file_sha256(path) for path in args.provisioning_profiles or []],
+        'entitlements': [file_sha256(path) for path in args.entitlements or []]
+    }
+
+
+def _build_cache_key(args, platform, app_id, fusion_set_id, app_hash):
+    automation_vendor = init_automation_vendor(args.build_to_test_vendor).name if args.build_to_test_vendor else None
+    return build_cache_key(args.team_id, app_id, fusion_set_id, init_overrides(args.build_overrides),
+                           args.diagnostic_logs, automation_vendor, app_hash, args.baseline_profile,
+                           args.cert_pinning_zip, _signing_inputs(args, platform))
+
+
+def _run_pipeline(args, platform, fusion_set_id):
+    polling_strategy = init_polling_strategy(args)
+    init_workflow_log(args)
+    build_cache = init_build_cache(args)
+    checkpoint = init_checkpoint(args, fusion_set_id)
+    app_hash = None
+    if args.app and (build_cache or args.upload_cache) and not checkpoint.phase_done('sign'):
+        app_hash = file_sha256(args.app)
+
+    app_id = checkpoint.run_phase('upload', lambda: _upload_app(args, polling_strategy, app_hash), key='app_id')
+
+    cache_key = None
+    if build_cache and not checkpoint.phase_done('sign'):
+        cache_key = _build_cache_key(args, platform, app_id, fusion_set_id, app_hash)
+    # Pipelines of the same cache key wait for each other, so a task is built and signed once and reused after
+    with build_cache.key_lock(cache_key) if cache_key else nullcontext():
+        task_id = None
+        if cache_key and not args.refresh_build_cache:
+            task_id = get_cached_task_id(args.api_key, args.team_id, build_cache, cache_key, args.verify_build_cache)
+        if task_id:
+            # The cached task is already signed with the same signing configuration
+            for name in ('build', 'context', 'sign'):
+                checkpoint.complete_phase(name, task_id=task_id)
+        else:
+            task_id = _build_and_sign(args, platform, app_id, fusion_set_id, checkpoint, polling_strategy)
+            if cache_key:
+                build_cache.put(cache_key, {'task_id': task_id, 'team_id': args.team_id,
+                                            'fusion_set_id': fusion_set_id})
 
+    _download_outputs(args, task_id, args.download_workers, checkpoint)
+    return task_id
 
-def main():
-    args = parse_arguments()
-    platform, fusion_set_id = validate_args(args)
 
-    app_id = _upload(args.api_key, args.team_id, args.app) if args.app else args.app_id
+def _build_and_sign(args, platform, app_id, fusion_set_id, checkpoint, polling_strategy):
+    task_id = checkpoint.run_phase('build', lambda: run_build(
+        args.api_key, args.team_id, app_id, fusion_set_id, args.build_overrides, args.diagnostic_logs,
+        args.build_to_test_vendor, args.workflow_output_logs, args.baseline_profile, args.cert_pinning_zip,
+        polling_strategy), key='task_id')
 
-    task_id = _build(args.api_key, args.team_id, app_id, fusion_set_id, args.build_overrides, args.diagnostic_logs,
-                     args.build_to_test_vendor, args.workflow_output_logs, args.baseline_profile, args.cert_pinning_zip)
+    checkpoint.run_phase('context', lambda: _context(args.api_key, args.team_id, task_id, args.workflow_output_logs,
+                                                     polling_strategy))
 
-    _context(args.api_key, args.team_id, task_id, args.workflow_output_logs)
+    checkpoint.run_phase('sign', lambda: _sign(args, platform, task_id, args.sign_overrides,
+                                               args.workflow_output_logs, polling_strategy))
+    return task_id
 
-    _sign(args, platform, task_id, args.sign_overrides, args.workflow_output_logs)
 
+def _download_outputs(args, task_id, max_workers=DEFAULT_DOWNLOAD_WORKERS, checkpoint=None):
+    """
+    Download all requested outputs of a signed task concurrently.
+    Every output is attempted, and the errors of all failed outputs are reported together.
+    Outputs recorded in the checkpoint that are still on disk unchanged are not downloaded again.
+    """
+    api_key, team_id = args.api_key, args.team_id
+    download_tasks = {}
     if args.output:
-        _download_file(args.api_key, args.team_id, task_id, args.output, download)
-    if _get_obfuscation_map_status(args.api_key, args.team_id, task_id):
-        download_action(args.api_key, args.team_id, task_id, args.deobfuscation_script_output, 'deobfuscation_script')
-        if args.deobfuscation_script_output and (args.datadog_api_key or args.firebase_app_id):
-            upload_mapping_file(deobfuscation_mapping_file=args.deobfuscation_script_output,
-                                fire_base_app_id=args.firebase_app_id, data_dog_api_key=args.datadog_api_key)
-    if not args.auto_dev_private_signing:
-        download_action(args.api_key, args.team_id, task_id, args.sign_second_output, 'sign_second_output')
+        download_tasks['output'] = (args.output,
+                                    lambda: download_task_file(api_key, team_id, task_id, args.output, download))
+    if args.deobfuscation_script_output:
+        download_tasks['deobfuscation_script'] = (args.deobfuscation_script_output,
+                                                  lambda: _download_deobfuscation_script(args, task_id))
+    if args.sign_second_output and not args.auto_dev_private_signing:
+        download_tasks['sign_second_output'] = (args.sign_second_output,
+                                                lambda: download_action(api_key, team_id, task_id,
+                                                                        args.sign_second_output, 'sign_second_output'))
     if args.certificate_output:
-        _download_file(args.api_key, args.team_id, task_id, args.certificate_output, download_certified_secure)
+        download_tasks['certificate_output'] = (args.certificate_output,
+                                                lambda: download_task_file(api_key, team_id, task_id,
+                                                                           args.certificate_output,
+                                                                           download_certified_secure))
     if args.certificate_json:
-        _download_file(args.api_key, args.team_id, task_id, args.certificate_json, download_certified_secure_json)
-        format_json_file(args.certificate_json)
+        download_tasks['certificate_json'] = (args.certificate_json,
+                                              lambda: _download_certificate_json(api_key, team_id, task_id,
+                                                                                 args.certificate_json))
+    if checkpoint:
+        for name, (output_path, _) in list(download_tasks.items()):
+            if checkpoint.download_done(name, output_path):
+                logging.info(f"Skipping download of {name}, {output_path} is unchanged since checkpoint")
+                del download_tasks[name]
+    if not download_tasks:
+        return
+
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='download') as executor:
+        futures = {name: submit_in_context(executor, _download_phase, name, output_path, download_task, checkpoint)
+                   for name, (output_path, download_task) in download_tasks.items()}
+    errors = {}
+    for name, future in futures.items():
+        if future.exception():
+            errors[name] = future.exception()
+            logging.error(f"Failed to download {name}. Error: {future.exception()}")
+    if errors:
+        log_and_exit("Failed downloads: " + "; ".join(f"{name}: {error}" for name, error in errors.items()))
+
+
+def _download_phase(name, output_path, download_task, checkpoint=None):
+    with phase(f'download_{name}'):
+        download_task()
+    if checkpoint:
+        checkpoint.complete_download(name, output_path)
+
+
+def _download_deobfuscation_script(args, task_id):
+    if not _get_obfuscation_map_status(args.api_key, args.team_id, task_id):
+        return
+    download_action(args.api_key, args.team_id, task_id, args.deobfuscation_script_output, 'deobfuscation_script')
+    if args.datadog_api_key or args.firebase_app_id:
+        # Imported only when needed - it brings in the Crashlytics and DataDog clients
+        from upload_mapping_file import upload_mapping_file
+        upload_mapping_file(deobfuscation_mapping_file=args.deobfuscation_script_output,
+                            fire_base_app_id=args.firebase_app_id, data_dog_api_key=args.datadog_api_key)
+
+
+def _download_certificate_json(api_key, team_id, task_id, output_path):
+    download_task_file(api_key, team_id, task_id, output_path, download_certified_secure_json)
+    format_json_file(output_path)
+
+
+def main():
+    run_pipeline(parse_arguments())
 
 
 if __name__ == '__main__':
@@ -3,10 +3,12 @@ import logging
 from enum import Enum
 from os import getenv
 from os.path import splitext
-from appdome_api import _upload, _build, _download_file
+from pipeline_phases import run_upload, run_build, download_task_file
 from private_sign import private_sign_ios
 from sign import sign_ios
 from status import wait_for_status_complete
+from workflow_log import add_workflow_log_args, init_workflow_log
+from polling import add_polling_args, init_polling_strategy
 from certified_secure import download_certified_secure
 from certified_secure_json import download_certified_secure_json, format_json_file
 from download import download
@@ -52,6 +54,8 @@ def parse_arguments():
                         help='Output file for Certified Secure json')
     parser.add_argument('-wol', '--workflow_output_logs', metavar='workflow_output_logs',
                         help='Enter path to a workflow output logs file (optional)')
+    add_workflow_log_args(parser)
+    add_polling_args(parser)
     return parser.parse_args()
 
 
@@ -82,7 +86,7 @@ def validate_args(args):
     return platform, fusion_set_id
 
 
-def _sign(args, platform, task_id, workflow_output_logs=None):
+def _sign(args, platform, task_id, workflow_output_logs=None, polling_strategy=None):
     if platform == Platform.IOS:
         if args.keystore:
             r = sign_ios(args.api_key, args.team_id, task_id, args.keystore, args.keystore_pass,
@@ -92,23 +96,27 @@ def _sign(args, platform, task_id, workflow_output_logs=None):
         validate_response(r)
         logging.info(f"Signing request started. Response: {r.json()}")
         wait_for_status_complete(args.api_key, args.team_id, task_id, operation="sign",
-                                 workflow_output_logs_path=workflow_output_logs)
+                                 workflow_output_logs_path=workflow_output_logs, polling_strategy=polling_strategy)
         logging.info(f"Signing request finished.")
 
 
 def main():
     args = parse_arguments()
     platform, fusion_set_id = validate_args(args)
-    app_id = _upload(args.api_key, args.team_id, args.app) if args.app else args.app_id
-    task_id = _build(args.api_key, args.team_id, app_id, fusion_set_id, args.build_overrides, args.diagnostic_logs,
-                     None, args.workflow_output_logs)
-    _sign(args, platform, task_id, args.workflow_output_logs)
+    polling_strategy = init_polling_strategy(args)
+    init_workflow_log(args)
+    app_id = run_upload(args.api_key, args.team_id, args.app,
+                        polling_strategy=polling_strategy) if args.app else args.app_id
+    task_id = run_build(args.api_key, args.team_id, app_id, fusion_set_id, args.build_overrides,
+                        args.diagnostic_logs, None, args.workflow_output_logs, polling_strategy=polling_strategy)
+    _sign(args, platform, task_id, args.workflow_output_logs, polling_strategy)
     if args.output:
-        _download_file(args.api_key, args.team_id, task_id, args.output, download)
+        download_task_file(args.api_key, args.team_id, task_id, args.output, download)
     if args.certificate_output:
-        _download_file(args.api_key, args.team_id, task_id, args.certificate_output, download_certified_secure)
+        download_task_file(args.api_key, args.team_id, task_id, args.certificate_output, download_certified_secure)
     if args.certificate_json:
-        _download_file(args.api_key, args.team_id, task_id, args.certificate_json, download_certified_secure_json)
+        download_task_file(args.api_key, args.team_id, task_id, args.certificate_json,
+                           download_certified_secure_json)
         format_json_file(args.certificate_json)
 
 
@@ -0,0 +1,108 @@
+# asyncio mirrors of the upload, build, context, sign, status and download functions.
+# They run the sync functions on an executor over the shared pooled session, while waiting for a task is done by a
+# status watcher thread, so one event loop can drive many pipelines without a thread per waiting task.
+# Use set_executor() to size the pool of requests and file transfers in flight.
+import asyncio
+import contextvars
+import functools
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from os.path import basename
+
+import auto_dev_sign
+import build as build_module
+import build_to_test as build_to_test_module
+import context as context_module
+import download as download_module
+import private_sign
+import sign
+import status as status_module
+import upload as upload_module
+from multipart_upload import DEFAULT_PART_SIZE, DEFAULT_CONCURRENCY
+from status_watcher import StatusWatcher
+from utils import TASKS_URL, UPLOAD_URL, validate_response
+
+_executor = None
+_status_watcher = None
+_status_watcher_lock = threading.Lock()
+
+
+def set_executor(executor=None, max_workers=None):
+    """
+    Run the blocking calls of the coroutines on executor, or on a new thread pool of max_workers threads, instead of
+    the event loop's default executor (which has at most 32 threads). Call with no arguments to use the default
+    executor again.
+
+    :return: The executor used
+    """
+    global _executor
+    if executor is None and max_workers:
+        executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='async-api')
+    _executor = executor
+    return executor
+
+
+async def run_blocking(func, *args, **kwargs):
+    """
+    Run a blocking function on the executor of set_executor(), or the event loop's default executor, in a copy of
+    the current context.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor,
+                                      functools.partial(contextvars.copy_context().run, func, *args, **kwargs))
+
+
+def _to_async(func):
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        return await run_blocking(func, *args, **kwargs)
+    return wrapper
+
+
+build = _to_async(build_module.build)
+build_to_test = _to_async(build_to_test_module.build_to_test)
+context = _to_async(context_module.context)
+sign_android = _to_async(sign.sign_android)
+sign_ios = _to_async(sign.sign_ios)
+private_sign_android = _to_async(private_sign.private_sign_android)
+private_sign_ios = _to_async(private_sign.private_sign_ios)
+auto_dev_sign_android = _to_async(auto_dev_sign.auto_dev_sign_android)
+auto_dev_sign_ios = _to_async(auto_dev_sign.auto_dev_sign_ios)
+status = _to_async(status_module.status)
+download = _to_async(download_module.download)
+download_action = _to_async(download_module.download_action)
+
+
+async def upload(api_key, team_id, file_path, multipart=False, part_size=DEFAULT_PART_SIZE,
+                 concurrency=DEFAULT_CONCURRENCY, polling_strategy=None):
+    logging.info(f"Preparing to upload [{file_path}]")
+    file_id = await run_blocking(upload_module.upload_file, api_key, team_id, file_path, multipart, part_size,
+                                 concurrency)
+    app = await run_blocking(upload_module.upload_using_link, api_key, team_id, file_id, basename(file_path))
+    validate_response(app)
+    await wait_for_status_complete(api_key, team_id, app.json()['id'], url=UPLOAD_URL, operation="upload",
+                                   polling_strategy=polling_strategy)
+    return app
+
+
+async def wait_for_status_complete(api_key, team_id, task_id, url=TASKS_URL, interval_sec=10, timeout_sec=3600,
+                                   num_of_retries=3, operation=None, workflow_output_logs_path=None,
+                                   polling_strategy=None):
+    """
+    Wait for a task like status.wait_for_status_complete, through the status watcher set with
+    status.set_status_watcher() or one shared by the coroutines.
+    """
+    watcher = status_module.get_status_watcher() or _get_status_watcher()
+    await asyncio.wrap_future(watcher.watch(api_key, team_id, task_id, url=url, interval_sec=interval_sec,
+                                            timeout_sec=timeout_sec, num_of_retries=num_of_retries,
+                                            operation=operation, workflow_output_logs_path=workflow_output_logs_path,
+                                            polling_strategy=polling_strategy))
+
+
+def _get_status_watcher():
+    global _status_watcher
+    with _status_watcher_lock:
+        if _status_watcher is None:
+            _status_watcher = StatusWatcher(name='async-status-watcher')
+        return _status_watcher
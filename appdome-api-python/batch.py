@@ -0,0 +1,187 @@
+import argparse
+import csv
+import json
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from os import getenv
+from os.path import splitext
+
+from appdome_api import FLAG_ARGS, LIST_ARGS, parse_arguments as parse_pipeline_arguments, run_pipeline
+from status import set_status_watcher
+from status_watcher import StatusWatcher
+from utils import (add_common_args, init_common_args, log_and_exit, validate_output_path, init_session,
+                   API_POOL_SIZE_ENV, UPLOAD_POOL_SIZE_ENV, DEFAULT_POOL_SIZE)
+
+CSV_LIST_SEPARATOR = ';'
+CSV_TRUE_VALUES = ('true', 'yes', '1')
+CSV_FALSE_VALUES = ('false', 'no', '0', '')
+
+
+def load_manifest(manifest_path):
+    """
+    Load the apps to protect from a JSON, YAML or CSV manifest.
+
+    Each row holds appdome_api.py arguments by their long name, e.g. {"app": "app.apk", "sign_on_appdome": true}.
+    JSON and YAML manifests are a list of rows or an object with an "apps" list. In CSV manifests the header holds
+    the argument names, flags are true/false and multiple values (e.g. provisioning_profiles) are separated by ';'.
+
+    :param manifest_path: Path to the manifest file
+    :return: List of rows
+    """
+    ext = splitext(manifest_path)[-1].lower()
+    with open(manifest_path, newline='' if ext == '.csv' else None) as f:
+        if ext == '.json':
+            rows = json.load(f)
+        elif ext in ('.yaml', '.yml'):
+            try:
+                import yaml
+            except ImportError:
+                log_and_exit("YAML manifests require PyYAML. Install it with 'pip3 install pyyaml'")
+            rows = yaml.safe_load(f)
+        elif ext == '.csv':
+            rows = [_parse_csv_row(row) for row in csv.DictReader(f)]
+        else:
+            log_and_exit(f"Manifest extension [{ext}] must be .json, .yaml, .yml or .csv")
+
+    if isinstance(rows, dict):
+        rows = rows.get('apps')
+    if not isinstance(rows, list) or not all(isinstance(row, dict) for row in rows):
+        log_and_exit(f"Manifest [{manifest_path}] must contain a list of apps")
+    return rows
+
+
+def _parse_csv_row(row):
+    # Only flags are true/false and only arguments of many values are split, other values (e.g.
+    # upload_concurrency=1) are passed as they are
+    parsed = {}
+    for key, value in row.items():
+        value = (value or '').strip()
+        if key in FLAG_ARGS:
+            if value.lower() in CSV_TRUE_VALUES:
+                parsed[key] = True
+            elif value.lower() in CSV_FALSE_VALUES:
+                parsed[key] = False
+            else:
+                log_and_exit(f"Column [{key}] is a flag, its values must be true or false. Got [{value}]")
+        elif key in LIST_ARGS and CSV_LIST_SEPARATOR in value:
+            parsed[key] = [item.strip() for item in value.split(CSV_LIST_SEPARATOR)]
+        else:
+            parsed[key] = value
+    return parsed
+
+
+def row_to_argv(row):
+    """
+    Convert a manifest row to appdome_api.py command line arguments.
+    """
+    argv = []
+    for key, value in row.items():
+        if value is None or value is False or value == '':
+            continue
+        argv.append(f"--{key}")
+        if isinstance(value, (list, tuple)):
+            argv.extend(str(item) for item in value)
+        elif value is not True:
+            argv.append(str(value))
+    return argv
+
+
+def run_row(index, row, common_row):
+    """
+    Run the pipeline of one manifest row.
+
+    :return: Result entry of the batch report
+    """
+    row = {**common_row, **row}
+    result = {'index': index, 'app': row.get('app') or row.get('app_id'), 'fusion_set_id': row.get('fusion_set_id')}
+    start = time.time()
+    try:
+        args = parse_pipeline_arguments(row_to_argv(row))
+        result['task_id'] = run_pipeline(args)
+        result['status'] = 'completed'
+        logging.info(f"[{index}] {result['app']} completed")
+    except SystemExit as e:
+        # argparse exits on invalid arguments after printing the usage error
+        result['status'] = 'failed'
+        result['error'] = f"Invalid arguments (exit code {e.code})"
+        logging.error(f"[{index}] {result['app']} failed: {result['error']}")
+    except Exception as e:
+        result['status'] = 'failed'
+        result['error'] = str(e)
+        logging.error(f"[{index}] {result['app']} failed: {e}")
+    result['duration_sec'] = round(time.time() - start, 3)
+    result['outputs'] = {key: row[key] for key in ('output', 'sign_second_output', 'deobfuscation_script_output',
+                                                   'certificate_output', 'certificate_json') if row.get(key)}
+    return result
+
+
+def run_batch(manifest_path, concurrency, common_row=None):
+    """
+    Protect every app of the manifest, running up to concurrency pipelines at the same time.
+
+    :param manifest_path: Path to the JSON, YAML or CSV manifest
+    :param concurrency: Max number of concurrent pipelines
+    :param common_row: Arguments applied to every row, unless the row sets them
+    :return: Batch report
+    """
+    rows = load_manifest(manifest_path)
+    # Let every concurrent pipeline keep its connections alive
+    init_session(api_pool_size=max(concurrency, int(getenv(API_POOL_SIZE_ENV, DEFAULT_POOL_SIZE))),
+                 upload_pool_size=max(concurrency, int(getenv(UPLOAD_POOL_SIZE_ENV, DEFAULT_POOL_SIZE))))
+    logging.info(f"Running {len(rows)} pipelines from [{manifest_path}] with concurrency {concurrency}")
+
+    start = time.time()
+    # The tasks of all pipelines are polled by one watcher thread instead of a poll loop per pipeline
+    with StatusWatcher() as watcher:
+        set_status_watcher(watcher)
+        try:
+            with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='pipeline') as executor:
+                results = list(executor.map(lambda item: run_row(item[0], item[1], common_row or {}),
+                                            enumerate(rows)))
+        finally:
+            set_status_watcher(None)
+
+    completed = sum(1 for result in results if result['status'] == 'completed')
+    return {
+        'manifest': manifest_path,
+        'total': len(results),
+        'completed': completed,
+        'failed': len(results) - completed,
+        'duration_sec': round(time.time() - start, 3),
+        'results': results
+    }
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Runs the Appdome protection flow for every app of a manifest')
+    add_common_args(parser)
+    parser.add_argument('-m', '--manifest', required=True, metavar='manifest_file',
+                        help='JSON, YAML or CSV manifest. Each row holds appdome_api.py arguments by their long name')
+    parser.add_argument('-c', '--concurrency', type=int, default=4, metavar='concurrency',
+                        help='Max number of apps protected at the same time. Default is 4')
+    parser.add_argument('-r', '--report', metavar='report_json_file', help='Output file for the batch result report')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_arguments()
+    init_common_args(args)
+    if args.concurrency < 1:
+        log_and_exit("concurrency must be at least 1")
+    validate_output_path(args.report)
+
+    common_row = {'api_key': args.api_key, 'team_id': args.team_id, 'verbose': args.verbose}
+    report = run_batch(args.manifest, args.concurrency, common_row)
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump(report, f, indent=2)
+        logging.info(f"Batch report written to {args.report}")
+    logging.info(f"Batch done. {report['completed']} of {report['total']} apps completed "
+                 f"in {report['duration_sec']} seconds")
+    if report['failed']:
+        log_and_exit(f"{report['failed']} of {report['total']} apps failed")
+
+
+if __name__ == '__main__':
+    main()
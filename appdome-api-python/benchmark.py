@@ -0,0 +1,251 @@
+import argparse
+import json
+import logging
+import os
+import shlex
+import subprocess
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from os.path import abspath, dirname, join
+
+from appdome import SUBCOMMANDS
+
+from mock_server import MockAppdomeServer, MockServerConfig, MB, parse_task_durations
+from utils import log_and_exit, validate_output_path
+
+APPDOME_API_SCRIPT = join(dirname(abspath(__file__)), 'appdome_api.py')
+APPDOME_SCRIPT = join(dirname(abspath(__file__)), 'appdome.py')
+FILE_WRITE_CHUNK_SIZE = 4 * MB
+
+
+def create_app_file(path, size):
+    chunk = os.urandom(min(size, FILE_WRITE_CHUNK_SIZE)) if size else b''
+    with open(path, 'wb') as f:
+        remaining = size
+        while remaining > 0:
+            f.write(chunk[:remaining])
+            remaining -= len(chunk)
+
+
+def pipeline_command(app_path, output_path, poll_interval, pipeline_args):
+    return [sys.executable, APPDOME_API_SCRIPT, '--api_key', 'benchmark', '--team_id', 'benchmark',
+            '--app', app_path, '--fusion_set_id', 'benchmark', '--private_signing', '--signing_fingerprint', 'AA:BB',
+            '--output', output_path, '--polling_strategy', 'fixed', '--poll_interval', str(poll_interval),
+            *pipeline_args]
+
+
+def run_pipeline_process(command, env, log_path, result):
+    """
+    Run one pipeline process and record its wall time, exit code and peak resident memory.
+    """
+    start = time.monotonic()
+    with open(log_path, 'wb') as log_file:
+        process = subprocess.Popen(command, env=env, stdout=log_file, stderr=subprocess.STDOUT)
+        _, wait_status, rusage = os.wait4(process.pid, 0)
+    process.returncode = _exit_code(wait_status)
+    result['wall_sec'] = time.monotonic() - start
+    result['exit_code'] = process.returncode
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    result['peak_rss_mb'] = rusage.ru_maxrss / (MB if sys.platform == 'darwin' else 1024)
+
+
+def _exit_code(wait_status):
+    # os.waitstatus_to_exitcode is only in Python 3.9+
+    if hasattr(os, 'waitstatus_to_exitcode'):
+        return os.waitstatus_to_exitcode(wait_status)
+    return -os.WTERMSIG(wait_status) if os.WIFSIGNALED(wait_status) else os.WEXITSTATUS(wait_status)
+
+
+def run_scenario(server, workdir, artifact_size, concurrency, poll_interval, pipeline_args):
+    """
+    Run concurrency pipelines at the same time, uploading and downloading apps of artifact_size bytes.
+
+    :return: Scenario result
+    """
+    server.config.artifact_size = artifact_size
+    app_path = join(workdir, f"app_{artifact_size}.apk")
+    create_app_file(app_path, artifact_size)
+    env = dict(os.environ, APPDOME_SERVER_BASE_URL=server.base_url)
+    server.reset_stats()
+
+    results = [{} for _ in range(concurrency)]
+    threads = []
+    start = time.monotonic()
+    for index in range(concurrency):
+        output_path = join(workdir, f"output_{artifact_size}_{concurrency}_{index}.apk")
+        command = pipeline_command(app_path, output_path, poll_interval, pipeline_args)
+        log_path = join(workdir, f"pipeline_{artifact_size}_{concurrency}_{index}.log")
+        thread = threading.Thread(target=run_pipeline_process, args=(command, env, log_path, results[index]))
+        thread.start()
+        threads.append(thread)
+    for thread in threads:
+        thread.join()
+    wall_sec = time.monotonic() - start
+
+    stats = server.get_stats()
+    failed = [index for index, result in enumerate(results) if result['exit_code'] != 0]
+    for index in failed:
+        log_path = join(workdir, f"pipeline_{artifact_size}_{concurrency}_{index}.log")
+        logging.error(f"Pipeline {index} failed, see {log_path}")
+    return {
+        'artifact_size_mb': round(artifact_size / MB, 3),
+        'concurrency': concurrency,
+        'wall_sec': round(wall_sec, 3),
+        'mean_pipeline_sec': round(sum(result['wall_sec'] for result in results) / concurrency, 3),
+        'failed': len(failed),
+        'requests': stats['total_requests'],
+        'requests_per_pipeline': round(stats['total_requests'] / concurrency, 1),
+        'requests_by_endpoint': stats['requests'],
+        'bytes_uploaded': stats['bytes_received'],
+        'bytes_downloaded': stats['bytes_sent'],
+        'peak_rss_mb': round(max(result['peak_rss_mb'] for result in results), 1),
+        'throughput_mb_per_sec': round((stats['bytes_received'] + stats['bytes_sent']) / MB / wall_sec, 2)
+    }
+
+
+def run_benchmark(artifact_sizes_mb, concurrency_levels, config, poll_interval, pipeline_args, workdir=None):
+    """
+    Run the whole appdome_api.py flow against a local mock server for every artifact size and concurrency.
+
+    :param workdir: Parent of the temporary directory of the apps and outputs, created if missing
+    :return: List of scenario results
+    """
+    if workdir:
+        os.makedirs(workdir, exist_ok=True)
+    results = []
+    with MockAppdomeServer(config) as server, tempfile.TemporaryDirectory(dir=workdir) as tmpdir:
+        logging.info(f"Mock server listening on {server.base_url}")
+        for artifact_size_mb in artifact_sizes_mb:
+            for concurrency in concurrency_levels:
+                logging.info(f"Running {concurrency} pipelines with {artifact_size_mb} MB apps")
+                result = run_scenario(server, tmpdir, int(artifact_size_mb * MB), concurrency, poll_interval,
+                                      pipeline_args)
+                logging.info(f"{result['wall_sec']} sec, {result['requests']} requests, "
+                             f"peak RSS {result['peak_rss_mb']} MB, {result['failed']} failed")
+                results.append(result)
+    return results
+
+
+def module_import_ms(module):
+    """
+    Import module in a new interpreter with -X importtime.
+
+    :return: Cumulative import time of the module in milliseconds
+    """
+    process = subprocess.run([sys.executable, '-X', 'importtime', '-c', f"import {module}"],
+                             cwd=dirname(APPDOME_SCRIPT), capture_output=True, text=True, check=True)
+    for line in reversed(process.stderr.splitlines()):
+        # import time: self [us] | cumulative | imported package
+        fields = line.split('|')
+        if len(fields) == 3 and fields[2].strip() == module:
+            return int(fields[1]) / 1000
+    raise ValueError(f"No import time of {module} in -X importtime output")
+
+
+def command_startup_ms(command):
+    """
+    :return: Wall time of 'appdome <command> --help' in milliseconds, interpreter startup included
+    """
+    start = time.monotonic()
+    subprocess.run([sys.executable, APPDOME_SCRIPT, command, '--help'], stdout=subprocess.DEVNULL, check=True)
+    return (time.monotonic() - start) * 1000
+
+
+def run_import_benchmark(commands, repeat):
+    """
+    Measure the import time of every subcommand module and the startup time of the subcommand.
+
+    :return: List of results, with the median of repeat runs
+    """
+    results = []
+    for command in commands:
+        module = SUBCOMMANDS[command][0]
+        import_times = [module_import_ms(module) for _ in range(repeat)]
+        startup_times = [command_startup_ms(command) for _ in range(repeat)]
+        results.append({
+            'command': command,
+            'module': module,
+            'import_ms': round(statistics.median(import_times), 1),
+            'startup_ms': round(statistics.median(startup_times), 1)
+        })
+        logging.info(f"{command}: import {results[-1]['import_ms']} ms, startup {results[-1]['startup_ms']} ms")
+    return results
+
+
+def print_table(results, columns):
+    widths = [max([len(column)] + [len(str(result[column])) for result in results]) for column in columns]
+    print('  '.join(f"{column:>{width}}" for column, width in zip(columns, widths)))
+    for result in results:
+        print('  '.join(f"{result[column]:>{width}}" for column, width in zip(columns, widths)))
+
+
+def print_results(results):
+    columns = ('artifact_size_mb', 'concurrency', 'wall_sec', 'mean_pipeline_sec', 'requests_per_pipeline',
+               'peak_rss_mb', 'throughput_mb_per_sec', 'failed')
+    print_table(results, columns)
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Benchmark the whole appdome_api.py flow against a local mock server, '
+                                                 'or the import times of the appdome subcommands')
+    parser.add_argument('--artifact_sizes', type=float, nargs='+', default=[1, 16, 64], metavar='MB',
+                        help='Sizes of the uploaded and downloaded apps in MB. Default is 1 16 64')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 4, 8], metavar='pipelines',
+                        help='Numbers of pipelines run at the same time. Default is 1 4 8')
+    parser.add_argument('--task_duration', type=float, default=1, metavar='seconds',
+                        help='Seconds every mock task stays in progress. Default is 1')
+    parser.add_argument('--task_durations', type=parse_task_durations, default={}, metavar='durations',
+                        help='Per operation task durations, e.g. "build=5,sign=2"')
+    parser.add_argument('--latency', type=float, default=0, metavar='seconds',
+                        help='Delay the mock server adds to every request')
+    parser.add_argument('--poll_interval', type=float, default=0.5, metavar='seconds',
+                        help='Status poll interval of the pipelines. Default is 0.5')
+    parser.add_argument('--pipeline_args', default='', metavar='args',
+                        help='Extra appdome_api.py arguments, e.g. "--multipart_upload --download_workers 2"')
+    parser.add_argument('--import_times', action='store_true',
+                        help='Measure the import and startup times of the appdome subcommands instead of the flow')
+    parser.add_argument('--commands', nargs='+', choices=list(SUBCOMMANDS), default=list(SUBCOMMANDS),
+                        metavar='command', help='Subcommands measured with --import_times. Default is all')
+    parser.add_argument('--repeat', type=int, default=5, metavar='runs',
+                        help='Runs of every import time measurement, the median is reported. Default is 5')
+    parser.add_argument('--workdir', metavar='directory', help='Directory for the temporary apps and outputs, created if missing')
+    parser.add_argument('-r', '--report', metavar='report_json_file', help='Output file for the benchmark results')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_arguments()
+    logging.basicConfig(format='[%(asctime)s] [%(levelname)s] %(message)s', level=logging.INFO)
+    validate_output_path(args.report)
+    if args.import_times:
+        if args.repeat < 1:
+            log_and_exit("repeat must be at least 1")
+        results = run_import_benchmark(args.commands, args.repeat)
+        print_table(results, ('command', 'module', 'import_ms', 'startup_ms'))
+        write_report(args.report, results)
+        return
+
+    if not hasattr(os, 'wait4'):
+        log_and_exit("The benchmark measures peak memory with os.wait4, which is not available on this platform")
+    if min(args.concurrency) < 1:
+        log_and_exit("concurrency must be at least 1")
+    config = MockServerConfig(latency_sec=args.latency, default_task_duration_sec=args.task_duration,
+                              task_durations=args.task_durations, message_interval_sec=0)
+    results = run_benchmark(args.artifact_sizes, args.concurrency, config, args.poll_interval,
+                            shlex.split(args.pipeline_args), args.workdir)
+    print_results(results)
+    write_report(args.report, results)
+
+
+def write_report(path, results):
+    if path:
+        with open(path, 'w') as f:
+            json.dump(results, f, indent=2)
+        logging.info(f"Benchmark results written to {path}")
+
+
+if __name__ == '__main__':
+    main()
@@ -2,10 +2,9 @@ import argparse
 import json
 import logging
 
-import requests
-
 from utils import (request_headers, empty_files, validate_response, debug_log_request, TASKS_URL,
-                   ACTION_KEY, OVERRIDES_KEY, add_common_args, init_common_args, init_overrides, team_params)
+                   ACTION_KEY, OVERRIDES_KEY, add_common_args, init_common_args, init_overrides, team_params,
+                   get_session)
 
 
 def create_build_request(api_key, team_id, app_id, fusion_set_id, overrides=None, use_diagnostic_logs=False):
@@ -28,7 +27,7 @@ def create_build_request(api_key, team_id, app_id, fusion_set_id, overrides=None
 def build(api_key, team_id, app_id, fusion_set_id, overrides=None, use_diagnostic_logs=False, files=None):
     url, headers, body, params = create_build_request(api_key, team_id, app_id, fusion_set_id, overrides, use_diagnostic_logs)
     debug_log_request(url, headers=headers, params=params, data=body)
-    return requests.post(url, headers=headers, params=params, data=body, files=files if files else empty_files())
+    return get_session().post(url, headers=headers, params=params, data=body, files=files if files else empty_files())
 
 
 def parse_arguments():
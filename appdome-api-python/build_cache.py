@@ -0,0 +1,97 @@
+import hashlib
+import json
+import logging
+from copy import deepcopy
+
+from build import create_build_request
+from build_to_test import create_build_to_test_request
+from cache import PersistentCache, cache_file_path, DEFAULT_CACHE_TTL_SEC, DEFAULT_CACHE_MAX_ENTRIES
+from status import status
+from utils import OVERRIDES_KEY, TASKS_URL, file_sha256
+
+BUILD_CACHE_FILE = 'build_cache.json'
+
+
+def build_cache_key(team_id, app_id, fusion_set_id, overrides=None, use_diagnostic_logs=False,
+                    build_to_test_vendor=None, app_hash=None, baseline_profile=None, cert_pinning_zip=None,
+                    signing=None):
+    """
+    Canonical hash of every input of a build: the build (or build-to-test) request, the app content,
+    the baseline profile and certificate pinning files and the signing configuration.
+
+    :param app_hash: SHA-256 of the app file. When None the app is identified by app_id
+    :param signing: JSON serializable signing configuration. Cached tasks are signed, so a task is only reused
+    with the same signing
+    :return: Hex digest identifying the build
+    """
+    if build_to_test_vendor:
+        url, _, body, params = create_build_to_test_request(None, team_id, app_id, fusion_set_id, build_to_test_vendor,
+                                                            overrides=deepcopy(overrides),
+                                                            use_diagnostic_logs=use_diagnostic_logs)
+    else:
+        url, _, body, params = create_build_request(None, team_id, app_id, fusion_set_id, deepcopy(overrides),
+                                                    use_diagnostic_logs)
+    body = dict(body)
+    if OVERRIDES_KEY in body:
+        body[OVERRIDES_KEY] = json.loads(body[OVERRIDES_KEY])
+    if app_hash:
+        body['app_id'] = app_hash
+    key_inputs = {
+        'url': url,
+        'params': params,
+        'body': body,
+        'baseline_profile': file_sha256(baseline_profile) if baseline_profile else None,
+        'cert_pinning_zip': file_sha256(cert_pinning_zip) if cert_pinning_zip else None,
+        'signing': signing
+    }
+    return hashlib.sha256(json.dumps(key_inputs, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def get_cached_task_id(api_key, team_id, build_cache, cache_key, verify=False):
+    cached = build_cache.get(cache_key)
+    if not cached:
+        return None
+    task_id = cached['task_id']
+    if verify and not is_build_completed(api_key, team_id, task_id):
+        logging.info(f"Cached build {task_id} is no longer available. Building again")
+        build_cache.delete(cache_key)
+        return None
+    logging.info(f"The same build was already done. Using cached build id {task_id}")
+    return task_id
+
+
+def is_build_completed(api_key, team_id, task_id):
+    try:
+        status_response = status(api_key, team_id, task_id, TASKS_URL)
+        return status_response.status_code == 200 and status_response.json().get('status') == 'completed'
+    except Exception as e:
+        logging.debug(f"Couldn't get status of build id {task_id}. Error: {e}")
+        return False
+
+
+def add_build_cache_args(parser):
+    parser.add_argument('-bc', '--build_cache', action='store_true',
+                        help='Reuse a completed and signed build of the same app, Fusion Set, overrides, build files '
+                             'and signing')
+    parser.add_argument('--verify_build_cache', action='store_true',
+                        help='Check with Appdome that a cached build is still completed before using it')
+    parser.add_argument('--refresh_build_cache', action='store_true',
+                        help='Build even when a cached build exists, and replace the cached build')
+    parser.add_argument('--clear_build_cache', action='store_true', help='Remove all cached builds before building')
+    parser.add_argument('--build_cache_ttl', type=float, default=DEFAULT_CACHE_TTL_SEC / 3600, metavar='hours',
+                        help=f'Hours a cached build stays valid. Default is {DEFAULT_CACHE_TTL_SEC // 3600}')
+    parser.add_argument('--build_cache_max_entries', type=int, default=DEFAULT_CACHE_MAX_ENTRIES,
+                        metavar='max_entries',
+                        help=f'Max number of cached builds, least recently used are evicted. '
+                             f'Default is {DEFAULT_CACHE_MAX_ENTRIES}')
+
+
+def init_build_cache(args):
+    if not args.build_cache and not args.clear_build_cache:
+        return None
+    build_cache = PersistentCache(cache_file_path(BUILD_CACHE_FILE), args.build_cache_ttl * 3600,
+                                  args.build_cache_max_entries)
+    if args.clear_build_cache:
+        build_cache.clear()
+        logging.info("Build cache cleared")
+    return build_cache if args.build_cache else None
@@ -3,10 +3,9 @@ import json
 import logging
 from enum import Enum
 
-import requests
-
 from utils import (request_headers, empty_files, validate_response, debug_log_request, BUILD_TO_TEST_URL, log_and_exit,
-                   ACTION_KEY, OVERRIDES_KEY, add_common_args, init_common_args, init_overrides, team_params)
+                   ACTION_KEY, OVERRIDES_KEY, add_common_args, init_common_args, init_overrides, team_params,
+                   get_session)
 
 
 class BuildToTestVendors(Enum):
@@ -55,7 +54,7 @@ def build_to_test(api_key, team_id, app_id, fusion_set_id, vendor,
                                                               vendor, automation_vendor_err_msg, overrides,
                                                               use_diagnostic_logs)
     debug_log_request(url, headers=headers, params=params, data=body)
-    return requests.post(url, headers=headers, params=params, data=body, files=files if files else empty_files())
+    return get_session().post(url, headers=headers, params=params, data=body, files=files if files else empty_files())
 
 
 def init_automation_vendor(automation_vendor):
@@ -0,0 +1,134 @@
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from os import getenv, makedirs
+from os.path import exists, expanduser, join, dirname
+
+try:
+    import fcntl
+except ImportError:  # Windows - entries are still guarded between threads
+    fcntl = None
+
+CACHE_DIR_ENV = 'APPDOME_CACHE_DIR'
+DEFAULT_CACHE_DIR = join('~', '.cache', 'appdome')
+DEFAULT_CACHE_TTL_SEC = 24 * 3600
+DEFAULT_CACHE_MAX_ENTRIES = 1000
+
+
+def cache_file_path(name):
+    """
+    :return: Path of a cache file in the directory set by environment variable 'APPDOME_CACHE_DIR' or ~/.cache/appdome
+    """
+    return join(expanduser(getenv(CACHE_DIR_ENV, DEFAULT_CACHE_DIR)), name)
+
+
+class PersistentCache:
+    """
+    Key/value cache persisted in a JSON file, shared by threads and processes that use the same file.
+
+    Entries expire ttl_sec after they were stored. When there are more than max_entries entries,
+    the least recently used ones are evicted.
+    """
+    _locks = {}
+    _locks_lock = threading.Lock()
+
+    def __init__(self, path, ttl_sec=DEFAULT_CACHE_TTL_SEC, max_entries=DEFAULT_CACHE_MAX_ENTRIES):
+        """
+        :param path: Path of the JSON cache file
+        :param ttl_sec: Seconds an entry stays valid after it was stored
+        :param max_entries: Max number of entries kept in the file
+        """
+        self.path = path
+        self.ttl_sec = ttl_sec
+        self.max_entries = max_entries
+        with PersistentCache._locks_lock:
+            self._lock = PersistentCache._locks.setdefault(path, threading.Lock())
+
+    def get(self, key):
+        """
+        :return: The value stored for key, or None when missing or expired
+        """
+        with self._locked_entries() as entries:
+            entry = entries.get(key)
+            if not entry:
+                return None
+            entry['last_used'] = time.time()
+            return entry['value']
+
+    def put(self, key, value):
+        with self._locked_entries() as entries:
+            now = time.time()
+            entries[key] = {'value': value, 'created': now, 'last_used': now}
+
+    def delete(self, key):
+        with self._locked_entries() as entries:
+            entries.pop(key, None)
+
+    def clear(self):
+        with self._locked_entries() as entries:
+            entries.clear()
+
+    @contextmanager
+    def key_lock(self, key):
+        """
+        Hold key against other threads and processes using the same cache file, e.g. while computing its value.
+        Entries can still be read and written by everyone meanwhile.
+
+        :param key: Cache key, used as a file name
+        """
+        with PersistentCache._locks_lock:
+            key_lock = PersistentCache._locks.setdefault((self.path, key), threading.Lock())
+        with key_lock, self._file_lock(join(self.path + '.locks', key + '.lock')):
+            yield
+
+    @contextmanager
+    def _locked_entries(self):
+        with self._lock, self._file_lock(self.path + '.lock'):
+            entries = self._load()
+            self._evict(entries)
+            yield entries
+            self._evict(entries)
+            self._save(entries)
+
+    @staticmethod
+    @contextmanager
+    def _file_lock(lock_path):
+        if not fcntl:
+            yield
+            return
+        makedirs(dirname(lock_path) or '.', exist_ok=True)
+        with open(lock_path, 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _load(self):
+        if not exists(self.path):
+            return {}
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except ValueError:
+            logging.warning(f"Ignoring corrupted cache file {self.path}")
+            return {}
+
+    def _save(self, entries):
+        makedirs(dirname(self.path) or '.', exist_ok=True)
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(entries, f)
+        os.replace(tmp_path, self.path)
+
+    def _evict(self, entries):
+        now = time.time()
+        for key in [key for key, entry in entries.items() if now - entry['created'] > self.ttl_sec]:
+            del entries[key]
+        if len(entries) > self.max_entries:
+            by_last_use = sorted(entries, key=lambda key: entries[key]['last_used'])
+            for key in by_last_use[:len(entries) - self.max_entries]:
+                del entries[key]
@@ -0,0 +1,267 @@
+import atexit
+import gzip
+import io
+import json
+import logging
+import re
+import threading
+import time
+from collections import deque
+from datetime import timedelta
+from os import getenv
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+from requests import Response
+from requests.adapters import BaseAdapter, HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+
+CASSETTE_RECORD_ENV = 'APPDOME_CASSETTE_RECORD'
+CASSETTE_REPLAY_ENV = 'APPDOME_CASSETTE_REPLAY'
+CASSETTE_SPEED_ENV = 'APPDOME_CASSETTE_SPEED'
+CASSETTE_VERSION = 1
+REDACTED = 'REDACTED'
+# Query parameters of API and presigned S3 urls that hold credentials or identify the account
+SENSITIVE_QUERY_PARAMS = {'team_id', 'x-amz-credential', 'x-amz-signature', 'x-amz-security-token', 'signature',
+                          'awsaccesskeyid', 'x-amz-date'}
+RECORDED_HEADERS = ('Content-Type', 'Content-Length', 'Content-Range', 'Content-Encoding', 'ETag', 'Retry-After')
+TEXT_CONTENT_TYPES = ('json', 'text', 'xml')
+MAX_RECORDED_BODY_SIZE = 256 * 1024
+BODY_CHUNK_SIZE = 64 * 1024
+URL_IN_TEXT_RE = re.compile(r'https?://[^\s"\'<>]+')
+
+_writers = {}
+_writers_lock = threading.Lock()
+
+
+def redact_url(url):
+    """
+    Replace the values of credential query parameters, e.g. presigned S3 signatures, with REDACTED.
+    """
+    parts = urlsplit(url)
+    if not parts.query:
+        return url
+    query = [(key, REDACTED if key.lower() in SENSITIVE_QUERY_PARAMS else value)
+             for key, value in parse_qsl(parts.query, keep_blank_values=True)]
+    return urlunsplit(parts._replace(query=urlencode(query)))
+
+
+def redact_text(text):
+    return URL_IN_TEXT_RE.sub(lambda match: redact_url(match.group(0)), text)
+
+
+def exchange_key(method, url):
+    """
+    Key matching a replayed request to recorded exchanges. The host is ignored, so a cassette recorded against one
+    server can be replayed whatever APPDOME_SERVER_BASE_URL is.
+    """
+    parts = urlsplit(redact_url(url))
+    return f"{method} {parts.path}?{parts.query}" if parts.query else f"{method} {parts.path}"
+
+
+class CassetteWriter:
+    """
+    Appends recorded HTTP exchanges to a cassette file, one JSON object per line (gzip compressed for .gz paths).
+
+    Only the method, redacted url, request body size, response status, a few response headers, the time until the
+    response headers and the response body are kept. Request headers (e.g. Authorization) are never recorded,
+    and binary bodies (apps, pdf and zip files) are recorded by size only.
+    """
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = gzip.open(path, 'wt', encoding='utf-8') if path.endswith('.gz') else open(path, 'w')
+        self._write({'version': CASSETTE_VERSION, 'recorded': time.time()})
+        atexit.register(self.close)
+
+    def record(self, request, response, stream):
+        headers = {key: response.headers[key] for key in RECORDED_HEADERS if key in response.headers}
+        exchange = {
+            'key': exchange_key(request.method, request.url),
+            'status': response.status_code,
+            'headers': headers,
+            'elapsed': round(response.elapsed.total_seconds(), 4),
+            'request_size': int(request.headers.get('Content-Length') or 0)
+        }
+        if self._is_text(response, stream):
+            exchange['body'] = redact_text(response.text)
+            exchange['headers'].pop('Content-Length', None)
+            exchange['headers'].pop('Content-Encoding', None)
+        elif not stream:
+            exchange['body_size'] = len(response.content)
+        else:
+            exchange['body_size'] = int(response.headers.get('Content-Length') or 0)
+        self._write(exchange)
+
+    def close(self):
+        with self._lock:
+            if not self._file.closed:
+                self._file.close()
+
+    def _write(self, obj):
+        line = json.dumps(obj, separators=(',', ':')) + '\n'
+        with self._lock:
+            self._file.write(line)
+            self._file.flush()
+
+    @staticmethod
+    def _is_text(response, stream):
+        content_type = response.headers.get('Content-Type', '').lower()
+        if not any(text_type in content_type for text_type in TEXT_CONTENT_TYPES):
+            return False
+        size = response.headers.get('Content-Length')
+        # Small text responses are read now; requests still returns the content to the caller
+        return not stream or (size is not None and int(size) <= MAX_RECORDED_BODY_SIZE)
+
+
+class RecordingAdapter(HTTPAdapter):
+    """
+    HTTPAdapter that records every exchange it sends to a cassette.
+    """
+    def __init__(self, writer, *args, **kwargs):
+        self.writer = writer
+        super().__init__(*args, **kwargs)
+
+    def send(self, request, stream=False, **kwargs):
+        response = super().send(request, stream=stream, **kwargs)
+        try:
+            self.writer.record(request, response, stream)
+        except Exception as e:
+            logging.warning(f"Couldn't record {request.method} {redact_url(request.url)} to cassette. Error: {e}")
+        return response
+
+
+class _GeneratedBody:
+    """
+    Readable stream of size deterministic bytes, standing for a recorded binary body without keeping it.
+    """
+    def __init__(self, size):
+        self.remaining = size
+        self._pattern = bytes(range(256)) * (BODY_CHUNK_SIZE // 256)
+
+    def read(self, amt=None):
+        size = self.remaining if amt is None or amt < 0 else min(amt, self.remaining)
+        self.remaining -= size
+        return (self._pattern * (size // len(self._pattern) + 1))[:size]
+
+    def close(self):
+        self.remaining = 0
+
+
+class Cassette:
+    """
+    Recorded exchanges by request key, in recorded order.
+    """
+    def __init__(self, path):
+        self.path = path
+        self._exchanges = {}
+        self._lock = threading.Lock()
+        opener = gzip.open if path.endswith('.gz') else open
+        with opener(path, 'rt', encoding='utf-8') as f:
+            header = json.loads(f.readline())
+            if header.get('version') != CASSETTE_VERSION:
+                raise ValueError(f"Unsupported cassette version {header.get('version')} in {path}")
+            for line in f:
+                exchange = json.loads(line)
+                self._exchanges.setdefault(exchange['key'], deque()).append(exchange)
+
+    def next_exchange(self, key):
+        """
+        Pop the next recorded exchange of key. The last one is repeated once all were replayed, so a client that
+        polls more often than the recorded one keeps getting the final status.
+        """
+        with self._lock:
+            exchanges = self._exchanges.get(key)
+            if not exchanges:
+                return None
+            return exchanges.popleft() if len(exchanges) > 1 else exchanges[0]
+
+
+class ReplayAdapter(BaseAdapter):
+    """
+    Transport adapter answering requests from a cassette, without network access.
+
+    Responses are delayed by their recorded time divided by speed (0 replays without delays). Request bodies are
+    read like a real upload would, so the client's streaming code runs as in production.
+    """
+    def __init__(self, cassette, speed=1):
+        super().__init__()
+        self.cassette = cassette
+        self.speed = speed
+
+    def send(self, request, stream=False, timeout=None, verify=True, cert=None, proxies=None):
+        self._consume_body(request.body)
+        key = exchange_key(request.method, request.url)
+        exchange = self.cassette.next_exchange(key)
+        if not exchange:
+            response = self._build_response(request, {'status': 599, 'headers': {}, 'body': ''})
+            response.reason = f"No recorded exchange for {key}"
+            return response
+        if self.speed and exchange['elapsed']:
+            time.sleep(exchange['elapsed'] / self.speed)
+        return self._build_response(request, exchange)
+
+    def close(self):
+        pass
+
+    @staticmethod
+    def _consume_body(body):
+        if body is None or isinstance(body, (bytes, str)):
+            return
+        if hasattr(body, 'read'):
+            while body.read(BODY_CHUNK_SIZE):
+                pass
+        else:
+            for _ in body:
+                pass
+
+    @staticmethod
+    def _build_response(request, exchange):
+        response = Response()
+        response.status_code = exchange['status']
+        response.headers = CaseInsensitiveDict(exchange['headers'])
+        if 'body' in exchange:
+            body = exchange['body'].encode('utf-8')
+            response.headers['Content-Length'] = str(len(body))
+            response.raw = io.BytesIO(body)
+        else:
+            response.raw = _GeneratedBody(exchange.get('body_size', 0))
+        response.encoding = get_encoding_from_headers(response.headers)
+        response.reason = 'Replayed'
+        response.url = request.url
+        response.request = request
+        response.elapsed = timedelta(seconds=exchange.get('elapsed', 0))
+        return response
+
+
+def mount_cassette(session, pool_adapters):
+    """
+    Mount recording or replaying adapters on a session, when set by environment variables
+    'APPDOME_CASSETTE_RECORD' or 'APPDOME_CASSETTE_REPLAY' (with 'APPDOME_CASSETTE_SPEED', default 1).
+
+    :param pool_adapters: HTTPAdapter keyword arguments by mount prefix, used when recording
+    :return: True when cassette adapters were mounted
+    """
+    replay_path = getenv(CASSETTE_REPLAY_ENV)
+    record_path = getenv(CASSETTE_RECORD_ENV)
+    if replay_path:
+        adapter = ReplayAdapter(Cassette(replay_path), float(getenv(CASSETTE_SPEED_ENV, 1)))
+        for prefix in pool_adapters:
+            session.mount(prefix, adapter)
+        logging.info(f"Replaying HTTP exchanges from cassette {replay_path}")
+        return True
+    if record_path:
+        writer = _cassette_writer(record_path)
+        for prefix, adapter_kwargs in pool_adapters.items():
+            session.mount(prefix, RecordingAdapter(writer, **adapter_kwargs))
+        logging.info(f"Recording HTTP exchanges to cassette {record_path}")
+        return True
+    return False
+
+
+def _cassette_writer(path):
+    # Sessions created again (e.g. by init_session) keep appending to the same cassette
+    with _writers_lock:
+        if path not in _writers:
+            _writers[path] = CassetteWriter(path)
+        return _writers[path]
@@ -1,11 +1,11 @@
 import argparse
 import logging
 
-from utils import (validate_response, add_common_args, init_common_args, validate_output_path, task_output_command)
+from utils import (add_common_args, init_common_args, validate_output_path, task_output_command, download_to_file)
 
 
-def download_certified_secure(api_key, team_id, task_id):
-    return task_output_command(api_key, team_id, task_id, 'certificate')
+def download_certified_secure(api_key, team_id, task_id, stream=False, offset=0):
+    return task_output_command(api_key, team_id, task_id, 'certificate', stream=stream, offset=offset)
 
 
 def parse_arguments():
@@ -19,10 +19,9 @@ def main():
     args = parse_arguments()
     init_common_args(args)
     validate_output_path(args.certificate_output)
-    r = download_certified_secure(args.api_key, args.team_id, args.task_id)
-    validate_response(r)
-    with open(args.certificate_output, 'wb') as f:
-        f.write(r.content)
+    download_to_file(lambda offset: download_certified_secure(args.api_key, args.team_id, args.task_id,
+                                                              stream=True, offset=offset),
+                     args.certificate_output, resume_id=args.task_id)
     logging.info(f"Downloaded file to {args.certificate_output}")
 
 
@@ -3,11 +3,12 @@ import logging
 from json import load, dump
 from os.path import exists
 from shutil import move
-from utils import (validate_response, add_common_args, init_common_args, validate_output_path, task_output_command)
+from utils import (add_common_args, init_common_args, validate_output_path, task_output_command, download_to_file,
+                   file_sha256, write_sha256_file, CHECKSUM_SUFFIX)
 
 
-def download_certified_secure_json(api_key, team_id, task_id):
-    return task_output_command(api_key, team_id, task_id, 'certificate-json')
+def download_certified_secure_json(api_key, team_id, task_id, stream=False, offset=0):
+    return task_output_command(api_key, team_id, task_id, 'certificate-json', stream=stream, offset=offset)
 
 
 def format_json_file(file_path):
@@ -20,6 +21,8 @@ def format_json_file(file_path):
         with open(temp_write_file_path, 'w') as f:
             dump(obj, f, indent=2, separators=(',', ': '))
         move(temp_write_file_path, file_path)
+        if exists(file_path + CHECKSUM_SUFFIX):
+            write_sha256_file(file_path, file_sha256(file_path))
         logging.debug(f"Formatted {file_path}")
     except Exception:
         pass
@@ -36,10 +39,9 @@ def main():
     args = parse_arguments()
     init_common_args(args)
     validate_output_path(args.certificate_json)
-    r = download_certified_secure_json(args.api_key, args.team_id, args.task_id)
-    validate_response(r)
-    with open(args.certificate_json, 'wb') as f:
-        f.write(r.content)
+    download_to_file(lambda offset: download_certified_secure_json(args.api_key, args.team_id, args.task_id,
+                                                                   stream=True, offset=offset),
+                     args.certificate_json, resume_id=args.task_id)
     logging.info(f"Downloaded file to {args.certificate_json}")
     format_json_file(args.certificate_json)
 
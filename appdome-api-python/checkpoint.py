@@ -0,0 +1,161 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from os.path import abspath, exists, getmtime, getsize
+
+from utils import CHECKSUM_SUFFIX, file_sha256, log_and_exit, validate_output_path
+
+CHECKPOINT_VERSION = 1
+# appdome_api.py arguments that change what a phase does. A checkpoint of other arguments is never resumed.
+FINGERPRINT_ARGS = ('team_id', 'app_id', 'build_overrides', 'diagnostic_logs', 'baseline_profile', 'cert_pinning_zip',
+                    'build_to_test_vendor', 'sign_on_appdome', 'private_signing', 'auto_dev_private_signing',
+                    'sign_overrides', 'keystore', 'keystore_alias', 'signing_fingerprint',
+                    'signing_fingerprint_upgrade', 'google_play_signing', 'provisioning_profiles', 'entitlements')
+
+
+def pipeline_fingerprint(args, fusion_set_id):
+    """
+    :return: Hash of the app and the arguments of a pipeline, changed by any change of what the pipeline builds
+    """
+    values = {arg: getattr(args, arg, None) for arg in FINGERPRINT_ARGS}
+    values['fusion_set_id'] = fusion_set_id
+    if args.app:
+        values['app'] = [abspath(args.app), getsize(args.app), getmtime(args.app)]
+    return hashlib.sha256(json.dumps(values, sort_keys=True).encode()).hexdigest()
+
+
+class Checkpoint:
+    """
+    Progress of a pipeline persisted in a JSON file after every phase: the app id, the task id, the completed
+    phases and the downloaded outputs with their SHA-256.
+
+    A resumed pipeline skips the completed phases, and the outputs that are still on disk unchanged.
+    Without a path nothing is persisted and nothing is skipped.
+    """
+    def __init__(self, path, fingerprint, state=None):
+        self.path = path
+        self.fingerprint = fingerprint
+        self.state = state or {'version': CHECKPOINT_VERSION, 'fingerprint': fingerprint, 'phases': {},
+                               'downloads': {}}
+        # Outputs are downloaded, and recorded, concurrently
+        self._lock = threading.Lock()
+
+    @property
+    def app_id(self):
+        return self.state.get('app_id')
+
+    @property
+    def task_id(self):
+        return self.state.get('task_id')
+
+    def phase_done(self, name):
+        return name in self.state['phases']
+
+    def complete_phase(self, name, **values):
+        """
+        Record a completed phase with the values it produced, e.g. app_id, and save the checkpoint.
+        """
+        with self._lock:
+            self.state.update(values)
+            self.state['phases'][name] = time.time()
+            self._save()
+
+    def run_phase(self, name, func, key=None):
+        """
+        Run a phase unless it was completed, then record it.
+
+        :param key: State key of the value returned by func, returned without running func when the phase was done
+        :return: The value of func
+        """
+        if self.phase_done(name):
+            logging.info(f"Skipping {name}, completed in checkpoint {self.path}")
+            return self.state.get(key) if key else None
+        value = func()
+        self.complete_phase(name, **({key: value} if key else {}))
+        return value
+
+    def download_done(self, name, output_path):
+        """
+        :return: True when the output was downloaded and is still on disk unchanged
+        """
+        download = self.state['downloads'].get(name)
+        if not download or download['path'] != output_path:
+            return False
+        if download['sha256'] is None:
+            # Nothing to download, e.g. a build without deobfuscation scripts
+            return True
+        return exists(output_path) and file_sha256(output_path) == download['sha256']
+
+    def complete_download(self, name, output_path):
+        """
+        Record a downloaded output, and its SHA-256 when it exists, and save the checkpoint.
+        """
+        digest = _saved_sha256(output_path) if exists(output_path) else None
+        with self._lock:
+            self.state['downloads'][name] = {'path': output_path, 'sha256': digest}
+            self._save()
+
+    def _save(self):
+        if not self.path:
+            return
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(self.state, f, indent=2)
+        os.replace(tmp_path, self.path)
+
+
+def _saved_sha256(file_path):
+    # Downloads save the SHA-256 computed while writing next to the output
+    if exists(file_path + CHECKSUM_SUFFIX):
+        with open(file_path + CHECKSUM_SUFFIX) as f:
+            return f.read().split()[0]
+    return file_sha256(file_path)
+
+
+def load_checkpoint(path, fingerprint):
+    """
+    :return: The saved state of the checkpoint file when it is of the same pipeline, otherwise None
+    """
+    if not exists(path):
+        return None
+    try:
+        with open(path) as f:
+            state = json.load(f)
+    except ValueError:
+        logging.warning(f"Ignoring invalid checkpoint file {path}")
+        return None
+    if state.get('version') != CHECKPOINT_VERSION or state.get('fingerprint') != fingerprint:
+        logging.warning(f"Checkpoint {path} is of another app or other arguments, starting over")
+        return None
+    return state
+
+
+def add_checkpoint_args(parser):
+    parser.add_argument('--checkpoint', metavar='checkpoint_json_file',
+                        help='Save the app id, task id, completed phases and downloaded outputs to this file after '
+                             'every phase of the flow')
+    parser.add_argument('--resume', action='store_true',
+                        help='Skip the phases and downloads completed in the --checkpoint file of the same app and '
+                             'arguments')
+
+
+def validate_checkpoint_args(args):
+    if args.resume and not args.checkpoint:
+        log_and_exit("resume requires a checkpoint file")
+    validate_output_path(args.checkpoint)
+
+
+def init_checkpoint(args, fusion_set_id):
+    """
+    :return: Checkpoint of the pipeline, resumed from the --checkpoint file when --resume is set
+    """
+    if not args.checkpoint:
+        return Checkpoint(None, None)
+    fingerprint = pipeline_fingerprint(args, fusion_set_id)
+    state = load_checkpoint(args.checkpoint, fingerprint) if args.resume else None
+    if state:
+        logging.info(f"Resuming from checkpoint {args.checkpoint}. Completed phases: {', '.join(state['phases'])}")
+    return Checkpoint(args.checkpoint, fingerprint, state)
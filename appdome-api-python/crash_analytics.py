@@ -2,7 +2,8 @@ import logging
 import zipfile
 import os
 from abc import ABC, abstractmethod
-from utils import erased_temp_dir
+
+MAPPING_FILE = "mapping.txt"
 
 
 class CrashAnalytics(ABC):
@@ -20,18 +21,20 @@ class CrashAnalytics(ABC):
         self.faid_or_dd_api_key = faid_or_dd_api_key
 
     @abstractmethod
-    def upload_mappingfileid_file(self, tmpdir):
+    def upload_mappingfileid_file(self, zip_file):
         """
         Abstract method to be implemented by subclasses to upload mapping file to their respective services.
+        Subclasses read only the members they need from the archive.
 
-        :param tmpdir: Temporary directory where files are extracted
+        :param zip_file: Open deobfuscation script zip file, containing mapping.txt
         """
         pass
 
-    def upload_deobfuscation_map(self):
+    def upload_deobfuscation_map(self, zip_file=None):
         """
-        Upload the deobfuscation mapping file to the specified service after extracting the contents.
+        Upload the deobfuscation mapping file to the specified service, reading it from the deobfuscation zip.
 
+        :param zip_file: Already open deobfuscation script zip file, to share it between services
         :return: None
         """
         if not os.path.exists(self.deobfuscation_script_output):
@@ -41,18 +44,20 @@ class CrashAnalytics(ABC):
             logging.warning("Missing API key or ID. Skipping code deobfuscation mapping file upload.")
             return
         try:
-            with erased_temp_dir() as tmpdir:
+            if zip_file:
+                self._upload_from_zip(zip_file)
+            else:
                 with zipfile.ZipFile(self.deobfuscation_script_output, "r") as zip_file:
-                    zip_file.extractall(tmpdir)
-
-                mapping_file = os.path.join(tmpdir, "mapping.txt")
-                if not os.path.exists(mapping_file):
-                    logging.warning("Missing mapping.txt file. Skipping code deobfuscation mapping file upload.")
-                    return
-
-                # Delegate to subclass for specific mappingfileid_file handling
-                self.upload_mappingfileid_file(tmpdir)
+                    self._upload_from_zip(zip_file)
         except Exception as e:
             logging.error(f"An error occurred during file extraction or mapping file processing: {e}")
 
+    def _upload_from_zip(self, zip_file):
+        if MAPPING_FILE not in zip_file.namelist():
+            logging.warning("Missing mapping.txt file. Skipping code deobfuscation mapping file upload.")
+            return
+
+        # Delegate to subclass for specific mappingfileid_file handling
+        self.upload_mappingfileid_file(zip_file)
+
 
@@ -1,7 +1,9 @@
-import os
 import logging
 import subprocess
-from crash_analytics import CrashAnalytics
+from crash_analytics import CrashAnalytics, MAPPING_FILE
+from utils import erased_temp_dir
+
+MAPPING_FILE_ID_FILE = "com_google_firebase_crashlytics_mappingfileid.xml"
 
 
 class Crashlytics(CrashAnalytics):
@@ -17,23 +19,25 @@ class Crashlytics(CrashAnalytics):
         """
         super().__init__(deobfuscation_script_output, firebase_app_id)
 
-    def upload_mappingfileid_file(self, tmpdir):
+    def upload_mappingfileid_file(self, zip_file):
         """
         Upload the Crashlytics mapping file to Firebase using the provided Firebase App ID.
+        The Firebase CLI reads files from disk, so only the two needed members are extracted.
 
-        :param tmpdir: Temporary directory where files are extracted
+        :param zip_file: Open deobfuscation script zip file
         :return: None
         """
-        mappingfileid_file = os.path.join(tmpdir, "com_google_firebase_crashlytics_mappingfileid.xml")
-
-        if not os.path.exists(mappingfileid_file):
+        if MAPPING_FILE_ID_FILE not in zip_file.namelist():
             logging.warning("Missing com_google_firebase_crashlytics_mappingfileid.xml file. "
                             "Skipping code deobfuscation mapping file upload to Crashlytics.")
             return
 
-        subprocess.call(
-            f"firebase crashlytics:mappingfile:upload --app={self.faid_or_dd_api_key} --resource-file={mappingfileid_file} "
-            f"{os.path.join(tmpdir, 'mapping.txt')}", shell=True)
+        with erased_temp_dir() as tmpdir:
+            mappingfileid_file = zip_file.extract(MAPPING_FILE_ID_FILE, tmpdir)
+            mapping_file = zip_file.extract(MAPPING_FILE, tmpdir)
+            subprocess.call(
+                f"firebase crashlytics:mappingfile:upload --app={self.faid_or_dd_api_key} "
+                f"--resource-file={mappingfileid_file} {mapping_file}", shell=True)
 
 
 
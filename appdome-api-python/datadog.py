@@ -1,9 +1,17 @@
 import os
+import gzip
 import logging
 import json
-import requests
-from crash_analytics import CrashAnalytics
+import tempfile
+from pathlib import Path
+from contextlib import ExitStack
+from crash_analytics import CrashAnalytics, MAPPING_FILE
 from CustomMultipartEncoder import CustomMultipartEncoder
+from utils import get_session
+
+# Responses of an intake that does not accept a gzip-encoded body: length required, unsupported media type
+GZIP_REJECTED_STATUS_CODES = (411, 415)
+DATADOG_METADATA_FILE = "data_dog_metadata.json"
 
 
 class DataDog(CrashAnalytics):
@@ -19,32 +27,34 @@ class DataDog(CrashAnalytics):
         """
         super().__init__(deobfuscation_script_output, dd_api_key)
 
-    def upload_mappingfileid_file(self, tmpdir):
+    def upload_mappingfileid_file(self, zip_file):
         """
         Upload the DataDog mapping file using the provided DataDog API key.
+        The metadata and mapping file are streamed out of the zip file without extracting it.
 
-        :param tmpdir: Temporary directory where files are extracted
+        :param zip_file: Open deobfuscation script zip file
         :return: None
         """
-        mappingfileid_file = os.path.join(tmpdir, "data_dog_metadata.json")
-
-        if not os.path.exists(mappingfileid_file):
+        if DATADOG_METADATA_FILE not in zip_file.namelist():
             logging.warning("Missing datadog_mapping file. Skipping code deobfuscation mapping file upload to DataDog.")
             return
 
-        build_id, service_name, version = self.load_json(mappingfileid_file)
+        with zip_file.open(DATADOG_METADATA_FILE) as metadata_file:
+            build_id, service_name, version = self.load_json(metadata_file)
         self.api_call_upload_mapping_file(api_key=self.faid_or_dd_api_key, build_id=build_id, version_name=version,
-                                          service_name=service_name,
-                                          mapping_file_path=os.path.join(tmpdir, "mapping.txt"))
+                                          service_name=service_name, mapping_file_path=MAPPING_FILE,
+                                          zip_file=zip_file)
 
-    def load_json(self, file_path):
+    def load_json(self, file):
         """
         Load JSON metadata from the provided file.
 
-        :param file_path: Path to the JSON metadata file
+        :param file: Path to the JSON metadata file, or the open file
         :return: Tuple containing build_id, service_name, and version
         """
-        with open(file_path, 'r') as file:
+        with ExitStack() as stack:
+            if not hasattr(file, 'read'):
+                file = stack.enter_context(open(file, 'r'))
             data = json.load(file)
 
             # Extract fields into variables
@@ -54,15 +64,21 @@ class DataDog(CrashAnalytics):
 
             return build_id, service_name, version
 
-    def api_call_upload_mapping_file(self, api_key, build_id, version_name, service_name, mapping_file_path):
+    def api_call_upload_mapping_file(self, api_key, build_id, version_name, service_name, mapping_file_path,
+                                     compress=True, zip_file=None):
         """
         Make an API call to DataDog to upload the deobfuscation mapping file.
 
+        The request body is streamed from the mapping file. With compress, it is gzip-compressed into a temporary
+        file first, and sent uncompressed if the intake rejects the compressed request.
+
         :param api_key: DataDog API key
         :param build_id: Build ID from metadata
         :param version_name: Version name from metadata
         :param service_name: Service name from metadata
-        :param mapping_file_path: Path to the mapping.txt file
+        :param mapping_file_path: Path to the mapping.txt file, or its member name in zip_file
+        :param compress: Send the request body gzip-compressed
+        :param zip_file: Open zip file to stream the mapping file from, without extracting it
         :return: None
         """
         url = "https://sourcemap-intake.datadoghq.com/api/v2/srcmap"
@@ -77,27 +93,61 @@ class DataDog(CrashAnalytics):
             "version": version_name
         }
         event_json = json.dumps(event_data)
-        fields = {
-            "event": ("event.json", event_json.encode('utf-8'), "application/json; charset=utf-8"),
-            "jvm_mapping_file": ("jvm_mapping", open(mapping_file_path, "rb").read(), "text/plain")
-        }
 
-        # Use custom multipart encoder
-        encoder = CustomMultipartEncoder(fields)
+        def fields(stack):
+            if zip_file:
+                mapping_file = stack.enter_context(zip_file.open(mapping_file_path))
+                mapping_part = ("jvm_mapping", mapping_file, "text/plain", zip_file.getinfo(mapping_file_path).file_size)
+            else:
+                mapping_part = ("jvm_mapping", Path(mapping_file_path), "text/plain")
+            return {
+                "event": ("event.json", event_json.encode('utf-8'), "application/json; charset=utf-8"),
+                "jvm_mapping_file": mapping_part
+            }
 
         headers = {
             "dd-evp-origin": "dd-sdk-android-gradle-plugin",
             "dd-evp-origin-version": "1.13.0",
             "dd-api-key": api_key,
-            "Content-Type": encoder.content_type,
             "Accept-Encoding": "gzip"
         }
 
-        # Send the POST request to Datadog
-        response = requests.post(url, headers=headers, data=encoder.to_string())
+        response = None
+        if compress:
+            with ExitStack() as stack:
+                response = self.post_gzip_multipart(url, headers, fields(stack))
+            if response.status_code in GZIP_REJECTED_STATUS_CODES:
+                logging.info(f"DataDog rejected the compressed upload (status code {response.status_code}). "
+                             f"Uploading uncompressed")
+                response = None
+        if response is None:
+            # The encoder streams the mapping file while the request is sent
+            with ExitStack() as stack:
+                encoder = CustomMultipartEncoder(fields(stack))
+                response = get_session().post(url, headers={**headers, "Content-Type": encoder.content_type},
+                                              data=encoder)
 
         if response.status_code == 202:
             logging.info("Mapping file uploaded successfully to Data Dog!")
         else:
             logging.info(f"Failed to upload mapping file to DataDog. Status code: {response.status_code}")
             logging.info(f"Response: {response.text}")
+
+    @staticmethod
+    def post_gzip_multipart(url, headers, fields):
+        """
+        POST the multipart body of fields gzip-compressed, with a bounded memory footprint.
+
+        :return: Response
+        """
+        encoder = CustomMultipartEncoder(fields)
+        with tempfile.TemporaryFile() as compressed:
+            with gzip.GzipFile(fileobj=compressed, mode='wb', compresslevel=6) as gzip_file:
+                for chunk in encoder:
+                    gzip_file.write(chunk)
+            compressed_size = compressed.tell()
+            compressed.seek(0)
+            logging.debug(f"Mapping upload body compressed from {encoder.len} to {compressed_size} bytes")
+            headers = {**headers, "Content-Type": encoder.content_type, "Content-Encoding": "gzip",
+                       "Content-Length": str(compressed_size)}
+            return get_session().post(url, headers=headers, data=compressed)
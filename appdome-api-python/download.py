@@ -1,24 +1,23 @@
 import argparse
 import logging
 
-from utils import (validate_response, add_common_args, init_common_args, validate_output_path, task_output_command)
+from utils import (add_common_args, init_common_args, validate_output_path, task_output_command, download_to_file)
 
 
-def download(api_key, team_id, task_id, action=None):
-    return task_output_command(api_key, team_id, task_id, 'output', action)
+def download(api_key, team_id, task_id, action=None, stream=False, offset=0):
+    return task_output_command(api_key, team_id, task_id, 'output', action, stream, offset)
 
 
 def download_action(api_key, team_id, task_id, command_output_path, action):
     if not command_output_path:
         return
     validate_output_path(command_output_path)
-    r = download(api_key, team_id, task_id, action)
-    if action == 'deobfuscation_script' and r.status_code == 404:
+    digest = download_to_file(lambda offset: download(api_key, team_id, task_id, action, stream=True, offset=offset),
+                              command_output_path, resume_id=task_id,
+                              allow_not_found=action == 'deobfuscation_script')
+    if not digest:
         logging.debug(f"couldn't find deobfuscation scripts.")
         return
-    validate_response(r)
-    with open(command_output_path, 'wb') as f:
-        f.write(r.content)
     logging.info(f"Downloaded {action if action else ''} output file to {command_output_path}")
 
 
@@ -0,0 +1,202 @@
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar, copy_context
+
+PHASE_COUNTERS = ('requests', 'bytes_sent', 'bytes_received', 'polls')
+PROMETHEUS_METRICS = (
+    ('duration_seconds', 'wall_sec', 'Wall time of the pipeline phase in seconds'),
+    ('requests', 'requests', 'HTTP requests sent during the pipeline phase'),
+    ('bytes_sent', 'bytes_sent', 'Bytes of HTTP request bodies sent during the pipeline phase'),
+    ('bytes_received', 'bytes_received', 'Bytes of HTTP response bodies received during the pipeline phase'),
+    ('polls', 'polls', 'Status polls done during the pipeline phase'),
+    ('success', 'success', '1 when the pipeline phase succeeded, 0 when it failed'),
+)
+
+_current_metrics = ContextVar('appdome_metrics', default=None)
+_current_phase = ContextVar('appdome_metrics_phase', default=None)
+
+
+class PhaseMetrics:
+    def __init__(self, name):
+        self.name = name
+        self.wall_sec = 0
+        self.requests = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.polls = 0
+        self.success = 1
+        self._lock = threading.Lock()
+
+    def add(self, **counters):
+        with self._lock:
+            for counter, value in counters.items():
+                setattr(self, counter, getattr(self, counter) + value)
+
+    def to_dict(self):
+        return {
+            'wall_sec': round(self.wall_sec, 3),
+            'requests': self.requests,
+            'bytes_sent': self.bytes_sent,
+            'bytes_received': self.bytes_received,
+            'polls': self.polls,
+            'success': bool(self.success)
+        }
+
+
+class PipelineMetrics:
+    """
+    Wall time, HTTP requests, bytes sent and received and status polls of every phase of a pipeline.
+
+    Bytes are counted from the Content-Length of requests and responses, so chunked responses count as 0 bytes.
+    """
+    def __init__(self, labels=None):
+        """
+        :param labels: Labels identifying the pipeline, e.g. {"app": "app.apk"}, added to the Prometheus metrics
+        """
+        self.labels = labels or {}
+        self.phases = {}
+        self.wall_sec = 0
+        self._lock = threading.Lock()
+
+    def phase(self, name):
+        with self._lock:
+            phase_metrics = self.phases.get(name)
+            if not phase_metrics:
+                phase_metrics = self.phases[name] = PhaseMetrics(name)
+            return phase_metrics
+
+    def to_dict(self):
+        phases = {name: phase_metrics.to_dict() for name, phase_metrics in self.phases.items()}
+        totals = {counter: sum(phase[counter] for phase in phases.values()) for counter in PHASE_COUNTERS}
+        return {'labels': self.labels, 'wall_sec': round(self.wall_sec, 3), 'totals': totals, 'phases': phases}
+
+    def write_json(self, path):
+        _write_atomically(path, json.dumps(self.to_dict(), indent=2))
+        logging.info(f"Pipeline metrics written to {path}")
+
+    def write_prometheus(self, path):
+        """
+        Write the metrics in the Prometheus text format, for the node exporter textfile collector.
+        """
+        lines = []
+        for metric, attribute, description in PROMETHEUS_METRICS:
+            name = f"appdome_pipeline_phase_{metric}"
+            lines.append(f"# HELP {name} {description}")
+            lines.append(f"# TYPE {name} gauge")
+            for phase_name, phase_metrics in self.phases.items():
+                labels = _prometheus_labels({**self.labels, 'phase': phase_name})
+                lines.append(f"{name}{{{labels}}} {getattr(phase_metrics, attribute)}")
+        lines.append("# HELP appdome_pipeline_duration_seconds Wall time of the whole pipeline in seconds")
+        lines.append("# TYPE appdome_pipeline_duration_seconds gauge")
+        lines.append(f"appdome_pipeline_duration_seconds{{{_prometheus_labels(self.labels)}}} {self.wall_sec}")
+        _write_atomically(path, '\n'.join(lines) + '\n')
+        logging.info(f"Pipeline Prometheus metrics written to {path}")
+
+    def log_summary(self):
+        for name, phase_metrics in self.phases.items():
+            logging.info(f"Phase {name}: {phase_metrics.wall_sec:.3f} sec, {phase_metrics.requests} requests, "
+                         f"{phase_metrics.bytes_sent} bytes sent, {phase_metrics.bytes_received} bytes received, "
+                         f"{phase_metrics.polls} polls")
+
+
+@contextmanager
+def collect(labels=None):
+    """
+    Collect the metrics of the phases run in this context (and in contexts copied from it).
+
+    :yield: PipelineMetrics
+    """
+    pipeline_metrics = PipelineMetrics(labels)
+    token = _current_metrics.set(pipeline_metrics)
+    start = time.monotonic()
+    try:
+        yield pipeline_metrics
+    finally:
+        pipeline_metrics.wall_sec = time.monotonic() - start
+        _current_metrics.reset(token)
+
+
+@contextmanager
+def phase(name):
+    """
+    Attribute the requests and polls done in this context to a phase of the collected pipeline, and time it.
+    Does nothing when no pipeline metrics are collected.
+    """
+    pipeline_metrics = _current_metrics.get()
+    if not pipeline_metrics:
+        yield None
+        return
+    phase_metrics = pipeline_metrics.phase(name)
+    token = _current_phase.set(phase_metrics)
+    start = time.monotonic()
+    try:
+        yield phase_metrics
+    except BaseException:
+        phase_metrics.success = 0
+        raise
+    finally:
+        phase_metrics.add(wall_sec=time.monotonic() - start)
+        _current_phase.reset(token)
+
+
+def record_poll():
+    phase_metrics = _current_phase.get()
+    if phase_metrics:
+        phase_metrics.add(polls=1)
+
+
+def record_response(response, *args, **kwargs):
+    """
+    requests response hook counting the request and its bytes in the current phase.
+    """
+    phase_metrics = _current_phase.get()
+    if phase_metrics:
+        phase_metrics.add(requests=1, bytes_sent=_content_length(response.request.headers),
+                          bytes_received=_content_length(response.headers))
+    return response
+
+
+def submit_in_context(executor, func, *args, **kwargs):
+    """
+    Submit func to an executor so that it runs in (a copy of) the current context, and is counted in its phase.
+    """
+    return executor.submit(copy_context().run, func, *args, **kwargs)
+
+
+def _content_length(headers):
+    try:
+        return int(headers.get('Content-Length') or 0)
+    except ValueError:
+        return 0
+
+
+def _prometheus_labels(labels):
+    def escape(value):
+        return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return ','.join(f'{key}="{escape(value)}"' for key, value in labels.items())
+
+
+def _write_atomically(path, content):
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w') as f:
+        f.write(content)
+    os.replace(tmp_path, path)
+
+
+def add_metrics_args(parser):
+    parser.add_argument('--metrics_json', metavar='metrics_json_file',
+                        help='Output file for the wall time, requests, bytes and polls of every phase of the flow')
+    parser.add_argument('--metrics_prometheus', metavar='metrics_prom_file',
+                        help='Output .prom file with the phase metrics, for the node exporter textfile collector')
+
+
+def write_metrics(args, pipeline_metrics):
+    pipeline_metrics.log_summary()
+    if args.metrics_json:
+        pipeline_metrics.write_json(args.metrics_json)
+    if args.metrics_prometheus:
+        pipeline_metrics.write_prometheus(args.metrics_prometheus)
@@ -0,0 +1,462 @@
+import argparse
+import io
+import json
+import logging
+import re
+import threading
+import time
+import zipfile
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+from uuid import uuid4
+
+MB = 1024 * 1024
+STREAM_CHUNK_SIZE = 64 * 1024
+DEFAULT_TASK_DURATION_SEC = 2
+DEFAULT_ARTIFACT_SIZE = MB
+API_PREFIX = '/api/v1/'
+S3_PREFIX = '/s3/'
+FORM_FIELD_RE = rb'name="%s"\r\n(?:[^\r\n]+\r\n)*\r\n([^\r\n]*)'
+# Task actions by the operation whose duration they take
+ACTION_OPERATIONS = {'fuse': 'build', 'seal': 'sign', 'sign': 'sign', 'sign_script': 'sign'}
+
+
+class MockServerConfig:
+    """
+    Behavior of the mock server.
+
+    :param latency_sec: Delay added to every request
+    :param task_durations: Seconds an upload, build (fuse), context, sign (sign, seal or sign_script) or validation
+                           task stays in progress, by operation name. Operations not listed take
+                           default_task_duration_sec
+    :param artifact_size: Size in bytes of the app returned by the output endpoints
+    :param obfuscation_map: Whether tasks have deobfuscation scripts
+    :param message_interval_sec: Seconds between the workflow messages of a task in progress
+    """
+    def __init__(self, latency_sec=0, default_task_duration_sec=DEFAULT_TASK_DURATION_SEC, task_durations=None,
+                 artifact_size=DEFAULT_ARTIFACT_SIZE, obfuscation_map=False, message_interval_sec=0.5):
+        self.latency_sec = latency_sec
+        self.default_task_duration_sec = default_task_duration_sec
+        self.task_durations = task_durations or {}
+        self.artifact_size = artifact_size
+        self.obfuscation_map = obfuscation_map
+        self.message_interval_sec = message_interval_sec
+
+    def task_duration(self, operation):
+        return self.task_durations.get(operation, self.default_task_duration_sec)
+
+
+class MockAppdomeServer:
+    """
+    Local stand-in for the Appdome API and its S3 upload host, keeping all state in memory.
+
+    Point the client at it with the APPDOME_SERVER_BASE_URL environment variable set to base_url.
+    GET /__stats returns the number of requests by endpoint and the bytes uploaded and downloaded,
+    POST /__reset clears them.
+    """
+    def __init__(self, config=None, host='127.0.0.1', port=0):
+        self.config = config or MockServerConfig()
+        self.httpd = ThreadingHTTPServer((host, port), _MockRequestHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.mock = self
+        self.lock = threading.Lock()
+        self.tasks = {}
+        self.validations = {}
+        self.stats = {}
+        self.bytes_received = 0
+        self.bytes_sent = 0
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name='mock-server', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        if self._thread:
+            self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    def count(self, endpoint, bytes_received=0, bytes_sent=0):
+        with self.lock:
+            self.stats[endpoint] = self.stats.get(endpoint, 0) + 1
+            self.bytes_received += bytes_received
+            self.bytes_sent += bytes_sent
+
+    def add_bytes_sent(self, size):
+        with self.lock:
+            self.bytes_sent += size
+
+    def get_stats(self):
+        with self.lock:
+            return {'requests': dict(self.stats), 'total_requests': sum(self.stats.values()),
+                    'bytes_received': self.bytes_received, 'bytes_sent': self.bytes_sent}
+
+    def reset_stats(self):
+        with self.lock:
+            self.stats.clear()
+            self.bytes_received = 0
+            self.bytes_sent = 0
+
+    def new_task(self, operation, tasks=None):
+        task_id = uuid4().hex
+        with self.lock:
+            (self.tasks if tasks is None else tasks)[task_id] = {
+                'operation': operation,
+                'created': time.monotonic(),
+                'created_time': time.time(),
+                'duration': self.config.task_duration(operation)
+            }
+        return task_id
+
+    def restart_task(self, task_id, operation):
+        """
+        Run a new operation (e.g. context or sign) on an existing task, like the API does for parent_task_id.
+
+        :return: True when the task exists
+        """
+        with self.lock:
+            task = self.tasks.get(task_id)
+            if not task:
+                return False
+            task.update(operation=operation, created=time.monotonic(), created_time=time.time(),
+                        duration=self.config.task_duration(operation))
+        return True
+
+    def task_progress(self, task_id, tasks=None):
+        """
+        :return: (task, elapsed seconds, whether it is done), or None for an unknown task
+        """
+        with self.lock:
+            task = (self.tasks if tasks is None else tasks).get(task_id)
+        if not task:
+            return None
+        elapsed = time.monotonic() - task['created']
+        return task, elapsed, elapsed >= task['duration']
+
+
+class _MockRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    @property
+    def mock(self):
+        return self.server.mock
+
+    def log_message(self, format, *args):
+        logging.debug(f"Mock server: {format % args}")
+
+    def do_GET(self):
+        self._handle('GET')
+
+    def do_POST(self):
+        self._handle('POST')
+
+    def do_PUT(self):
+        self._handle('PUT')
+
+    def _handle(self, method):
+        if self.mock.config.latency_sec:
+            time.sleep(self.mock.config.latency_sec)
+        parsed = urlparse(self.path)
+        self.query = {key: values[-1] for key, values in parse_qs(parsed.query).items()}
+        path = parsed.path
+        parts = path[len(API_PREFIX):].strip('/').split('/') if path.startswith(API_PREFIX) else []
+
+        if path == '/__stats' and method == 'GET':
+            return self._send_json(self.mock.get_stats())
+        if path == '/__reset' and method == 'POST':
+            self.mock.reset_stats()
+            return self._send_json({})
+        if path.startswith(S3_PREFIX):
+            return self._s3(method, path[len(S3_PREFIX):].strip('/').split('/'))
+
+        routes = {
+            ('GET', 'upload-link'): self._upload_link,
+            ('POST', 'upload-using-link'): self._upload_using_link,
+            ('POST', 'tasks'): self._task_action,
+            ('POST', 'build-to-test'): self._task_action,
+            ('POST', 'validation'): self._validation_upload,
+            ('POST', 'release_fs'): self._release_fusion_set,
+            ('GET', 'upload'): self._upload_status,
+            ('GET', 'tasks'): self._task_command,
+            ('GET', 'validation'): self._validation_status,
+        }
+        handler = routes.get((method, parts[0] if parts else None))
+        if not handler:
+            self._read_body()
+            return self._send_json({'message': f'Unknown endpoint {method} {path}'}, 404)
+        handler(parts)
+
+    def _upload_link(self, parts):
+        self.mock.count('upload-link')
+        file_id = uuid4().hex
+        s3_url = f"{self.mock.base_url}s3/{file_id}"
+        link = {'url': s3_url, 'file_id': file_id}
+        part_count = int(self.query.get('parts') or 0)
+        if part_count:
+            link['part_urls'] = [f"{s3_url}?partNumber={n}" for n in range(1, part_count + 1)]
+            link['complete_url'] = f"{s3_url}/complete"
+        self._send_json(link)
+
+    def _s3(self, method, parts):
+        size = self._read_body()
+        if method == 'PUT':
+            self.mock.count('s3-put', bytes_received=size)
+            return self._send_json({}, headers={'ETag': f'"{uuid4().hex}"'})
+        if method == 'POST' and parts[-1] == 'complete':
+            self.mock.count('s3-complete', bytes_received=size)
+            return self._send_json({})
+        self._send_json({'message': 'Unknown S3 request'}, 404)
+
+    def _upload_using_link(self, parts):
+        size = self._read_body()
+        self.mock.count('upload-using-link', bytes_received=size)
+        self._send_json({'id': self.mock.new_task('upload')})
+
+    def _task_action(self, parts):
+        body = self._read_body(keep=True)
+        action = self._form_field(body, 'action') or 'fuse'
+        self.mock.count(f"{parts[0]}:{action}", bytes_received=len(body))
+        operation = ACTION_OPERATIONS.get(action, action)
+        # Context and sign continue the build task, which the client keeps polling
+        parent_task_id = self._form_field(body, 'parent_task_id')
+        if parent_task_id and self.mock.restart_task(parent_task_id, operation):
+            return self._send_json({'task_id': parent_task_id})
+        self._send_json({'task_id': self.mock.new_task(operation)})
+
+    def _upload_status(self, parts):
+        self.mock.count('upload-status')
+        self._send_status(parts[1] if len(parts) > 1 else None)
+
+    def _task_command(self, parts):
+        if len(parts) < 3:
+            return self._send_json({'message': 'Missing task command'}, 404)
+        task_id, command = parts[1], parts[2]
+        if command == 'status':
+            self.mock.count('status')
+            return self._send_status(task_id)
+        progress = self.mock.task_progress(task_id)
+        if not progress or not progress[2]:
+            self.mock.count(command)
+            return self._send_json({'message': f'Task {task_id} has no output'}, 404)
+
+        if command == 'output':
+            action = self.query.get('action')
+            self.mock.count(f"output:{action}" if action else 'output')
+            if action == 'deobfuscation_script':
+                if not self.mock.config.obfuscation_map:
+                    return self._send_json({'message': 'No deobfuscation script'}, 404)
+                return self._send_bytes(self._deobfuscation_zip(), 'application/zip')
+            return self._send_artifact(self.mock.config.artifact_size)
+        if command == 'certificate':
+            self.mock.count('certificate')
+            return self._send_bytes(b'%PDF-1.4\n% Certified Secure mock\n%%EOF\n', 'application/pdf')
+        if command == 'certificate-json':
+            self.mock.count('certificate-json')
+            certificate = {'task_id': task_id, 'certified_secure': True, 'created': _iso_time(time.time())}
+            return self._send_bytes(json.dumps(certificate).encode('utf-8'), 'application/json')
+        self.mock.count(command)
+        self._send_json({'message': f'Unknown task command {command}'}, 404)
+
+    def _validation_upload(self, parts):
+        size = self._read_body()
+        self.mock.count('validation-upload', bytes_received=size)
+        self._send_json({'id': self.mock.new_task('validation', self.mock.validations)})
+
+    def _validation_status(self, parts):
+        self.mock.count('validation-status')
+        progress = self.mock.task_progress(parts[1] if len(parts) > 1 else None, self.mock.validations)
+        if not progress:
+            return self._send_json({'message': 'Unknown validation'}, 404)
+        _, _, done = progress
+        if not done:
+            return self._send_json({'validation_state': 'active'})
+        self._send_json({'validation_state': 'completed', 'validation_result': 'valid'})
+
+    def _release_fusion_set(self, parts):
+        self._read_body()
+        self.mock.count('release_fs')
+        self._send_json({'new_fusion_set_id': uuid4().hex})
+
+    def _send_status(self, task_id):
+        progress = self.mock.task_progress(task_id)
+        if not progress:
+            return self._send_json({'message': f'Unknown task {task_id}'}, 404)
+        task, elapsed, done = progress
+        status_json = {'status': 'completed' if done else 'progress', 'task_id': task_id,
+                       'obfuscationMapExists': self.mock.config.obfuscation_map}
+        if self.query.get('messages') == 'true':
+            status_json['messages'] = self._task_messages(task, min(elapsed, task['duration']),
+                                                          self.query.get('lastDate'))
+        self._send_json(status_json)
+
+    def _task_messages(self, task, elapsed, last_date):
+        interval = self.mock.config.message_interval_sec
+        if not interval:
+            return []
+        messages = []
+        for index in range(1, int(elapsed / interval) + 1):
+            creation_time = _iso_time(task['created_time'] + index * interval)
+            if last_date and creation_time <= last_date:
+                continue
+            messages.append({'message': {'text': f"{task['operation']} step {index}"}, 'creation_time': creation_time})
+        return messages
+
+    @staticmethod
+    def _deobfuscation_zip():
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
+            zip_file.writestr('mapping.txt', 'com.example.App -> a:\n')
+        return buffer.getvalue()
+
+    @staticmethod
+    def _form_field(body, name):
+        match = re.search(FORM_FIELD_RE % re.escape(name.encode()), body)
+        if match:
+            return match.group(1).decode('utf-8', 'replace')
+        return parse_qs(body.decode('utf-8', 'replace')).get(name, [None])[-1]
+
+    def _read_body(self, keep=False):
+        """
+        Read the request body, discarding it unless keep is set.
+
+        :return: The body if keep is set, otherwise its size
+        """
+        kept = []
+        size = 0
+        if self.headers.get('Transfer-Encoding', '').lower() == 'chunked':
+            while True:
+                chunk_size = int(self.rfile.readline().split(b';')[0].strip() or b'0', 16)
+                if not chunk_size:
+                    self.rfile.readline()
+                    break
+                chunk = self.rfile.read(chunk_size)
+                self.rfile.readline()
+                size += len(chunk)
+                if keep:
+                    kept.append(chunk)
+        else:
+            remaining = int(self.headers.get('Content-Length') or 0)
+            while remaining > 0:
+                chunk = self.rfile.read(min(STREAM_CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                size += len(chunk)
+                if keep:
+                    kept.append(chunk)
+        return b''.join(kept) if keep else size
+
+    def _send_json(self, obj, status_code=200, headers=None):
+        body = json.dumps(obj).encode('utf-8')
+        self.send_response(status_code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_bytes(self, body, content_type):
+        self.mock.add_bytes_sent(len(body))
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_artifact(self, size):
+        start = 0
+        range_match = re.match(r'bytes=(\d+)-$', self.headers.get('Range', ''))
+        if range_match:
+            start = int(range_match.group(1))
+            if start >= size:
+                self.send_response(416)
+                self.send_header('Content-Range', f'bytes */{size}')
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            self.send_response(206)
+            self.send_header('Content-Range', f'bytes {start}-{size - 1}/{size}')
+        else:
+            self.send_response(200)
+        self.send_header('Content-Type', 'application/octet-stream')
+        self.send_header('Content-Length', str(size - start))
+        self.end_headers()
+
+        # Deterministic content, so resumed downloads can be verified
+        pattern = bytes(range(256)) * (STREAM_CHUNK_SIZE // 256)
+        position = start
+        while position < size:
+            offset = position % len(pattern)
+            chunk = pattern[offset:offset + min(len(pattern) - offset, size - position)]
+            self.wfile.write(chunk)
+            position += len(chunk)
+        self.mock.add_bytes_sent(size - start)
+
+
+def _iso_time(timestamp):
+    return datetime.fromtimestamp(timestamp, timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+
+
+def parse_task_durations(value):
+    """
+    Parse per operation task durations in seconds, e.g. "build=10,sign=3".
+    """
+    durations = {}
+    for item in value.split(','):
+        if not item.strip():
+            continue
+        operation, _, seconds = item.partition('=')
+        durations[operation.strip()] = float(seconds)
+    return durations
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Local stand-in of the Appdome API, for testing and benchmarks. '
+                                                 'Point the client at it with APPDOME_SERVER_BASE_URL')
+    parser.add_argument('--host', default='127.0.0.1', help='Host to listen on. Default is 127.0.0.1')
+    parser.add_argument('-p', '--port', type=int, default=8080, help='Port to listen on. Default is 8080')
+    parser.add_argument('--latency', type=float, default=0, metavar='seconds', help='Delay added to every request')
+    parser.add_argument('--task_duration', type=float, default=DEFAULT_TASK_DURATION_SEC, metavar='seconds',
+                        help=f'Seconds a task stays in progress. Default is {DEFAULT_TASK_DURATION_SEC}')
+    parser.add_argument('--task_durations', type=parse_task_durations, default={}, metavar='durations',
+                        help='Per operation task durations, e.g. "upload=1,build=10,context=2,sign=3,validation=5"')
+    parser.add_argument('--artifact_size', type=float, default=DEFAULT_ARTIFACT_SIZE / MB, metavar='MB',
+                        help=f'Size of the downloaded app in MB. Default is {DEFAULT_ARTIFACT_SIZE // MB}')
+    parser.add_argument('--obfuscation_map', action='store_true', help='Tasks have deobfuscation scripts')
+    parser.add_argument('--message_interval', type=float, default=0.5, metavar='seconds',
+                        help='Seconds between workflow messages of a task in progress. 0 sends no messages')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_arguments()
+    logging.basicConfig(format='%(message)s', level=logging.INFO)
+    config = MockServerConfig(args.latency, args.task_duration, args.task_durations, int(args.artifact_size * MB),
+                              args.obfuscation_map, args.message_interval)
+    server = MockAppdomeServer(config, args.host, args.port)
+    logging.info(f"Mock Appdome server listening. Use APPDOME_SERVER_BASE_URL={server.base_url}")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.httpd.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,287 @@
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from os.path import abspath, exists, getsize, getmtime, join
+from urllib.parse import parse_qs, urlsplit
+
+from metrics import submit_in_context
+from utils import validate_response, debug_log_request, log_and_exit, get_session
+
+try:
+    import fcntl
+except ImportError:  # Windows - only uploads of the same process are kept apart
+    fcntl = None
+
+MB = 1024 * 1024
+MIN_PART_SIZE = 5 * MB  # S3 rejects smaller parts (except the last one)
+DEFAULT_PART_SIZE = 64 * MB
+DEFAULT_CONCURRENCY = 4
+PART_URLS_KEY = 'part_urls'
+COMPLETE_URL_KEY = 'complete_url'
+# A saved link expiring sooner is not resumed, the remaining parts may take that long to upload
+LINK_EXPIRY_MARGIN_SEC = 300
+LINK_REFUSED_STATUS_CODES = (403,)
+
+# State files claimed by uploads of this process
+_claimed_state_paths = set()
+_claimed_state_paths_lock = threading.Lock()
+
+
+class UploadLinkExpiredError(Exception):
+    """
+    S3 refused a presigned URL of the upload link, e.g. because it expired.
+    """
+
+
+class FilePart:
+    """
+    Read-only file-like view of a byte range of a file, so a part is streamed from disk instead of loaded in memory.
+    """
+    def __init__(self, file_path, offset, size):
+        self._file = open(file_path, 'rb')
+        self._file.seek(offset)
+        self._remaining = size
+        self.len = size
+
+    def __len__(self):
+        return self.len
+
+    def read(self, size=-1):
+        if size is None or size < 0 or size > self._remaining:
+            size = self._remaining
+        data = self._file.read(size)
+        self._remaining -= len(data)
+        return data
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class MultipartUpload:
+    """
+    Uploads a file to S3 in parts, concurrently, using presigned part URLs from the upload link.
+
+    Completed parts are recorded in a state file so a rerun with the same file resumes instead of restarting.
+    The state file of a file and team must be claimed with claim_upload_state() while it is used.
+    """
+    def __init__(self, file_path, link_json, part_size=DEFAULT_PART_SIZE, concurrency=DEFAULT_CONCURRENCY,
+                 num_of_retries=3, team_id=None, resumable=True):
+        """
+        :param file_path: Path of the file to upload
+        :param link_json: Upload link response with 'file_id', 'part_urls' and 'complete_url'
+        :param part_size: Size in bytes of every part but the last
+        :param concurrency: Number of parts uploaded at the same time
+        :param num_of_retries: Attempts per part before the upload fails
+        :param team_id: Team the file is uploaded to, part of the state file key
+        :param resumable: Record the uploaded parts in the state file, and resume from it
+        """
+        self.file_path = file_path
+        self.link_json = link_json
+        self.part_size = part_size
+        self.concurrency = concurrency
+        self.num_of_retries = num_of_retries
+        self.team_id = team_id
+        self.resumable = resumable
+        self.file_size = getsize(file_path)
+        self.etags = {}
+        self._lock = threading.Lock()
+
+    @property
+    def part_count(self):
+        return part_count(self.file_size, self.part_size)
+
+    def upload(self):
+        """
+        Upload the missing parts and complete the multipart upload.
+
+        :return: Response of the complete request
+        """
+        part_urls = self.link_json[PART_URLS_KEY]
+        if len(part_urls) != self.part_count:
+            log_and_exit(f"Upload link has {len(part_urls)} part urls, expected {self.part_count}")
+        self._load_state()
+        missing_parts = [n for n in range(1, self.part_count + 1) if n not in self.etags]
+        logging.info(f"Uploading {len(missing_parts)} of {self.part_count} parts "
+                     f"with {self.concurrency} concurrent uploads")
+
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            futures = [submit_in_context(executor, self._upload_part, n, part_urls[n - 1]) for n in missing_parts]
+            for future in as_completed(futures):
+                future.result()
+
+        response = self._complete()
+        _check_link_accepted(response, "Multipart upload completion")
+        validate_response(response)
+        self._remove_state()
+        return response
+
+    def _upload_part(self, part_number, part_url):
+        offset = (part_number - 1) * self.part_size
+        size = min(self.part_size, self.file_size - offset)
+        for i in range(self.num_of_retries):
+            try:
+                with FilePart(self.file_path, offset, size) as part:
+                    debug_log_request(part_url, headers={'Content-Length': size}, request_type='put')
+                    response = get_session().put(part_url, data=part)
+                _check_link_accepted(response, f"Upload of part {part_number}")
+                validate_response(response)
+                break
+            except UploadLinkExpiredError:
+                raise
+            except Exception as e:
+                if i == self.num_of_retries - 1:
+                    raise Exception(f'Upload of part {part_number} failed. Error: {e}')
+                logging.debug(f'Upload of part {part_number} failed, retrying. Error: {e}')
+
+        with self._lock:
+            self.etags[part_number] = response.headers.get('ETag', '')
+            self._save_state()
+        logging.debug(f"Uploaded part {part_number}/{self.part_count}")
+
+    def _complete(self):
+        # Imported here - xml.sax imports urllib.request, which most runs never need
+        from xml.sax.saxutils import escape
+        parts = ''.join(f"<Part><PartNumber>{n}</PartNumber><ETag>{escape(self.etags[n])}</ETag></Part>"
+                        for n in sorted(self.etags))
+        body = f"<CompleteMultipartUpload>{parts}</CompleteMultipartUpload>"
+        url = self.link_json[COMPLETE_URL_KEY]
+        headers = {'Content-Type': 'application/xml'}
+        debug_log_request(url, headers=headers, data=body)
+        return get_session().post(url, headers=headers, data=body.encode('utf-8'))
+
+    def _load_state(self):
+        if not self.resumable:
+            return
+        state = load_upload_state(self.file_path, self.part_size, self.team_id)
+        if state and state.get('link') == self.link_json:
+            self.etags = {int(n): etag for n, etag in state.get('etags', {}).items()}
+            logging.info(f"Resuming upload of [{self.file_path}], {len(self.etags)} parts already uploaded")
+
+    def _save_state(self):
+        if not self.resumable:
+            return
+        state = {'file_size': self.file_size, 'mtime': getmtime(self.file_path), 'part_size': self.part_size,
+                 'link': self.link_json, 'etags': self.etags}
+        state_path = upload_state_path(self.file_path, self.team_id)
+        with open(state_path + '.tmp', 'w') as f:
+            json.dump(state, f)
+        os.replace(state_path + '.tmp', state_path)
+
+    def _remove_state(self):
+        if self.resumable:
+            remove_upload_state(self.file_path, self.team_id)
+
+
+def part_count(file_size, part_size):
+    return max(1, -(-file_size // part_size))
+
+
+def _check_link_accepted(response, request_name):
+    if response.status_code in LINK_REFUSED_STATUS_CODES:
+        raise UploadLinkExpiredError(f"{request_name} was refused (status code {response.status_code}). "
+                                     f"The upload link may have expired. Response: {response.text}")
+
+
+def link_expiry(link_json):
+    """
+    :return: Epoch time the presigned part URLs of the upload link expire at, or None when they don't tell
+    """
+    part_urls = link_json.get(PART_URLS_KEY)
+    if not part_urls:
+        return None
+    query = parse_qs(urlsplit(part_urls[0]).query)
+    try:
+        if 'X-Amz-Date' in query:
+            # Signature V4: signing time and seconds of validity
+            signed = datetime.strptime(query['X-Amz-Date'][0], '%Y%m%dT%H%M%SZ').replace(tzinfo=timezone.utc)
+            return signed.timestamp() + int(query['X-Amz-Expires'][0])
+        if 'Expires' in query:
+            # Signature V2: epoch time
+            return int(query['Expires'][0])
+    except (KeyError, ValueError):
+        pass
+    return None
+
+
+def upload_state_path(file_path, team_id=None):
+    key = hashlib.sha1(f"{team_id or ''}:{abspath(file_path)}".encode('utf-8')).hexdigest()
+    return join(tempfile.gettempdir(), f"appdome-upload-{key}.json")
+
+
+@contextmanager
+def claim_upload_state(file_path, team_id=None):
+    """
+    Claim the state file of the uploads of file_path to team_id, against other threads and processes.
+
+    Concurrent uploads of the same file (e.g. of several fusion sets) each upload with their own link, only the one
+    holding the claim may resume and save the state.
+
+    :return: Context manager of True when the state file was claimed, False when another upload holds it
+    """
+    state_path = upload_state_path(file_path, team_id)
+    with _claimed_state_paths_lock:
+        claimed_here = state_path in _claimed_state_paths
+        _claimed_state_paths.add(state_path)
+    if claimed_here:
+        yield False
+        return
+    lock_file = None
+    try:
+        if fcntl:
+            lock_file = open(state_path + '.lock', 'w')
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                lock_file.close()
+                lock_file = None
+                yield False
+                return
+        yield True
+    finally:
+        if lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+            lock_file.close()
+        with _claimed_state_paths_lock:
+            _claimed_state_paths.discard(state_path)
+
+
+def load_upload_state(file_path, part_size, team_id=None):
+    """
+    Return the saved state of an interrupted multipart upload of the unchanged file_path to team_id, or None.
+    """
+    state_path = upload_state_path(file_path, team_id)
+    if not exists(state_path):
+        return None
+    try:
+        with open(state_path) as f:
+            state = json.load(f)
+    except ValueError:
+        return None
+    if (state.get('file_size') != getsize(file_path) or state.get('mtime') != getmtime(file_path)
+            or state.get('part_size') != part_size):
+        return None
+    expiry = link_expiry(state.get('link') or {})
+    if expiry is not None and expiry - LINK_EXPIRY_MARGIN_SEC < time.time():
+        logging.info(f"Upload link of the interrupted upload of [{file_path}] expired, starting over")
+        remove_upload_state(file_path, team_id)
+        return None
+    return state
+
+
+def remove_upload_state(file_path, team_id=None):
+    state_path = upload_state_path(file_path, team_id)
+    if exists(state_path):
+        os.remove(state_path)
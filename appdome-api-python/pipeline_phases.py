@@ -0,0 +1,50 @@
+# Phases of the whole flow shared by appdome_api.py and appdome_api_sdk.py, so the SDK flow doesn't import
+# everything the app flow needs
+import logging
+
+from build import build
+from build_to_test import build_to_test, init_automation_vendor
+from metrics import phase
+from multipart_upload import DEFAULT_PART_SIZE, DEFAULT_CONCURRENCY
+from status import wait_for_status_complete
+from upload import upload_app
+from utils import validate_response, init_overrides, init_baseline_file, init_certs_pinning, download_to_file
+
+
+@phase('upload')
+def run_upload(api_key, team_id, app_path, multipart=False, part_size=DEFAULT_PART_SIZE,
+               concurrency=DEFAULT_CONCURRENCY, polling_strategy=None, upload_cache=None,
+               verify_upload_cache=False, app_hash=None):
+    app_id = upload_app(api_key, team_id, app_path, multipart, part_size, concurrency, polling_strategy,
+                        upload_cache, verify_upload_cache, app_hash)
+    logging.info(f"Upload done. App-id: {app_id}")
+    return app_id
+
+
+@phase('build')
+def run_build(api_key, team_id, app_id, fusion_set_id, build_overrides, use_diagnostic_logs, build_to_test_vendor,
+              workflow_output_logs=None, baseline_profile=None, cert_pinning_zip=None, polling_strategy=None):
+    build_overrides_json = init_overrides(build_overrides)
+    automation_vendor = init_automation_vendor(build_to_test_vendor).name if build_to_test_vendor else None
+    files = init_certs_pinning(cert_pinning_zip)
+    init_baseline_file(baseline_profile, files)
+    if automation_vendor:
+        build_response = build_to_test(api_key, team_id, app_id, fusion_set_id, automation_vendor,
+                                       overrides=build_overrides_json, use_diagnostic_logs=use_diagnostic_logs,
+                                       files=files)
+    else:
+        build_response = build(api_key, team_id, app_id, fusion_set_id, build_overrides_json, use_diagnostic_logs,
+                               files=files)
+    validate_response(build_response)
+    logging.info(f"Build request started. Response: {build_response.json()}")
+    task_id = build_response.json()['task_id']
+    wait_for_status_complete(api_key, team_id, task_id, operation="build",
+                             workflow_output_logs_path=workflow_output_logs, polling_strategy=polling_strategy)
+    logging.info(f"Build request finished.")
+    return task_id
+
+
+def download_task_file(api_key, team_id, task_id, output_path, download_func):
+    download_to_file(lambda offset: download_func(api_key, team_id, task_id, stream=True, offset=offset),
+                     output_path, resume_id=task_id)
+    logging.info(f"File written to {output_path}")
@@ -0,0 +1,138 @@
+import random
+from abc import ABC, abstractmethod
+
+from utils import log_and_exit
+
+DEFAULT_POLL_INTERVAL = 10
+
+
+class PollingStrategy(ABC):
+    """
+    Decides how long to wait before the next status poll of a task.
+    """
+    @abstractmethod
+    def next_delay(self, poll_count, elapsed_sec, operation=None):
+        """
+        :param poll_count: Number of status polls done so far for the task
+        :param elapsed_sec: Seconds waited so far for the task
+        :param operation: Operation being waited for (upload, build, context, sign), if known
+        :return: Seconds to wait before the next poll
+        """
+        pass
+
+
+class FixedInterval(PollingStrategy):
+    def __init__(self, interval_sec=DEFAULT_POLL_INTERVAL):
+        self.interval_sec = interval_sec
+
+    def next_delay(self, poll_count, elapsed_sec, operation=None):
+        return self.interval_sec
+
+
+class ExponentialBackoff(PollingStrategy):
+    """
+    Starts polling quickly and multiplies the interval by factor after each poll, up to max_interval_sec.
+    Jitter spreads the polls of concurrent tasks so they do not hit the server together.
+    """
+    def __init__(self, initial_sec=1, factor=2, max_interval_sec=30, jitter=0.1):
+        self.initial_sec = initial_sec
+        self.factor = factor
+        self.max_interval_sec = max_interval_sec
+        self.jitter = jitter
+
+    def next_delay(self, poll_count, elapsed_sec, operation=None):
+        delay = min(self.max_interval_sec, self.initial_sec * self.factor ** max(0, poll_count - 1))
+        if self.jitter:
+            delay *= random.uniform(1 - self.jitter, 1 + self.jitter)
+        return delay
+
+
+class FastFirstPoll(PollingStrategy):
+    """
+    Polls once after first_delay_sec, then follows the wrapped strategy. Short tasks finish on the first poll.
+    """
+    def __init__(self, strategy=None, first_delay_sec=1):
+        self.strategy = strategy or FixedInterval()
+        self.first_delay_sec = first_delay_sec
+
+    def next_delay(self, poll_count, elapsed_sec, operation=None):
+        if poll_count <= 1:
+            return self.first_delay_sec
+        return self.strategy.next_delay(poll_count - 1, elapsed_sec, operation)
+
+
+class NearCompletion(PollingStrategy):
+    """
+    Polls every interval_sec until the task gets close to its expected duration, then every tight_interval_sec
+    until it is as late past it. Tasks still running after that window are polled less and less often, waiting
+    backoff times the time they overran the window, up to interval_sec.
+
+    expected_sec is either one duration for every operation or a dict of durations by operation.
+    Operations without an expected duration are polled every interval_sec.
+    """
+    def __init__(self, expected_sec, interval_sec=DEFAULT_POLL_INTERVAL, tight_interval_sec=1, window=0.2,
+                 backoff=0.5):
+        self.expected_sec = expected_sec
+        self.interval_sec = interval_sec
+        self.tight_interval_sec = tight_interval_sec
+        self.window = window
+        self.backoff = backoff
+
+    def next_delay(self, poll_count, elapsed_sec, operation=None):
+        expected_sec = self.expected_sec.get(operation) if isinstance(self.expected_sec, dict) else self.expected_sec
+        if not expected_sec:
+            return self.interval_sec
+        tight_start_sec = expected_sec * (1 - self.window)
+        tight_end_sec = expected_sec * (1 + self.window)
+        if elapsed_sec >= tight_end_sec:
+            overrun_sec = elapsed_sec - tight_end_sec
+            return max(self.tight_interval_sec, min(self.interval_sec, overrun_sec * self.backoff))
+        if elapsed_sec >= tight_start_sec:
+            return self.tight_interval_sec
+        # Do not sleep past the start of the tight polling window
+        return max(self.tight_interval_sec, min(self.interval_sec, tight_start_sec - elapsed_sec))
+
+
+POLLING_STRATEGIES = ['fixed', 'backoff', 'fast_first', 'near_completion']
+
+
+def add_polling_args(parser):
+    parser.add_argument('--polling_strategy', choices=POLLING_STRATEGIES, default='fixed',
+                        help='How to wait between task status polls. '
+                             'fixed: every poll_interval seconds. '
+                             'backoff: exponential backoff with jitter, from 1 second up to poll_interval. '
+                             'fast_first: first poll after 1 second, then every poll_interval seconds. '
+                             'near_completion: every poll_interval seconds, every second close to expected_duration, '
+                             'then backing off up to poll_interval')
+    parser.add_argument('--poll_interval', type=float, default=DEFAULT_POLL_INTERVAL, metavar='seconds',
+                        help=f'Status poll interval (max interval for backoff). Default is {DEFAULT_POLL_INTERVAL}')
+    parser.add_argument('--expected_duration', metavar='seconds_or_operation_durations',
+                        help='Expected task duration for near_completion polling. '
+                             'Either seconds, or per operation, e.g. "upload=20,build=300,context=30,sign=60"')
+
+
+def init_polling_strategy(args):
+    if args.poll_interval <= 0:
+        log_and_exit("poll_interval must be positive")
+    if args.polling_strategy == 'backoff':
+        return ExponentialBackoff(max_interval_sec=args.poll_interval)
+    if args.polling_strategy == 'fast_first':
+        return FastFirstPoll(FixedInterval(args.poll_interval))
+    if args.polling_strategy == 'near_completion':
+        if not args.expected_duration:
+            log_and_exit("expected_duration must be specified when using near_completion polling")
+        return NearCompletion(parse_expected_duration(args.expected_duration), args.poll_interval)
+    return FixedInterval(args.poll_interval)
+
+
+def parse_expected_duration(value):
+    try:
+        if '=' not in value:
+            return float(value)
+        durations = {}
+        for item in value.split(','):
+            operation, seconds = item.split('=')
+            durations[operation.strip()] = float(seconds)
+        return durations
+    except ValueError:
+        log_and_exit(f"Invalid expected_duration [{value}]")
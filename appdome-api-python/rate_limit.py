@@ -0,0 +1,216 @@
+import logging
+import random
+import re
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from os import getenv
+from urllib.parse import urlsplit
+
+from requests.adapters import BaseAdapter
+from requests.exceptions import UnrewindableBodyError
+from requests.utils import rewind_body
+
+from utils import log_and_exit
+
+RATE_LIMITS_ENV = 'APPDOME_RATE_LIMITS'
+RATE_LIMIT_RETRIES_ENV = 'APPDOME_RATE_LIMIT_RETRIES'
+# Requests per second by endpoint class. 0 is unlimited.
+DEFAULT_RATE_LIMITS = {'status': 5, 'upload': 2, 'task': 2, 'other': 0}
+DEFAULT_RATE_LIMIT_RETRIES = 5
+# Seconds of requests a bucket can hold, so short bursts are not delayed
+BURST_SEC = 2
+THROTTLED_STATUS_CODES = (429, 503)
+# A 503 (e.g. of a proxy) may come after the server accepted the request, these are retried only when the server
+# asked for it (429 or Retry-After), so a task is never started twice
+NON_IDEMPOTENT_METHODS = ('POST', 'PATCH')
+MAX_RETRY_AFTER_SEC = 300
+MAX_BACKOFF_SEC = 60
+UPLOAD_PATH_RE = re.compile(r'/(upload|upload-link|upload-using-link|validation/upload)(/|$)')
+
+_rate_limiter = None
+_rate_limiter_lock = threading.Lock()
+
+
+def endpoint_class(method, url):
+    """
+    :return: 'status' for status polls, 'upload' for app uploads, 'task' for the other POST requests
+             (e.g. task creation) or 'other'
+    """
+    path = urlsplit(url).path.rstrip('/')
+    if path.endswith('/status'):
+        return 'status'
+    if UPLOAD_PATH_RE.search(path):
+        return 'upload'
+    if method == 'POST':
+        return 'task'
+    return 'other'
+
+
+class TokenBucket:
+    """
+    Lets rate requests per second through, with bursts of up to capacity requests.
+    """
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or max(1, rate * BURST_SEC)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Block until a request may be sent.
+
+        :return: Seconds waited
+        """
+        waited = 0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                if self.rate:
+                    self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if now >= self.paused_until and not self.rate:
+                    return waited
+                if now >= self.paused_until and self.tokens >= 1:
+                    self.tokens -= 1
+                    return waited
+                delay = max(self.paused_until - now, (1 - self.tokens) / self.rate if self.rate else 0)
+            time.sleep(delay)
+            waited += delay
+
+    def pause(self, delay_sec):
+        """
+        Hold every request of the bucket for delay_sec, e.g. when the server asked to retry later.
+        """
+        with self._lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + delay_sec)
+
+
+class RateLimiter:
+    """
+    Token buckets by endpoint class, shared by every thread and session of the process.
+    """
+    def __init__(self, rate_limits=None):
+        rate_limits = {**DEFAULT_RATE_LIMITS, **(rate_limits or {})}
+        self.buckets = {name: TokenBucket(rate) for name, rate in rate_limits.items()}
+
+    def bucket(self, name):
+        return self.buckets.get(name) or self.buckets['other']
+
+
+def parse_rate_limits(value):
+    """
+    Parse requests per second by endpoint class, e.g. "status=5,task=1".
+    """
+    rate_limits = {}
+    for item in value.split(','):
+        if not item.strip():
+            continue
+        name, _, rate = item.partition('=')
+        name = name.strip()
+        if name not in DEFAULT_RATE_LIMITS:
+            log_and_exit(f"Unknown endpoint class [{name}] in {RATE_LIMITS_ENV}. "
+                         f"Must be one of {', '.join(DEFAULT_RATE_LIMITS)}")
+        try:
+            rate_limits[name] = float(rate)
+        except ValueError:
+            log_and_exit(f"Rate limit of [{name}] in {RATE_LIMITS_ENV} must be a number of requests per second")
+        if rate_limits[name] < 0:
+            log_and_exit(f"Rate limit of [{name}] in {RATE_LIMITS_ENV} must not be negative")
+    return rate_limits
+
+
+def get_rate_limiter():
+    """
+    Return the process rate limiter, with the limits of environment variable 'APPDOME_RATE_LIMITS'
+    (e.g. "status=5,upload=2,task=2,other=0" requests per second, 0 is unlimited).
+    """
+    global _rate_limiter
+    with _rate_limiter_lock:
+        if _rate_limiter is None:
+            _rate_limiter = RateLimiter(parse_rate_limits(getenv(RATE_LIMITS_ENV, '')))
+        return _rate_limiter
+
+
+def retry_after_sec(response):
+    """
+    :return: Seconds asked by the Retry-After header (seconds or HTTP date), or None
+    """
+    value = response.headers.get('Retry-After')
+    if not value:
+        return None
+    try:
+        delay = float(value)
+    except ValueError:
+        try:
+            delay = parsedate_to_datetime(value).timestamp() - time.time()
+        except (TypeError, ValueError):
+            return None
+    return min(max(delay, 0), MAX_RETRY_AFTER_SEC)
+
+
+def _should_retry(request, response):
+    if response.status_code not in THROTTLED_STATUS_CODES:
+        return False
+    if request.method in NON_IDEMPOTENT_METHODS:
+        return response.status_code == 429 or 'Retry-After' in response.headers
+    return True
+
+
+def _rewind(request):
+    """
+    Prepare the body of a request to be sent again. Streamed bodies (files, multipart encoders) are sought back
+    to where they started.
+
+    :return: False when the body can't be sent again
+    """
+    if request.body is None or isinstance(request.body, (bytes, str)):
+        return True
+    try:
+        rewind_body(request)
+        return True
+    except UnrewindableBodyError:
+        return False
+
+
+class RateLimitedAdapter(BaseAdapter):
+    """
+    Transport adapter sending requests through another adapter at the rate of their endpoint class.
+
+    Throttled responses (429 and 503) are retried after their Retry-After delay, or an exponential backoff, and
+    the endpoint class is held for every thread meanwhile. POST requests, which may start a task, are only retried on
+    429 or on 503 with a Retry-After header. Requests whose streamed body can't be rewound are not
+    retried.
+    """
+    def __init__(self, adapter, rate_limiter=None, max_retries=None):
+        super().__init__()
+        self.adapter = adapter
+        self.rate_limiter = rate_limiter or get_rate_limiter()
+        self.max_retries = max_retries if max_retries is not None else int(getenv(RATE_LIMIT_RETRIES_ENV,
+                                                                                  DEFAULT_RATE_LIMIT_RETRIES))
+
+    def send(self, request, **kwargs):
+        name = endpoint_class(request.method, request.url)
+        bucket = self.rate_limiter.bucket(name)
+        attempt = 0
+        while True:
+            waited = bucket.acquire()
+            if waited:
+                logging.debug(f"Rate limited {request.method} {urlsplit(request.url).path} for {waited:.2f} seconds")
+            response = self.adapter.send(request, **kwargs)
+            if not _should_retry(request, response) or attempt >= self.max_retries or not _rewind(request):
+                return response
+            delay = retry_after_sec(response)
+            if delay is None:
+                delay = min(MAX_BACKOFF_SEC, 2 ** attempt) * random.uniform(0.5, 1)
+            attempt += 1
+            logging.info(f"{request.method} {urlsplit(request.url).path} throttled (status code "
+                         f"{response.status_code}). Retrying in {delay:.1f} seconds ({attempt}/{self.max_retries})")
+            response.close()
+            bucket.pause(delay)
+
+    def close(self):
+        self.adapter.close()
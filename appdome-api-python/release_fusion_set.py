@@ -1,8 +1,8 @@
 import argparse
 import logging
-import requests
 
-from utils import (SERVER_API_V1_URL, request_headers, validate_response, add_common_args, init_common_args, build_url)
+from utils import (SERVER_API_V1_URL, request_headers, validate_response, add_common_args, init_common_args, build_url,
+                   get_session)
 
 
 def release_fusion_set(api_key, fusion_set_id, team_id):
@@ -10,7 +10,7 @@ def release_fusion_set(api_key, fusion_set_id, team_id):
     url = build_url(SERVER_API_V1_URL, 'release_fs', fusion_set_id)
     params = { 'team_id': team_id }
    
-    return requests.post(url, headers=headers, params=params)
+    return get_session().post(url, headers=headers, params=params)
 
 
 def parse_arguments():
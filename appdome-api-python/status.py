@@ -3,10 +3,26 @@ import logging
 from datetime import datetime
 from time import sleep
 
-import requests
-
 from utils import (TASKS_URL, request_headers, JSON_CONTENT_TYPE, validate_response,
-                   log_and_exit, add_common_args, init_common_args, build_url, team_params)
+                   log_and_exit, add_common_args, init_common_args, build_url, team_params, get_session)
+from polling import FixedInterval, add_polling_args, init_polling_strategy
+from workflow_log import open_workflow_log
+from metrics import record_poll
+
+_status_watcher = None
+
+
+def set_status_watcher(watcher):
+    """
+    Make wait_for_status_complete wait through a shared status_watcher.StatusWatcher, so that the tasks of
+    concurrent pipelines are polled from a single thread. Pass None to poll from the waiting thread again.
+    """
+    global _status_watcher
+    _status_watcher = watcher
+
+
+def get_status_watcher():
+    return _status_watcher
 
 
 def status(api_key, team_id, task_id, url, last_date=None, messages=None):
@@ -20,22 +36,30 @@ def status(api_key, team_id, task_id, url, last_date=None, messages=None):
             request_url = f"{url}?messages=true"
     else:
         request_url = url
-    return requests.get(request_url, headers=headers, params=params)
+    return get_session().get(request_url, headers=headers, params=params)
 
 
 def wait_for_status_complete(api_key, team_id, task_id, url=TASKS_URL, interval_sec=10, timeout_sec=3600,
-                             num_of_retries=3, operation=None, workflow_output_logs_path=None):
+                             num_of_retries=3, operation=None, workflow_output_logs_path=None, polling_strategy=None):
+    if _status_watcher:
+        _status_watcher.wait(api_key, team_id, task_id, url=url, interval_sec=interval_sec, timeout_sec=timeout_sec,
+                             num_of_retries=num_of_retries, operation=operation,
+                             workflow_output_logs_path=workflow_output_logs_path, polling_strategy=polling_strategy)
+        return
+
+    polling_strategy = polling_strategy or FixedInterval(interval_sec)
+    poll_count = 0
     accumulated_sleep = 0
     status_value = 'not initialized'
-    file_handle = open(workflow_output_logs_path, 'a') if workflow_output_logs_path else None
+    workflow_log = open_workflow_log(workflow_output_logs_path) if workflow_output_logs_path else None
     status_response_json = ''
     last_date = ''
 
     # Determine whether to use detailed logging based on the URL
-    detailed_logging = operation != "upload" and file_handle is not None
+    detailed_logging = operation != "upload" and workflow_log is not None
 
-    if file_handle:
-        file_handle.write(operation + ":\n")
+    if workflow_log:
+        workflow_log.start_operation(operation, task_id)
 
     while accumulated_sleep <= timeout_sec:
         status_response = None
@@ -55,36 +79,52 @@ def wait_for_status_complete(api_key, team_id, task_id, url=TASKS_URL, interval_
                 logging.debug(f'Wait for status Error. Error: {e}')
                 sleep(interval_sec)
 
+        poll_count += 1
+        record_poll()
         validate_response(status_response)
         status_response_json = status_response.json()
         status_value = status_response_json.get('status', '')
 
         if status_value == 'progress':
-            if detailed_logging:
-                messages = status_response_json.get('messages', [])
-                for message in messages:
-                    message_text = message.get('message', {}).get('text', '')
-                    message_type = message.get('message_type', '')
+            last_date = report_status_progress(status_response_json, detailed_logging, workflow_log, last_date,
+                                               operation, task_id)
+            delay = polling_strategy.next_delay(poll_count, accumulated_sleep, operation)
+            sleep(delay)
+            accumulated_sleep += delay
+
+        else:
+            print('', flush=True)
+            break
+
+    check_final_status(status_value, status_response_json, accumulated_sleep, timeout_sec)
+
 
-                    if message_text:
-                        print(f" - {message_text}")
-                        if message_text:
-                            if file_handle:
-                                file_handle.write(message_text + '\n')
+def report_status_progress(status_response_json, detailed_logging, workflow_log, last_date, operation=None,
+                           task_id=None):
+    """
+    Print the progress of a task in progress, and write its new workflow messages to the workflow log.
 
-                if messages:
-                    last_date = messages[-1].get('creation_time')
+    :return: Creation time of the last message seen, to request only newer messages on the next poll
+    """
+    if not detailed_logging:
+        print('.', end='', flush=True)
+        return last_date
 
+    messages = status_response_json.get('messages', [])
+    for message in messages:
+        message_text = message.get('message', {}).get('text', '')
+        if message_text:
+            if workflow_log:
+                workflow_log.write_message(message_text, operation, task_id, message.get('creation_time'))
             else:
-                print('.', end='', flush=True)
+                print(f" - {message_text}")
 
-            sleep(interval_sec)
-            accumulated_sleep += interval_sec
+    if messages:
+        last_date = messages[-1].get('creation_time')
+    return last_date
 
-        else:
-            print('', flush=True)
-            break
 
+def check_final_status(status_value, status_response_json, accumulated_sleep, timeout_sec):
     if accumulated_sleep > timeout_sec:
         log_and_exit(f"\nTask did not complete in the specified timeout of: {timeout_sec} seconds")
 
@@ -104,13 +144,14 @@ def _get_obfuscation_map_status(api_key, team_id, task_id):
 def parse_arguments():
     parser = argparse.ArgumentParser(description='Wait for status of task to be done')
     add_common_args(parser, add_task_id=True)
+    add_polling_args(parser)
     return parser.parse_args()
 
 
 def main():
     args = parse_arguments()
     init_common_args(args)
-    wait_for_status_complete(args.api_key, args.team_id, args.task_id)
+    wait_for_status_complete(args.api_key, args.team_id, args.task_id, polling_strategy=init_polling_strategy(args))
     logging.info("Task complete")
 
 
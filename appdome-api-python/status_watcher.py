@@ -0,0 +1,183 @@
+import heapq
+import itertools
+import logging
+import threading
+import time
+from concurrent.futures import Future
+from contextvars import copy_context
+
+from polling import FixedInterval
+from status import status, report_status_progress, check_final_status
+from utils import TASKS_URL, validate_response
+from workflow_log import open_workflow_log
+from metrics import record_poll
+
+
+class _WatchedTask:
+    def __init__(self, api_key, team_id, task_id, url, operation, interval_sec, timeout_sec, num_of_retries,
+                 workflow_output_logs_path, polling_strategy):
+        self.api_key = api_key
+        self.team_id = team_id
+        self.task_id = task_id
+        self.url = url
+        self.operation = operation
+        self.interval_sec = interval_sec
+        self.timeout_sec = timeout_sec
+        self.num_of_retries = num_of_retries
+        self.polling_strategy = polling_strategy or FixedInterval(interval_sec)
+        self.future = Future()
+        # Polls run in the context of the watching caller, so they are counted in its metrics phase
+        self.context = copy_context()
+        self.poll_count = 0
+        self.failed_polls = 0
+        self.accumulated_sleep = 0
+        self.last_date = ''
+        self.status_response_json = {}
+        self.workflow_log = open_workflow_log(workflow_output_logs_path) if workflow_output_logs_path else None
+        self.detailed_logging = operation != "upload" and self.workflow_log is not None
+        if self.workflow_log:
+            self.workflow_log.start_operation(operation, task_id)
+
+
+class StatusWatcher:
+    """
+    Waits for many upload and build tasks from a single thread.
+
+    Every watched task is kept in a priority queue by the time of its next status poll. The watcher thread sleeps
+    until the earliest poll is due, polls that task and schedules its next poll with the task's polling strategy.
+    When a task is done its future is resolved with the last status response, or fails like
+    status.wait_for_status_complete does when the task failed or timed out.
+    """
+    def __init__(self, name='status-watcher'):
+        self.name = name
+        self._queue = []
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+        self._thread = None
+        self._closed = False
+
+    def watch(self, api_key, team_id, task_id, url=TASKS_URL, interval_sec=10, timeout_sec=3600, num_of_retries=3,
+              operation=None, workflow_output_logs_path=None, polling_strategy=None, callback=None):
+        """
+        Start watching a task. Takes the same arguments as status.wait_for_status_complete.
+
+        :param callback: Called with the task future when the task is done
+        :return: concurrent.futures.Future resolved with the final status response json
+        """
+        task = _WatchedTask(api_key, team_id, task_id, url, operation, interval_sec, timeout_sec, num_of_retries,
+                            workflow_output_logs_path, polling_strategy)
+        if callback:
+            task.future.add_done_callback(callback)
+        with self._condition:
+            if self._closed:
+                raise RuntimeError("Status watcher is closed")
+            self._schedule(task, time.monotonic())
+            if not self._thread:
+                self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+                self._thread.start()
+        return task.future
+
+    def wait(self, api_key, team_id, task_id, **kwargs):
+        """
+        Watch a task and block until it is done.
+
+        :return: Final status response json
+        """
+        return self.watch(api_key, team_id, task_id, **kwargs).result()
+
+    def close(self):
+        """
+        Stop the watcher thread. Tasks still watched fail.
+        """
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+            thread = self._thread
+        if thread and thread is not threading.current_thread():
+            thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _schedule(self, task, poll_time):
+        heapq.heappush(self._queue, (poll_time, next(self._sequence), task))
+        self._condition.notify()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._closed and (not self._queue or self._queue[0][0] > time.monotonic()):
+                    self._condition.wait(self._queue[0][0] - time.monotonic() if self._queue else None)
+                if self._closed:
+                    remaining, self._queue = self._queue, []
+                    break
+                _, _, task = heapq.heappop(self._queue)
+            next_delay = task.context.run(self._poll, task)
+            if next_delay is not None:
+                with self._condition:
+                    self._schedule(task, time.monotonic() + next_delay)
+
+        for _, _, task in remaining:
+            self._finish(task, exception=RuntimeError(f"Status watcher closed while waiting for task {task.task_id}"))
+
+    def _poll(self, task):
+        """
+        Poll the status of a task once.
+
+        :return: Seconds until the next poll, or None when the task is done
+        """
+        if task.future.cancelled():
+            return None
+        if task.accumulated_sleep > task.timeout_sec:
+            return self._check_final_status(task, 'not completed')
+
+        try:
+            status_response = status(task.api_key, task.team_id, task.task_id, task.url,
+                                     task.last_date if task.detailed_logging else None, task.detailed_logging)
+            task.failed_polls = 0
+        except Exception as e:
+            task.failed_polls += 1
+            if task.failed_polls >= task.num_of_retries:
+                self._finish(task, exception=Exception(f'Wait for status Error. Error: {e}'))
+                return None
+            logging.debug(f'Wait for status Error. Error: {e}')
+            return task.interval_sec
+
+        task.poll_count += 1
+        record_poll()
+        try:
+            validate_response(status_response)
+            task.status_response_json = status_response.json()
+            status_value = task.status_response_json.get('status', '')
+            if status_value != 'progress':
+                return self._check_final_status(task, status_value)
+            task.last_date = report_status_progress(task.status_response_json, task.detailed_logging,
+                                                    task.workflow_log, task.last_date, task.operation, task.task_id)
+            delay = task.polling_strategy.next_delay(task.poll_count, task.accumulated_sleep, task.operation)
+        except Exception as e:
+            self._finish(task, exception=e)
+            return None
+        task.accumulated_sleep += delay
+        return delay
+
+    def _check_final_status(self, task, status_value):
+        try:
+            check_final_status(status_value, task.status_response_json, task.accumulated_sleep, task.timeout_sec)
+        except Exception as e:
+            self._finish(task, exception=e)
+        else:
+            logging.info(f"Task {task.task_id} {status_value}")
+            self._finish(task, result=task.status_response_json)
+        return None
+
+    @staticmethod
+    def _finish(task, result=None, exception=None):
+        if not task.future.set_running_or_notify_cancel():
+            return
+        if exception:
+            task.future.set_exception(exception)
+        else:
+            task.future.set_result(result)
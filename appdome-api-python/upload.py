@@ -1,26 +1,38 @@
 import argparse
+import hashlib
+import json
 import logging
-from os.path import basename
-
-import requests
+from contextlib import nullcontext
+from os.path import basename, getsize
 
 from utils import (SERVER_API_V1_URL, UPLOAD_URL, request_headers, empty_files, validate_response, debug_log_request, 
- 									  add_common_args, log_and_exit, init_common_args, build_url, team_params)
-from status import wait_for_status_complete
+ 									  add_common_args, log_and_exit, init_common_args, build_url, team_params, get_session, file_sha256,
+                   SERVER_BASE_URL)
+from status import wait_for_status_complete, status
+from cache import PersistentCache, cache_file_path, DEFAULT_CACHE_TTL_SEC, DEFAULT_CACHE_MAX_ENTRIES
+from polling import add_polling_args, init_polling_strategy
+from multipart_upload import (MultipartUpload, UploadLinkExpiredError, claim_upload_state, load_upload_state,
+                              remove_upload_state, part_count, DEFAULT_PART_SIZE, DEFAULT_CONCURRENCY, MIN_PART_SIZE, MB, PART_URLS_KEY)
+
+UPLOAD_CACHE_FILE = 'upload_cache.json'
 
 
-def get_upload_link(api_key, team_id):
+def get_upload_link(api_key, team_id, parts=None):
     url = build_url(SERVER_API_V1_URL, 'upload-link')
     params = team_params(team_id)
+    if parts:
+        params['parts'] = parts
     headers = request_headers(api_key)
     debug_log_request(url, headers, params=params, request_type='get')
-    return requests.get(url, headers=headers, params=params)
+    return get_session().get(url, headers=headers, params=params)
 
 
 def put_file_in_aws(file_path, aws_url):
+    # Pass the open file so the body is streamed from disk instead of read into memory
+    headers = {'Content-Length': str(getsize(file_path))}
     with open(file_path, 'rb') as f:
-        debug_log_request(aws_url, request_type='put')
-        return requests.put(aws_url, data=f.read())
+        debug_log_request(aws_url, headers=headers, request_type='put')
+        return get_session().put(aws_url, headers=headers, data=f)
 
 
 def upload_using_link(api_key, team_id, file_id, file_name):
@@ -30,42 +42,188 @@ def upload_using_link(api_key, team_id, file_id, file_name):
     headers = request_headers(api_key)
     body = {'file_app_id': file_id, 'file_name': file_name}
     debug_log_request(url, params=params, data=body)
-    return requests.post(url, headers=headers, params=params, data=body, files=empty_files())
-
-
-def upload(api_key, team_id, file_path):
+    return get_session().post(url, headers=headers, params=params, data=body, files=empty_files())
+
+
+def upload_file(api_key, team_id, file_path, multipart=False, part_size=DEFAULT_PART_SIZE,
+                concurrency=DEFAULT_CONCURRENCY):
+    """
+    Upload an app file to S3 with a new upload link, or resume an interrupted multipart upload of the same file.
+
+    :return: File id of the uploaded file
+    """
+    with claim_upload_state(file_path, team_id) if multipart else nullcontext(False) as resumable:
+        if multipart and not resumable:
+            logging.info(f"Another upload of [{file_path}] is running. This upload won't be resumable")
+        state = load_upload_state(file_path, part_size, team_id) if resumable else None
+        upload_link_json = state['link'] if state else _get_upload_link_json(api_key, team_id, file_path, multipart,
+                                                                              part_size)
+        file_id = upload_link_json.get('file_id')
+        if multipart and file_id and upload_link_json.get(PART_URLS_KEY):
+            logging.info(f"Uploading file id {file_id} in {part_count(getsize(file_path), part_size)} parts")
+            try:
+                MultipartUpload(file_path, upload_link_json, part_size, concurrency, team_id=team_id,
+                                resumable=resumable).upload()
+            except UploadLinkExpiredError as e:
+                if not state:
+                    raise
+                # The saved link of the interrupted upload expired, its uploaded parts are lost
+                logging.info(f"Saved upload link was refused, uploading again with a new link. Error: {e}")
+                remove_upload_state(file_path, team_id)
+                upload_link_json = _get_upload_link_json(api_key, team_id, file_path, multipart, part_size)
+                file_id = upload_link_json.get('file_id')
+                MultipartUpload(file_path, upload_link_json, part_size, concurrency, team_id=team_id).upload()
+        else:
+            aws_url = upload_link_json.get('url')
+            if not aws_url or not file_id:
+                log_and_exit(f'Error in upload link response: {upload_link_json}')
+            if multipart:
+                logging.info("Upload link does not support multipart upload. Uploading in a single request")
+            logging.info(f"Uploading file id {file_id}")
+            aws_put_response = put_file_in_aws(file_path, aws_url)
+            validate_response(aws_put_response)
+    return file_id
+
+
+def upload(api_key, team_id, file_path, multipart=False, part_size=DEFAULT_PART_SIZE,
+           concurrency=DEFAULT_CONCURRENCY, polling_strategy=None):
     logging.info(f"Preparing to upload [{file_path}]")
-    upload_link_response = get_upload_link(api_key, team_id)
-    validate_response(upload_link_response)
-    upload_link_json = upload_link_response.json()
-    aws_url = upload_link_json.get('url')
-    file_id = upload_link_json.get('file_id')
-    if not aws_url or not file_id:
-        log_and_exit('Error in upload link response: ' + upload_link_response.text)
-
-    logging.info(f"Uploading file id {file_id}")
-    aws_put_response = put_file_in_aws(file_path, aws_url)
-    validate_response(aws_put_response)
+    file_id = upload_file(api_key, team_id, file_path, multipart, part_size, concurrency)
     app = upload_using_link(api_key, team_id, file_id, basename(file_path))
     validate_response(app)
     app_id = app.json()['id']
-    wait_for_status_complete(api_key, team_id, app_id, url=UPLOAD_URL, operation="upload")
+    wait_for_status_complete(api_key, team_id, app_id, url=UPLOAD_URL, operation="upload",
+                             polling_strategy=polling_strategy)
     return app
 
 
+def upload_app(api_key, team_id, file_path, multipart=False, part_size=DEFAULT_PART_SIZE,
+               concurrency=DEFAULT_CONCURRENCY, polling_strategy=None, upload_cache=None, verify_upload_cache=False,
+               app_hash=None):
+    """
+    Upload an app, unless upload_cache holds an upload of the same file to the same team.
+
+    :param upload_cache: PersistentCache of previous uploads by content hash, None to always upload
+    :param verify_upload_cache: Check with the server that a cached app id is still a completed upload before using it
+    :param app_hash: SHA-256 of the app file, when already computed
+    :return: App id
+    """
+    cache_key = upload_cache_key(api_key, team_id, file_path, app_hash) if upload_cache else None
+    if cache_key:
+        app_id = get_cached_app_id(api_key, team_id, upload_cache, cache_key, verify_upload_cache)
+        if app_id:
+            return app_id
+
+    upload_response = upload(api_key, team_id, file_path, multipart, part_size, concurrency, polling_strategy)
+    validate_response(upload_response)
+    app_id = upload_response.json()['id']
+    if cache_key:
+        upload_cache.put(cache_key, {'app_id': app_id, 'team_id': team_id, 'file_name': basename(file_path)})
+    return app_id
+
+
+def upload_cache_key(api_key, team_id, file_path, app_hash=None):
+    """
+    Hash of the server, account (API key), team and app content of an upload. App ids of other servers or
+    accounts are never reused.
+
+    :param app_hash: SHA-256 of the app file, when already computed
+    :return: Hex digest identifying the upload
+    """
+    key_inputs = {
+        'server': SERVER_BASE_URL,
+        'api_key': hashlib.sha256((api_key or '').encode('utf-8')).hexdigest(),
+        'team_id': team_id or '',
+        'app': app_hash or file_sha256(file_path)
+    }
+    return hashlib.sha256(json.dumps(key_inputs, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def get_cached_app_id(api_key, team_id, upload_cache, cache_key, verify=False):
+    cached = upload_cache.get(cache_key)
+    if not cached:
+        return None
+    app_id = cached['app_id']
+    if verify and not is_app_uploaded(api_key, team_id, app_id):
+        logging.info(f"Cached app id {app_id} is no longer available. Uploading again")
+        upload_cache.delete(cache_key)
+        return None
+    logging.info(f"The same app was already uploaded. Using cached app id {app_id}")
+    return app_id
+
+
+def is_app_uploaded(api_key, team_id, app_id):
+    try:
+        status_response = status(api_key, team_id, app_id, UPLOAD_URL)
+        return status_response.status_code == 200 and status_response.json().get('status') == 'completed'
+    except Exception as e:
+        logging.debug(f"Couldn't get status of app id {app_id}. Error: {e}")
+        return False
+
+
+def _get_upload_link_json(api_key, team_id, file_path, multipart, part_size):
+    parts = part_count(getsize(file_path), part_size) if multipart else None
+    upload_link_response = get_upload_link(api_key, team_id, parts)
+    validate_response(upload_link_response)
+    return upload_link_response.json()
+
+
+def add_multipart_upload_args(parser):
+    parser.add_argument('-mu', '--multipart_upload', action='store_true',
+                        help='Upload the app to S3 in concurrent parts when the upload link supports it')
+    parser.add_argument('--upload_part_size', type=int, default=DEFAULT_PART_SIZE // MB, metavar='part_size_mb',
+                        help=f'Multipart upload part size in MB. Default is {DEFAULT_PART_SIZE // MB}, '
+                             f'minimum is {MIN_PART_SIZE // MB}')
+    parser.add_argument('--upload_concurrency', type=int, default=DEFAULT_CONCURRENCY, metavar='concurrency',
+                        help=f'Number of parts uploaded at the same time. Default is {DEFAULT_CONCURRENCY}')
+
+
+def add_upload_cache_args(parser):
+    parser.add_argument('-uc', '--upload_cache', action='store_true',
+                        help='Skip the upload when the same app file was already uploaded to the team, '
+                             'using the cached app id')
+    parser.add_argument('--verify_upload_cache', action='store_true',
+                        help='Check with Appdome that a cached app id is still available before using it')
+    parser.add_argument('--upload_cache_ttl', type=float, default=DEFAULT_CACHE_TTL_SEC / 3600, metavar='hours',
+                        help=f'Hours a cached upload stays valid. Default is {DEFAULT_CACHE_TTL_SEC // 3600}')
+    parser.add_argument('--upload_cache_max_entries', type=int, default=DEFAULT_CACHE_MAX_ENTRIES,
+                        metavar='max_entries',
+                        help=f'Max number of cached uploads, least recently used are evicted. '
+                             f'Default is {DEFAULT_CACHE_MAX_ENTRIES}')
+
+
+def init_upload_cache(args):
+    if not args.upload_cache:
+        return None
+    return PersistentCache(cache_file_path(UPLOAD_CACHE_FILE), args.upload_cache_ttl * 3600,
+                           args.upload_cache_max_entries)
+
+
+def validate_multipart_upload_args(args):
+    if args.upload_part_size * MB < MIN_PART_SIZE:
+        log_and_exit(f"upload_part_size must be at least {MIN_PART_SIZE // MB} MB")
+    if args.upload_concurrency < 1:
+        log_and_exit("upload_concurrency must be at least 1")
+
+
 def parse_arguments():
     parser = argparse.ArgumentParser(description='Upload app to Appdome')
     add_common_args(parser)
     parser.add_argument('-a', '--app', required=True, metavar='application_file', help='Upload app file input path')
+    add_multipart_upload_args(parser)
+    add_upload_cache_args(parser)
+    add_polling_args(parser)
     return parser.parse_args()
 
 
 def main():
     args = parse_arguments()
     init_common_args(args)
-    r = upload(args.api_key, args.team_id, args.app)
-    validate_response(r)
-    logging.info(f"Upload success: App id: {r.json()['id']}")
+    validate_multipart_upload_args(args)
+    app_id = upload_app(args.api_key, args.team_id, args.app, args.multipart_upload, args.upload_part_size * MB,
+                        args.upload_concurrency, init_polling_strategy(args), init_upload_cache(args),
+                        args.verify_upload_cache)
+    logging.info(f"Upload success: App id: {app_id}")
 
 
 if __name__ == '__main__':
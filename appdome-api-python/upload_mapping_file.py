@@ -1,5 +1,8 @@
 import argparse
 import logging
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from os.path import exists
 from crashlytics import Crashlytics
 from datadog import DataDog
 from utils import init_logging
@@ -21,23 +24,39 @@ def upload_mapping_file(deobfuscation_mapping_file, fire_base_app_id, data_dog_a
     :param data_dog_api_key: Datadog API key (optional)
     :return: None
     """
-    uploaded = False  # This will track whether any upload has started
+    services = []
     if fire_base_app_id:
-        logging.info("Uploading deobfuscation mapping file to Crashlytics...")
-        crashlytics = Crashlytics(deobfuscation_script_output=deobfuscation_mapping_file,
-                                  firebase_app_id=fire_base_app_id)
-        crashlytics.upload_deobfuscation_map()
-        uploaded = True
+        services.append(("Crashlytics", Crashlytics(deobfuscation_script_output=deobfuscation_mapping_file,
+                                                    firebase_app_id=fire_base_app_id)))
     if data_dog_api_key:
-        logging.info("Uploading deobfuscation mapping file to Data Dog...")
-        datadog = DataDog(deobfuscation_script_output=deobfuscation_mapping_file,
-                          dd_api_key=data_dog_api_key)
-        datadog.upload_deobfuscation_map()
-        uploaded = True
+        services.append(("Data Dog", DataDog(deobfuscation_script_output=deobfuscation_mapping_file,
+                                             dd_api_key=data_dog_api_key)))
 
-    if not uploaded:
+    if not services:
         logging.warning("Invalid arguments! You must provide the correct combination of arguments depending on "
                         "the upload: firebase_app_id or datadog_api_key are mandatory inputs.")
+        return
+    if not exists(deobfuscation_mapping_file):
+        logging.warning("Missing deobfuscation script. Skipping code deobfuscation mapping file upload.")
+        return
+
+    # The zip file is opened once and its members are read by all services at the same time
+    with zipfile.ZipFile(deobfuscation_mapping_file, "r") as zip_file:
+        with ThreadPoolExecutor(max_workers=len(services)) as executor:
+            list(executor.map(lambda service: upload_to_service(service, zip_file), services))
+
+
+def upload_to_service(service, zip_file):
+    """
+    Upload the mapping file of an open deobfuscation zip file to one crash analytics service.
+
+    :param service: (name, CrashAnalytics) tuple
+    :param zip_file: Open deobfuscation script zip file
+    :return: None
+    """
+    name, crash_analytics = service
+    logging.info(f"Uploading deobfuscation mapping file to {name}...")
+    crash_analytics.upload_deobfuscation_map(zip_file)
 
 
 def parse_arguments():
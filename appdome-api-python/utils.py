@@ -1,15 +1,18 @@
+import hashlib
+import io
 import json
 import logging
 import os
-import shutil
 import tempfile
+import threading
 import zipfile
 from contextlib import contextmanager
-from os import getenv, makedirs, listdir
-from os.path import isdir, dirname, exists, splitext, join, basename
+from glob import glob, escape
+from os import getenv, makedirs
+from os.path import isdir, dirname, exists, basename, getsize
 from shutil import rmtree
 from urllib.parse import urljoin
-import requests
+from metrics import record_response
 
 SERVER_BASE_URL = getenv('APPDOME_SERVER_BASE_URL', 'https://fusion.appdome.com/')
 SERVER_API_V1_URL = urljoin(SERVER_BASE_URL, 'api/v1')
@@ -20,6 +23,17 @@ ACTION_KEY = 'action'
 ANDROID_SIGNING_FINGERPRINT_KEY = 'signing_sha1_fingerprint'
 JSON_CONTENT_TYPE = 'application/json'
 APPDOME_CLIENT_HEADER = getenv('APPDOME_CLIENT_HEADER', 'Appdome-cli-python/1.0')
+API_POOL_SIZE_ENV = 'APPDOME_API_POOL_SIZE'
+UPLOAD_POOL_SIZE_ENV = 'APPDOME_UPLOAD_POOL_SIZE'
+DEFAULT_POOL_SIZE = 10
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+PARTIAL_DOWNLOAD_SUFFIX = '.part'
+CHECKSUM_SUFFIX = '.sha256'
+
+_session = None
+_session_lock = threading.Lock()
+_cert_pinning_bundles = {}
+_cert_pinning_bundles_lock = threading.Lock()
 
 
 @contextmanager
@@ -49,6 +63,62 @@ UPLOAD_URL = build_url(SERVER_API_V1_URL, 'upload')
 BUILD_TO_TEST_URL = build_url(SERVER_API_V1_URL, 'build-to-test')
 
 
+def init_session(api_pool_size=None, upload_pool_size=None):
+    """
+    Create the shared HTTP session used by every API call, replacing any previous one.
+
+    Connections to the Appdome API host and to the upload (S3) host are kept alive in separate pools.
+    The session is safe to share between threads - only its connection pools are mutated per request.
+
+    :param api_pool_size: Max pooled connections to the Appdome API host.
+                          Default is environment variable 'APPDOME_API_POOL_SIZE' or 10
+    :param upload_pool_size: Max pooled connections per upload host.
+                             Default is environment variable 'APPDOME_UPLOAD_POOL_SIZE' or 10
+    :return: The new session
+    """
+    global _session
+    session = _new_session(api_pool_size, upload_pool_size)
+    with _session_lock:
+        old_session, _session = _session, session
+    if old_session:
+        old_session.close()
+    return session
+
+
+def get_session():
+    """
+    Return the shared HTTP session, creating it with the default pool sizes on first use.
+    """
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                _session = _new_session()
+    return _session
+
+
+def _new_session(api_pool_size=None, upload_pool_size=None):
+    # requests is imported on first use, so scripts start fast and fail fast on invalid arguments
+    import requests
+    from requests.adapters import HTTPAdapter
+    from cassette import mount_cassette
+    from rate_limit import RateLimitedAdapter
+    api_pool_size = api_pool_size or int(getenv(API_POOL_SIZE_ENV, DEFAULT_POOL_SIZE))
+    upload_pool_size = upload_pool_size or int(getenv(UPLOAD_POOL_SIZE_ENV, DEFAULT_POOL_SIZE))
+    session = requests.Session()
+    session.hooks['response'].append(record_response)
+    upload_pool = {'pool_connections': upload_pool_size, 'pool_maxsize': upload_pool_size}
+    api_pool = {'pool_connections': 1, 'pool_maxsize': api_pool_size}
+    if not mount_cassette(session, {'https://': upload_pool, 'http://': upload_pool, SERVER_BASE_URL: api_pool}):
+        upload_adapter = HTTPAdapter(**upload_pool)
+        session.mount('https://', upload_adapter)
+        session.mount('http://', upload_adapter)
+        session.mount(SERVER_BASE_URL, HTTPAdapter(**api_pool))
+    # Only Appdome API requests are rate limited, uploads to S3 are not
+    session.mount(SERVER_BASE_URL, RateLimitedAdapter(session.get_adapter(SERVER_BASE_URL)))
+    return session
+
+
 def team_params(team_id):
     params = {}
     if team_id:
@@ -123,7 +193,7 @@ def init_baseline_file(baseline_profile, files):
 
 def init_certs_pinning(cert_pinning_zip):
     """
-    Extracts certificates and JSON mapping from the given zip file.
+    Reads certificates and JSON mapping from the given zip file.
 
     :param cert_pinning_zip: Path to the zip file containing certs and JSON mapping.
     :return: List of files in the required format.
@@ -133,30 +203,51 @@ def init_certs_pinning(cert_pinning_zip):
     if not cert_pinning_zip.endswith('.zip') or not exists(cert_pinning_zip):
         logging.warning("No zip file provided or file does not exist.")
         return []  # Return an empty list if the file is not a valid zip or does not exist
-    files = []
-    with zipfile.ZipFile(cert_pinning_zip, 'r') as zip_ref:
-        extract_path = splitext(cert_pinning_zip)[0] + "_unzipped"  # Extract to a folder with the same name as the zip
-        zip_ref.extractall(extract_path)
+    # Every build gets its own in-memory file objects over the shared certificate contents
+    return [(field_name, (file_name, io.BytesIO(content), 'application/octet-stream'))
+            for field_name, file_name, content in load_cert_pinning_bundle(cert_pinning_zip)]
+
 
-        # Locate the JSON file and parse it
-        json_file = next((f for f in listdir(extract_path) if f.endswith('.json')), None)
+def load_cert_pinning_bundle(cert_pinning_zip):
+    """
+    Reads the certificates listed in the JSON mapping straight from the zip file, without extracting it.
+    The bundle is kept in memory and reused until the zip file changes.
+
+    :param cert_pinning_zip: Path to the zip file containing certs and JSON mapping.
+    :return: Tuple of (field name, file name, content) entries
+    """
+    path = os.path.abspath(cert_pinning_zip)
+    file_stat = os.stat(path)
+    signature = (file_stat.st_mtime_ns, file_stat.st_size)
+    with _cert_pinning_bundles_lock:
+        cached = _cert_pinning_bundles.get(path)
+        if cached and cached[0] == signature:
+            return cached[1]
+
+    bundle = []
+    with zipfile.ZipFile(path, 'r') as zip_ref:
+        names = zip_ref.namelist()
+        # Locate the JSON file at the top level of the zip and parse it
+        json_file = next((name for name in names if name.endswith('.json') and '/' not in name), None)
         if not json_file:
-            logging.error("No JSON file found in the extracted zip contents.")
-            return []  # Return an empty list if no JSON file is found
+            logging.error("No JSON file found in the zip contents.")
+            return ()  # Return an empty bundle if no JSON file is found
 
-        with open(join(extract_path, json_file), 'r') as jf:
-            cert_mapping = json.load(jf)
+        cert_mapping = json.loads(zip_ref.read(json_file))
 
-        # Add cert and pem files to the files list in the required format
+        # Add cert and pem files to the bundle in the required format
         for index, file_name in cert_mapping.items():
-            file_path = join(extract_path, file_name)
-            if exists(file_path):
-                files.append((
+            member = file_name.replace(os.sep, '/')
+            if member in names:
+                bundle.append((
                     f"mitm_host_server_pinned_certs_list['{index}'].value.mitm_host_server_pinned_certs_file_content",
-                    (file_name, open(file_path, 'rb'), 'application/octet-stream')
+                    file_name, zip_ref.read(member)
                 ))
-    shutil.rmtree(extract_path)
-    return files
+    bundle = tuple(bundle)
+    with _cert_pinning_bundles_lock:
+        _cert_pinning_bundles[path] = (signature, bundle)
+    return bundle
+
 
 def run_task_action(api_key, team_id, action, task_id, overrides, files):
     if not files:
@@ -166,17 +257,130 @@ def run_task_action(api_key, team_id, action, task_id, overrides, files):
     params = team_params(team_id)
     body = {ACTION_KEY: action, 'parent_task_id': task_id, OVERRIDES_KEY: json.dumps(overrides)}
     debug_log_request(url, headers=headers, params=params, data=body, files=files)
-    return requests.post(url, headers=headers, params=params, data=body, files=files)
+    return get_session().post(url, headers=headers, params=params, data=body, files=files)
 
 
-def task_output_command(api_key, team_id, task_id, command, action=None):
+def task_output_command(api_key, team_id, task_id, command, action=None, stream=False, offset=0):
     url = build_url(TASKS_URL, task_id, command)
     params = team_params(team_id)
     if action:
         params[ACTION_KEY] = action
     headers = request_headers(api_key, JSON_CONTENT_TYPE)
+    if stream:
+        # Byte ranges must address the stored file, not a compressed representation of it
+        headers['Accept-Encoding'] = 'identity'
+    if offset:
+        headers['Range'] = f'bytes={offset}-'
     debug_log_request(url, headers=headers, params=params, request_type='get')
-    return requests.get(url, headers=headers, params=params)
+    return get_session().get(url, headers=headers, params=params, stream=stream)
+
+
+def download_to_file(request_func, output_path, resume_id=None, num_of_retries=3, allow_not_found=False):
+    """
+    Stream a download into a partial file next to output_path and rename it into place once complete.
+
+    An interrupted transfer is resumed with an HTTP Range request from the bytes already in the partial file.
+    The SHA-256 of the output is computed while writing and saved as '<output_path>.sha256'. Once the output is
+    complete, partial files of other content left next to it by earlier downloads are removed.
+
+    :param request_func: Callable receiving the byte offset to resume from and returning a streamed response
+    :param output_path: Final output file path
+    :param resume_id: Identifies the content (e.g. task id) so a partial file of other content is never resumed
+    :param num_of_retries: Number of attempts before giving up on an interrupted transfer
+    :param allow_not_found: Return None instead of failing when the server answers 404
+    :return: SHA-256 hex digest of the output file
+    """
+    # Imported here like in _new_session, so requests is only loaded by runs that send requests
+    from requests.exceptions import RequestException
+    if resume_id:
+        part_path = f"{output_path}.{resume_id}{PARTIAL_DOWNLOAD_SUFFIX}"
+    else:
+        part_path = output_path + PARTIAL_DOWNLOAD_SUFFIX
+    for i in range(num_of_retries):
+        offset = getsize(part_path) if exists(part_path) else 0
+        if offset:
+            logging.info(f"Resuming download of {output_path} from byte {offset}")
+        try:
+            digest = _write_response_to_part_file(request_func(offset), part_path, offset, allow_not_found)
+        except RequestException as e:
+            logging.debug(f'Download of {output_path} interrupted. Error: {e}')
+            digest = ''
+        if digest is None:
+            return None
+        if digest:
+            break
+    else:
+        log_and_exit(f'Download of {output_path} did not complete after {num_of_retries} attempts')
+
+    os.replace(part_path, output_path)
+    write_sha256_file(output_path, digest)
+    _remove_stale_part_files(output_path)
+    return digest
+
+
+def _remove_stale_part_files(output_path):
+    # Partial files of other task ids can never be resumed into this output
+    resumable_part_paths = glob(f"{escape(output_path)}.*{PARTIAL_DOWNLOAD_SUFFIX}")
+    for part_path in resumable_part_paths + [output_path + PARTIAL_DOWNLOAD_SUFFIX]:
+        try:
+            os.remove(part_path)
+            logging.debug(f"Removed stale partial download {part_path}")
+        except FileNotFoundError:
+            pass
+
+
+def _write_response_to_part_file(response, part_path, offset, allow_not_found):
+    """
+    :return: Hex digest when the file is complete, '' when the transfer was cut short, None when not found
+    """
+    with response:
+        if allow_not_found and response.status_code == 404:
+            return None
+        if offset and response.status_code == 416:
+            # The partial file does not fit the remote file, start over
+            os.remove(part_path)
+            return ''
+        if response.status_code != 206:
+            validate_response(response)
+            offset = 0
+        expected_size = _expected_download_size(response, offset)
+
+        sha256 = hashlib.sha256()
+        with open(part_path, 'r+b' if offset else 'wb') as f:
+            if offset:
+                for chunk in iter(lambda: f.read(DOWNLOAD_CHUNK_SIZE), b''):
+                    sha256.update(chunk)
+            for chunk in response.iter_content(DOWNLOAD_CHUNK_SIZE):
+                f.write(chunk)
+                sha256.update(chunk)
+            size = f.tell()
+    if expected_size is not None and size < expected_size:
+        logging.debug(f'Download cut short at {size} of {expected_size} bytes')
+        return ''
+    return sha256.hexdigest()
+
+
+def _expected_download_size(response, offset):
+    content_range = response.headers.get('Content-Range', '')
+    if response.status_code == 206 and '/' in content_range and not content_range.endswith('*'):
+        return int(content_range.rsplit('/', 1)[1])
+    content_length = response.headers.get('Content-Length')
+    if content_length and not response.headers.get('Content-Encoding'):
+        return offset + int(content_length)
+    return None
+
+
+def file_sha256(file_path):
+    sha256 = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(DOWNLOAD_CHUNK_SIZE), b''):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def write_sha256_file(file_path, digest):
+    with open(file_path + CHECKSUM_SUFFIX, 'w') as f:
+        f.write(f"{digest}  {basename(file_path)}\n")
 
 
 def validate_response(response):
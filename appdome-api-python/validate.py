@@ -1,79 +1,256 @@
 import argparse
+import heapq
+import itertools
+import json
 import logging
-from time import sleep
-
-import requests
+import queue
+import time
+from concurrent.futures import ThreadPoolExecutor
+from glob import glob, has_magic
+from os import getenv
+from os.path import basename, isfile
 
+from CustomMultipartEncoder import CustomMultipartEncoder
+from polling import FixedInterval, add_polling_args, init_polling_strategy
 from utils import (SERVER_API_V1_URL, request_headers, JSON_CONTENT_TYPE, validate_response, add_common_args,
-                   debug_log_request, log_and_exit, init_common_args, build_url)
+                   debug_log_request, log_and_exit, init_common_args, build_url, get_session, init_session,
+                   validate_output_path, API_POOL_SIZE_ENV, DEFAULT_POOL_SIZE)
 
 VALIDATION = 'validation'
+VALIDATION_IN_PROGRESS_STATES = ('pending', 'active')
+DEFAULT_VALIDATION_TIMEOUT_SEC = 3600
+DEFAULT_VALIDATION_CONCURRENCY = 4
 
 
 def validation_upload(api_key, file_path):
     url = build_url(SERVER_API_V1_URL, VALIDATION, 'upload')
     headers = request_headers(api_key)
     with open(file_path, 'rb') as f:
-        files = {'file': (file_path, f)}
-        debug_log_request(url, headers=headers, files=files)
-        return requests.post(url, headers=headers, files=files)
+        # The encoder streams the app from disk while the request is sent
+        encoder = CustomMultipartEncoder({'file': (basename(file_path), f, None)})
+        debug_log_request(url, headers=headers, files={'file': file_path})
+        return get_session().post(url, headers={**headers, 'Content-Type': encoder.content_type}, data=encoder)
 
 
 def validation_status(api_key, validation_id):
     url = build_url(SERVER_API_V1_URL, VALIDATION, validation_id, 'status')
     headers = request_headers(api_key, JSON_CONTENT_TYPE)
-    return requests.get(url, headers=headers)
+    return get_session().get(url, headers=headers)
+
 
+def wait_for_validation_result(api_key, validation_id, timeout_sec=DEFAULT_VALIDATION_TIMEOUT_SEC,
+                               polling_strategy=None):
+    """
+    Poll the status of a validation until it is no longer pending or active.
 
-def wait_for_validation_result(api_key, validation_id, timeout_sec=3600):
-    sleep_time = 10
-    accumulated_sleep = 0
-    status_response = {}
-    while accumulated_sleep <= timeout_sec:
+    :param timeout_sec: Seconds to wait for the result. The last poll is done when they elapsed
+    :param polling_strategy: polling.PollingStrategy. Default is every 10 seconds
+    :return: Last status response
+    """
+    polling_strategy = polling_strategy or FixedInterval()
+    start = time.monotonic()
+    poll_count = 0
+    while True:
         status_response = validation_status(api_key, validation_id)
         validate_response(status_response)
-        status_response_json = status_response.json()
-        validation_state = status_response_json.get('validation_state', '')
-        if validation_state == 'pending' or validation_state == 'active':
-            logging.debug(f'Validation not complete. Sleeping for {sleep_time} seconds')
-            print('.', end='', flush=True)
-            sleep(sleep_time)
-        else:
-            print('', flush=True)
-            break
+        poll_count += 1
+        if status_response.json().get('validation_state', '') not in VALIDATION_IN_PROGRESS_STATES:
+            return status_response
 
-    if accumulated_sleep > timeout_sec:
-        log_and_exit(f"\nValidation did not complete in the specified timeout of: {timeout_sec} seconds")
+        elapsed = time.monotonic() - start
+        if elapsed >= timeout_sec:
+            log_and_exit(f"Validation {validation_id} did not complete in the specified timeout of: "
+                         f"{timeout_sec} seconds")
+        sleep_time = min(polling_strategy.next_delay(poll_count, elapsed, VALIDATION), timeout_sec - elapsed)
+        logging.debug(f'Validation {validation_id} not complete. Sleeping for {sleep_time:.1f} seconds')
+        time.sleep(sleep_time)
 
-    return status_response
 
-
-def validate_app(api_key, file_path):
+def upload_for_validation(api_key, file_path):
+    """
+    :return: Validation id of the uploaded app
+    """
     upload_response = validation_upload(api_key, file_path)
-    logging.info("Upload app for validation done. Waiting for validation result")
+    logging.info(f"Upload of {file_path} for validation done. Waiting for validation result")
     validate_response(upload_response)
-    upload_response_json = upload_response.json()
-    validation_id = upload_response_json.get('id')
+    validation_id = upload_response.json().get('id')
     if not validation_id:
         log_and_exit('Error in upload validation response: ' + upload_response.text)
+    return validation_id
+
+
+def validate_app(api_key, file_path, timeout_sec=DEFAULT_VALIDATION_TIMEOUT_SEC, polling_strategy=None):
+    return wait_for_validation_result(api_key, upload_for_validation(api_key, file_path), timeout_sec,
+                                      polling_strategy)
+
+
+def expand_app_paths(paths):
+    """
+    Expand glob patterns (e.g. "out/*.apk") of the given app paths, keeping their order and dropping duplicates.
+    """
+    expanded = []
+    for path in paths:
+        matches = sorted(glob(path)) if has_magic(path) else [path]
+        if not matches:
+            log_and_exit(f"No app matches [{path}]")
+        expanded.extend(match for match in matches if match not in expanded)
+    for path in expanded:
+        if not isfile(path):
+            log_and_exit(f"App [{path}] doesn't exist")
+    return expanded
+
+
+class _Validation:
+    def __init__(self, file_path):
+        self.result = {'app': file_path}
+        self.start = None
+        self.validation_id = None
+        self.poll_count = 0
+
+    def finish(self, status, **fields):
+        self.result['status'] = status
+        self.result.update(fields)
+        self.result['duration_sec'] = round(time.monotonic() - self.start, 3)
+        if status == 'completed':
+            logging.info(f"Validation of {self.result['app']} done. Output: {fields['response']}")
+        else:
+            logging.error(f"Validation of {self.result['app']} {status.replace('_', ' ')}: {fields['error']}")
+
+
+def _upload_one(api_key, validation, deadline):
+    validation.start = time.monotonic()
+    if validation.start >= deadline:
+        validation.finish('timed_out', error="Timeout elapsed before the upload")
+        return validation
+    try:
+        validation.validation_id = upload_for_validation(api_key, validation.result['app'])
+    except Exception as e:
+        validation.finish('failed', error=str(e))
+    return validation
+
+
+def _poll_one(api_key, validation, deadline, polling_strategy):
+    """
+    :return: Seconds until the next poll of the validation, or None when it is done
+    """
+    try:
+        status_response = validation_status(api_key, validation.validation_id)
+        validate_response(status_response)
+        response_json = status_response.json()
+    except Exception as e:
+        validation.finish('failed', error=str(e))
+        return None
+    validation.poll_count += 1
+    if response_json.get('validation_state', '') not in VALIDATION_IN_PROGRESS_STATES:
+        validation.finish('completed', validation_state=response_json.get('validation_state'), response=response_json)
+        return None
+    now = time.monotonic()
+    if now >= deadline:
+        validation.finish('timed_out', error=f"Validation {validation.validation_id} did not complete in time")
+        return None
+    return min(polling_strategy.next_delay(validation.poll_count, now - validation.start, VALIDATION), deadline - now)
+
+
+def _poll_validations(api_key, uploaded, upload_count, deadline, polling_strategy):
+    """
+    Poll all uploaded validations from the calling thread, each when its polling strategy says, until all are done.
+
+    :param uploaded: Queue of the _Validation of every finished upload
+    :param upload_count: Number of validations put in the queue
+    """
+    scheduled = []
+    sequence = itertools.count()
+    received = 0
+    while received < upload_count or scheduled:
+        wait_sec = max(scheduled[0][0] - time.monotonic(), 0) if scheduled else None
+        if received < upload_count:
+            try:
+                validation = uploaded.get(timeout=wait_sec)
+                received += 1
+                if validation.validation_id:
+                    heapq.heappush(scheduled, (time.monotonic(), next(sequence), validation))
+                continue
+            except queue.Empty:
+                pass
+        else:
+            time.sleep(wait_sec)
+        _, _, validation = heapq.heappop(scheduled)
+        delay = _poll_one(api_key, validation, deadline, polling_strategy)
+        if delay is not None:
+            logging.debug(f'Validation {validation.validation_id} not complete. Next poll in {delay:.1f} seconds')
+            heapq.heappush(scheduled, (time.monotonic() + delay, next(sequence), validation))
+
+
+def validate_apps(api_key, file_paths, concurrency=DEFAULT_VALIDATION_CONCURRENCY,
+                  timeout_sec=DEFAULT_VALIDATION_TIMEOUT_SEC, polling_strategy=None):
+    """
+    Validate many apps at the same time. All validations share one deadline, timeout_sec after the start.
+    Apps are uploaded by up to concurrency threads, and all uploaded validations are polled from one thread.
+    Apps not uploaded yet when the deadline passes are reported as timed out.
+
+    :param concurrency: Max number of apps uploaded at the same time
+    :return: Validation summary
+    """
+    polling_strategy = polling_strategy or FixedInterval()
+    # Let every upload, and the status polls, keep their connection alive
+    init_session(api_pool_size=max(concurrency + 1, int(getenv(API_POOL_SIZE_ENV, DEFAULT_POOL_SIZE))))
+    start = time.monotonic()
+    deadline = start + timeout_sec
+    validations = [_Validation(path) for path in file_paths]
+    uploaded = queue.Queue()
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='validation-upload') as executor:
+        for validation in validations:
+            executor.submit(_upload_one, api_key, validation, deadline).add_done_callback(
+                lambda future: uploaded.put(future.result()))
+        _poll_validations(api_key, uploaded, len(validations), deadline, polling_strategy)
 
-    return wait_for_validation_result(api_key, validation_id)
+    results = [validation.result for validation in validations]
+    statuses = [result['status'] for result in results]
+    return {
+        'total': len(results),
+        'completed': statuses.count('completed'),
+        'failed': statuses.count('failed'),
+        'timed_out': statuses.count('timed_out'),
+        'duration_sec': round(time.monotonic() - start, 3),
+        'results': results
+    }
 
 
 def parse_arguments():
     parser = argparse.ArgumentParser(description='Validate App after local signing')
     add_common_args(parser, add_team_id=False)
-    parser.add_argument('-vl', '--validate_app', required=True, help='Path of app to validate')
+    parser.add_argument('-vl', '--validate_app', required=True, nargs='+', metavar='app_file',
+                        help='Paths or glob patterns (e.g. "out/*.apk") of apps to validate')
+    parser.add_argument('-c', '--concurrency', type=int, default=DEFAULT_VALIDATION_CONCURRENCY, metavar='concurrency',
+                        help=f'Max number of apps uploaded for validation at the same time. '
+                             f'Default is {DEFAULT_VALIDATION_CONCURRENCY}')
+    parser.add_argument('--timeout', type=float, default=DEFAULT_VALIDATION_TIMEOUT_SEC, metavar='seconds',
+                        help=f'Seconds to wait for all validations. Default is {DEFAULT_VALIDATION_TIMEOUT_SEC}')
+    add_polling_args(parser)
+    parser.add_argument('-r', '--report', metavar='report_json_file', help='Output file for the validation summary')
     return parser.parse_args()
 
 
 def main():
     args = parse_arguments()
     init_common_args(args)
+    if args.concurrency < 1:
+        log_and_exit("concurrency must be at least 1")
+    if args.timeout <= 0:
+        log_and_exit("timeout must be positive")
+    validate_output_path(args.report)
+    polling_strategy = init_polling_strategy(args)
 
-    r = validate_app(args.api_key, args.validate_app)
-    validate_response(r)
-    logging.info(f"Validation done. Output: {r.json()}")
+    summary = validate_apps(args.api_key, expand_app_paths(args.validate_app), args.concurrency, args.timeout,
+                            polling_strategy)
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump(summary, f, indent=2)
+        logging.info(f"Validation summary written to {args.report}")
+    logging.info(f"Validation done. {summary['completed']} of {summary['total']} apps validated "
+                 f"in {summary['duration_sec']} seconds")
+    if summary['failed'] or summary['timed_out']:
+        log_and_exit(f"{summary['failed']} of {summary['total']} validations failed, {summary['timed_out']} timed out")
 
 
 if __name__ == '__main__':
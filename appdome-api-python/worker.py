@@ -0,0 +1,373 @@
+import argparse
+import hmac
+import itertools
+import json
+import logging
+import os
+import signal
+import stat
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from os import getenv
+from socketserver import ThreadingMixIn, UnixStreamServer
+
+from appdome_api import create_parser as create_pipeline_parser, run_pipeline, validate_args
+from batch import row_to_argv
+from status import set_status_watcher
+from status_watcher import StatusWatcher
+from utils import (add_common_args, init_common_args, log_and_exit, init_session, API_POOL_SIZE_ENV,
+                   UPLOAD_POOL_SIZE_ENV, DEFAULT_POOL_SIZE)
+
+DEFAULT_PORT = 8765
+WORKER_TOKEN_ENV = 'APPDOME_WORKER_TOKEN'
+DEFAULT_MAX_FINISHED_JOBS = 1000
+MAX_REQUEST_SIZE = 1024 * 1024
+OUTPUT_ARGS = ('output', 'sign_second_output', 'deobfuscation_script_output', 'certificate_output',
+               'certificate_json', 'metrics_json', 'metrics_prometheus')
+
+
+class _JobArgumentParser(argparse.ArgumentParser):
+    # argparse prints usage errors and exits, a job is rejected with the error instead
+    def error(self, message):
+        raise ValueError(f"Invalid arguments: {message}")
+
+
+class WorkerJob:
+    def __init__(self, job_id, args):
+        self.id = job_id
+        self.args = args
+        self.status = 'queued'
+        self.task_id = None
+        self.error = None
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+        self.future = None
+
+    def to_dict(self):
+        # The parsed arguments hold credentials, only the app and the outputs are reported
+        return {
+            'id': self.id,
+            'status': self.status,
+            'app': self.args.app or self.args.app_id,
+            'fusion_set_id': self.args.fusion_set_id,
+            'task_id': self.task_id,
+            'error': self.error,
+            'submitted': self.submitted,
+            'started': self.started,
+            'finished': self.finished,
+            'outputs': {key: getattr(self.args, key) for key in OUTPUT_ARGS if getattr(self.args, key)}
+        }
+
+
+class Worker:
+    """
+    Runs appdome_api.py pipelines submitted as jobs, in a long-running process.
+
+    All jobs share the keep-alive HTTP session and one status watcher thread, and run on a pool of concurrency
+    threads. Submitting a job only parses and validates its arguments, so it returns right away.
+    """
+    def __init__(self, concurrency=4, common_row=None, max_finished_jobs=DEFAULT_MAX_FINISHED_JOBS):
+        """
+        :param concurrency: Max number of pipelines run at the same time
+        :param common_row: Arguments applied to every job, unless the job sets them, e.g. {"api_key": "..."}
+        :param max_finished_jobs: Number of completed and failed jobs kept for status queries
+        """
+        self.concurrency = concurrency
+        self.common_row = common_row or {}
+        self.max_finished_jobs = max_finished_jobs
+        self._jobs = OrderedDict()
+        self._finished_ids = []
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._executor = None
+        self._watcher = None
+
+    def start(self):
+        # Let every concurrent pipeline keep its connections alive
+        init_session(api_pool_size=max(self.concurrency, int(getenv(API_POOL_SIZE_ENV, DEFAULT_POOL_SIZE))),
+                     upload_pool_size=max(self.concurrency, int(getenv(UPLOAD_POOL_SIZE_ENV, DEFAULT_POOL_SIZE))))
+        self._watcher = StatusWatcher()
+        set_status_watcher(self._watcher)
+        self._executor = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='job')
+
+    def stop(self, wait=True):
+        """
+        Stop accepting jobs. Queued jobs are cancelled, running ones are waited for when wait is True.
+        """
+        self._executor.shutdown(wait=wait, cancel_futures=True)
+        set_status_watcher(None)
+        self._watcher.close()
+        with self._lock:
+            for job in self._jobs.values():
+                if job.status == 'queued':
+                    job.status = 'cancelled'
+                    job.finished = time.time()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    def submit(self, job):
+        """
+        Queue a pipeline job.
+
+        :param job: appdome_api.py arguments, as a command line list or a dict of values by argument long name
+                    (like the rows of a batch manifest)
+        :return: WorkerJob
+        """
+        common_argv = row_to_argv(self.common_row)
+        argv = common_argv + ([str(arg) for arg in job] if isinstance(job, list) else row_to_argv(job))
+        try:
+            args = create_pipeline_parser(_JobArgumentParser).parse_args(argv)
+        except SystemExit as e:
+            # e.g. --help, which prints to the worker's output and exits
+            raise ValueError(f"Invalid arguments (exit code {e.code})")
+        try:
+            validate_args(args)
+        except Exception as e:
+            raise ValueError(str(e))
+
+        with self._lock:
+            worker_job = WorkerJob(str(next(self._ids)), args)
+            self._jobs[worker_job.id] = worker_job
+            try:
+                worker_job.future = self._executor.submit(self._run_job, worker_job)
+            except RuntimeError:
+                del self._jobs[worker_job.id]
+                raise RuntimeError("Worker is stopping")
+        logging.info(f"Job {worker_job.id} queued: {worker_job.to_dict()['app']}")
+        return worker_job
+
+    def get_job(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def list_jobs(self):
+        with self._lock:
+            return list(self._jobs.values())
+
+    def cancel(self, job_id):
+        """
+        Cancel a queued job. Running jobs can't be cancelled.
+
+        :return: True when the job was cancelled
+        """
+        job = self.get_job(job_id)
+        if not job or not job.future.cancel():
+            return False
+        self._finish(job, 'cancelled')
+        return True
+
+    def _run_job(self, job):
+        job.status = 'running'
+        job.started = time.time()
+        try:
+            job.task_id = run_pipeline(job.args)
+        except SystemExit as e:
+            self._finish(job, 'failed', f"Exited with code {e.code}")
+        except Exception as e:
+            logging.error(f"Job {job.id} failed: {e}")
+            self._finish(job, 'failed', str(e))
+        else:
+            logging.info(f"Job {job.id} completed. Task id: {job.task_id}")
+            self._finish(job, 'completed')
+
+    def _finish(self, job, status, error=None):
+        job.error = error
+        job.finished = time.time()
+        job.status = status
+        with self._lock:
+            self._finished_ids.append(job.id)
+            while len(self._finished_ids) > self.max_finished_jobs:
+                self._jobs.pop(self._finished_ids.pop(0), None)
+
+    def stats(self):
+        counts = {}
+        for job in self.list_jobs():
+            counts[job.status] = counts.get(job.status, 0) + 1
+        return {'concurrency': self.concurrency, 'jobs': counts}
+
+
+class _WorkerRequestHandler(BaseHTTPRequestHandler):
+    """
+    POST /jobs            submit a job, the body is a JSON list of arguments or an object of arguments
+    GET /jobs             all jobs
+    GET /jobs/<id>        one job
+    DELETE /jobs/<id>     cancel a queued job
+    GET /health           number of jobs by status
+
+    When the server has a token, requests must send it in an "Authorization: Bearer <token>" header.
+    """
+    protocol_version = 'HTTP/1.1'
+
+    @property
+    def worker(self):
+        return self.server.worker
+
+    def log_message(self, format, *args):
+        logging.debug(f"{self.command} {self.path} " + format % args)
+
+    def do_GET(self):
+        if not self._authorized():
+            return
+        parts = self.path.strip('/').split('/')
+        if parts == ['health']:
+            self._send_json(self.worker.stats())
+        elif parts == ['jobs']:
+            self._send_json([job.to_dict() for job in self.worker.list_jobs()])
+        elif len(parts) == 2 and parts[0] == 'jobs':
+            job = self.worker.get_job(parts[1])
+            self._send_json(job.to_dict()) if job else self._send_error(404, f"No job {parts[1]}")
+        else:
+            self._send_error(404, f"Unknown path {self.path}")
+
+    def do_POST(self):
+        if not self._authorized():
+            return
+        if self.path.strip('/') != 'jobs':
+            self._send_error(404, f"Unknown path {self.path}")
+            return
+        size = int(self.headers.get('Content-Length') or 0)
+        if size > MAX_REQUEST_SIZE:
+            self._send_error(413, "Job is too large")
+            return
+        try:
+            job = json.loads(self.rfile.read(size) or b'null')
+            if not isinstance(job, (list, dict)):
+                raise ValueError("Job must be a JSON list or object of appdome_api.py arguments")
+            self._send_json(self.worker.submit(job).to_dict(), 202)
+        except ValueError as e:
+            self._send_error(400, str(e))
+        except RuntimeError as e:
+            # Submitted while the worker stops
+            self._send_error(503, str(e))
+
+    def do_DELETE(self):
+        if not self._authorized():
+            return
+        parts = self.path.strip('/').split('/')
+        if len(parts) != 2 or parts[0] != 'jobs':
+            self._send_error(404, f"Unknown path {self.path}")
+        elif self.worker.cancel(parts[1]):
+            self._send_json(self.worker.get_job(parts[1]).to_dict())
+        else:
+            self._send_error(409, f"Job {parts[1]} doesn't exist or isn't queued")
+
+    def _authorized(self):
+        token = self.server.token
+        if not token or hmac.compare_digest(self.headers.get('Authorization', ''), f"Bearer {token}"):
+            return True
+        # The body of the request isn't read, the connection can't be reused
+        self.close_connection = True
+        self._send_error(401, "Missing or invalid worker token")
+        return False
+
+    def _send_error(self, status_code, message):
+        self._send_json({'error': message}, status_code)
+
+    def _send_json(self, obj, status_code=200):
+        body = json.dumps(obj).encode()
+        self.send_response(status_code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class _UnixHTTPServer(ThreadingMixIn, UnixStreamServer):
+    daemon_threads = True
+
+    def get_request(self):
+        request, _ = super().get_request()
+        # BaseHTTPRequestHandler expects a (host, port) client address
+        return request, ('local', 0)
+
+
+def _remove_socket(socket_path):
+    # Never remove a regular file given as the socket path by mistake
+    try:
+        if not stat.S_ISSOCK(os.lstat(socket_path).st_mode):
+            log_and_exit(f"[{socket_path}] exists and is not a socket")
+    except FileNotFoundError:
+        return
+    os.remove(socket_path)
+
+
+def create_server(worker, host='127.0.0.1', port=DEFAULT_PORT, socket_path=None, token=None):
+    """
+    Create the HTTP server of a worker, listening on a Unix socket when socket_path is set, or on host and port.
+
+    :param token: Token requests must send in their Authorization header. Required to listen on a port
+    """
+    if socket_path:
+        _remove_socket(socket_path)
+        # Jobs run with the credentials of the worker, only its user may submit them. The socket is created with
+        # owner only permissions, a chmod after the bind would leave it open to others meanwhile.
+        umask = os.umask(0o177)
+        try:
+            httpd = _UnixHTTPServer(socket_path, _WorkerRequestHandler)
+        finally:
+            os.umask(umask)
+    else:
+        # Jobs run with the credentials of the worker and any local user can connect to a port, requests must send
+        # the token
+        if not token:
+            log_and_exit(f"Listening on a port requires a worker token in environment variable {WORKER_TOKEN_ENV}. "
+                         f"Set it or listen on a Unix socket with --socket")
+        httpd = ThreadingHTTPServer((host, port), _WorkerRequestHandler)
+        httpd.daemon_threads = True
+    httpd.worker = worker
+    httpd.token = token
+    return httpd
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Runs appdome_api.py jobs submitted over a local socket')
+    add_common_args(parser)
+    listen_group = parser.add_mutually_exclusive_group()
+    listen_group.add_argument('--socket', metavar='socket_path', help='Listen on a Unix socket')
+    listen_group.add_argument('--port', type=int, default=DEFAULT_PORT, metavar='port',
+                              help='Listen on an HTTP port. Requires a token in environment variable '
+                                   f'{WORKER_TOKEN_ENV}. Default is {DEFAULT_PORT}')
+    parser.add_argument('--host', default='127.0.0.1', metavar='host',
+                        help='Address to listen on with --port. Default is 127.0.0.1')
+    parser.add_argument('-c', '--concurrency', type=int, default=4, metavar='concurrency',
+                        help='Max number of jobs run at the same time. Default is 4')
+    parser.add_argument('--max_finished_jobs', type=int, default=DEFAULT_MAX_FINISHED_JOBS, metavar='jobs',
+                        help=f'Number of finished jobs kept for status queries. Default is {DEFAULT_MAX_FINISHED_JOBS}')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_arguments()
+    init_common_args(args)
+    if args.concurrency < 1:
+        log_and_exit("concurrency must be at least 1")
+
+    common_row = {'api_key': args.api_key, 'team_id': args.team_id, 'verbose': args.verbose}
+    with Worker(args.concurrency, common_row, args.max_finished_jobs) as worker:
+        httpd = create_server(worker, args.host, args.port, args.socket, getenv(WORKER_TOKEN_ENV))
+        logging.info(f"Worker listening on {args.socket or f'http://{args.host}:{httpd.server_address[1]}'} "
+                     f"with concurrency {args.concurrency}")
+        # serve_forever returns once shutdown is called from another thread
+        signal.signal(signal.SIGTERM, lambda *_: threading.Thread(target=httpd.shutdown).start())
+        try:
+            httpd.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            logging.info("Worker stopping, waiting for running jobs")
+            httpd.server_close()
+            if args.socket:
+                _remove_socket(args.socket)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,203 @@
+import atexit
+import gzip
+import json
+import logging
+import os
+import threading
+from datetime import datetime, timezone
+
+from utils import log_and_exit
+
+TEXT_FORMAT = 'text'
+JSONL_FORMAT = 'jsonl'
+WORKFLOW_LOG_FORMATS = (TEXT_FORMAT, JSONL_FORMAT)
+DEFAULT_BUFFER_SIZE = 64 * 1024
+DEFAULT_FLUSH_INTERVAL_SEC = 1
+
+_workflow_logs = {}
+_workflow_logs_lock = threading.Lock()
+
+
+class WorkflowLog:
+    """
+    Buffered sink of the workflow messages of tasks, shared by all tasks that write to the same file.
+
+    Messages are kept in memory and written by a background thread every flush_interval_sec, or as soon as
+    buffer_size bytes are buffered. Lines are either the plain message text under an "<operation>:" header,
+    or JSON objects with a timestamp, operation and task id. The file can be gzip compressed, and is rotated to
+    <path>.1 ... <path>.<backup_count> when its size on disk, compressed when compressed, reaches max_bytes.
+    It can exceed max_bytes by one flushed batch.
+    """
+    def __init__(self, path, log_format=TEXT_FORMAT, compress=False, max_bytes=0, backup_count=0,
+                 buffer_size=DEFAULT_BUFFER_SIZE, flush_interval_sec=DEFAULT_FLUSH_INTERVAL_SEC, echo=True):
+        """
+        :param path: Path of the workflow logs file, appended to if it exists
+        :param log_format: 'text' or 'jsonl'
+        :param compress: Write the file gzip compressed
+        :param max_bytes: Rotate the file when its size on disk reaches max_bytes, compressed size when compressed.
+        0 never rotates
+        :param backup_count: Number of rotated files kept
+        :param buffer_size: Buffered bytes that trigger an immediate flush
+        :param flush_interval_sec: Max seconds a message stays buffered
+        :param echo: Also print the messages to stdout
+        """
+        self.path = path
+        self.log_format = log_format
+        self.compress = compress
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.buffer_size = buffer_size
+        self.flush_interval_sec = flush_interval_sec
+        self.echo = echo
+        self._lines = []
+        self._buffered = 0
+        self._file = None
+        self._lock = threading.Lock()
+        self._file_lock = threading.Lock()
+        self._flush_needed = threading.Event()
+        self._closed = False
+        self._flush_thread = threading.Thread(target=self._flush_periodically, name='workflow-log', daemon=True)
+        self._flush_thread.start()
+
+    def start_operation(self, operation, task_id=None):
+        if self.log_format == JSONL_FORMAT:
+            self._append(self._json_line(operation, task_id, event='start'))
+        else:
+            self._append(f"{operation}:\n")
+
+    def write_message(self, message_text, operation=None, task_id=None, creation_time=None):
+        if self.echo:
+            print(f" - {message_text}")
+        if self.log_format == JSONL_FORMAT:
+            self._append(self._json_line(operation, task_id, message=message_text, creation_time=creation_time))
+        else:
+            self._append(message_text + '\n')
+
+    def flush(self):
+        with self._lock:
+            lines, self._lines, self._buffered = self._lines, [], 0
+        if not lines:
+            return
+        # The file lock keeps the order of flushed batches and guards rotation
+        with self._file_lock:
+            if not self._file:
+                self._file = self._open()
+            self._file.write(''.join(lines))
+            self._file.flush()
+            # The size on disk, which for gzip files includes the data flushed so far
+            if self.max_bytes and os.fstat(self._file.fileno()).st_size >= self.max_bytes:
+                self._rotate()
+
+    def close(self):
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+        self._flush_needed.set()
+        self._flush_thread.join()
+        self.flush()
+        with self._file_lock:
+            if self._file:
+                self._file.close()
+                self._file = None
+
+    def _append(self, line):
+        with self._lock:
+            if self._closed:
+                raise ValueError(f"Workflow log {self.path} is closed")
+            self._lines.append(line)
+            self._buffered += len(line)
+            if self._buffered >= self.buffer_size:
+                self._flush_needed.set()
+
+    def _flush_periodically(self):
+        while not self._closed:
+            self._flush_needed.wait(self.flush_interval_sec)
+            self._flush_needed.clear()
+            self.flush()
+
+    def _json_line(self, operation, task_id, **fields):
+        record = {'time': datetime.now(timezone.utc).isoformat(), 'operation': operation, 'task_id': task_id}
+        record.update(fields)
+        return json.dumps(record) + '\n'
+
+    def _open(self):
+        if self.compress:
+            # Every open appends a new gzip member, which gzip readers concatenate
+            return gzip.open(self.path, 'at', encoding='utf-8')
+        return open(self.path, 'a', encoding='utf-8')
+
+    def _rotate(self):
+        if self._file:
+            self._file.close()
+            self._file = None
+        if self.backup_count > 0:
+            for index in range(self.backup_count - 1, 0, -1):
+                if os.path.exists(f"{self.path}.{index}"):
+                    os.replace(f"{self.path}.{index}", f"{self.path}.{index + 1}")
+            if os.path.exists(self.path):
+                os.replace(self.path, f"{self.path}.1")
+        elif os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def open_workflow_log(path, **options):
+    """
+    Return the workflow log of path, opening it with the given WorkflowLog options if it is not open yet.
+    All tasks writing to the same path share one WorkflowLog, so the options of the first caller are used and
+    different options of later callers are logged as a warning.
+    """
+    key = os.path.abspath(path)
+    with _workflow_logs_lock:
+        workflow_log = _workflow_logs.get(key)
+        if not workflow_log:
+            workflow_log = _workflow_logs[key] = WorkflowLog(path, **options)
+            return workflow_log
+    ignored = {name: value for name, value in options.items() if getattr(workflow_log, name) != value}
+    if ignored:
+        opened_with = {name: getattr(workflow_log, name) for name in ignored}
+        logging.warning(f"Workflow log {path} is already open with {opened_with}. Ignoring {ignored}")
+    return workflow_log
+
+
+def close_workflow_logs():
+    """
+    Flush and close all open workflow logs.
+    """
+    with _workflow_logs_lock:
+        workflow_logs = list(_workflow_logs.values())
+        _workflow_logs.clear()
+    for workflow_log in workflow_logs:
+        workflow_log.close()
+
+
+atexit.register(close_workflow_logs)
+
+
+def add_workflow_log_args(parser):
+    parser.add_argument('--workflow_logs_format', choices=WORKFLOW_LOG_FORMATS, default=TEXT_FORMAT,
+                        help='Workflow output logs format: plain text, or JSON lines with time, operation and task id. '
+                             'Default is text')
+    parser.add_argument('--workflow_logs_compress', action='store_true',
+                        help='Write the workflow output logs file gzip compressed')
+    parser.add_argument('--workflow_logs_max_size', type=float, default=0, metavar='MB',
+                        help='Rotate the workflow output logs file when its size on disk reaches this size in MB, '
+                             'the compressed size with --workflow_logs_compress. Default is no rotation')
+    parser.add_argument('--workflow_logs_backups', type=int, default=3, metavar='count',
+                        help='Number of rotated workflow output logs files to keep. Default is 3')
+    parser.add_argument('--workflow_logs_quiet', action='store_true',
+                        help="Don't print workflow messages to the console")
+
+
+def init_workflow_log(args):
+    """
+    Open the workflow log of args.workflow_output_logs with the workflow log arguments.
+    """
+    if not args.workflow_output_logs:
+        return None
+    if args.workflow_logs_max_size < 0 or args.workflow_logs_backups < 0:
+        log_and_exit("workflow_logs_max_size and workflow_logs_backups can't be negative")
+    return open_workflow_log(args.workflow_output_logs, log_format=args.workflow_logs_format,
+                             compress=args.workflow_logs_compress,
+                             max_bytes=int(args.workflow_logs_max_size * 1024 * 1024),
+                             backup_count=args.workflow_logs_backups, echo=not args.workflow_logs_quiet)